@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks do caminho quente por arquivo do SCU
+Mede cada etapa isolada (leitura do cabeçalho por tipo de arquivo,
+quarentena, pasta do estudo, leitura/gravação no catálogo) e a etapa
+organize completa (send_and_organize: reserva, cabeçalho, roteamento, pasta
+do estudo e entrega no catálogo) contra catálogos de 1k, 10k e 100k estudos.
+Os metadados JSON por estudo (load_metadata/save_metadata) foram
+substituídos pelo catálogo SQLite: get_study e record_instances ocupam o lugar.
+
+Tudo roda numa pasta temporária; o resultado vai para um JSON comparável
+entre execuções (benchmarks/results/ por padrão).
+
+Uso:
+    python benchmarks/bench_hotpath.py [--quick] [--catalog-sizes 1000 10000 100000]
+    python benchmarks/bench_hotpath.py --compare antes.json depois.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from contextlib import redirect_stdout
+from datetime import datetime
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+RESULTS_FOLDER = REPO_ROOT / "benchmarks" / "results"
+
+# Piora acima disto (mediana) é destacada na comparação
+REGRESSION_THRESHOLD = 0.10
+
+
+def summarize(samples):
+    """Estatísticas de uma lista de durações (s)"""
+    ordered = sorted(samples)
+    total = sum(ordered)
+    return {
+        'n': len(ordered),
+        'mean_ms': statistics.fmean(ordered) * 1000,
+        'median_ms': statistics.median(ordered) * 1000,
+        'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        'min_ms': ordered[0] * 1000,
+        'max_ms': ordered[-1] * 1000,
+        'ops_per_s': len(ordered) / total if total else None,
+    }
+
+
+def measure(fn, inputs):
+    """Chama fn(item) para cada item e devolve as durações (setup fora da medida)"""
+    samples = []
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        for item in inputs:
+            started = time.perf_counter()
+            fn(item)
+            samples.append(time.perf_counter() - started)
+    return samples
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def populate_catalog(catalog, target, instances_per_study):
+    """Completa o catálogo até `target` estudos sintéticos (SQL direto, sem pastas)"""
+    current = catalog._connect().execute("SELECT COUNT(*) FROM studies").fetchone()[0]
+    batch = 5000
+    while current < target:
+        count = min(batch, target - current)
+        studies, instances, deliveries = [], [], []
+        for idx in range(current, current + count):
+            study_uid = f"2.25.9{idx:012d}"
+            studies.append((study_uid, f"20240101_000000_P{idx}_BENCH", f"P{idx}",
+                            "BENCH", "20240101", "000000", "CT", "CATALOGO",
+                            "20240101_000000", instances_per_study, 1))
+            for inst in range(instances_per_study):
+                sop_uid = f"{study_uid}.{inst}"
+                instances.append((sop_uid, study_uid, f"{study_uid}.1", "1.2.840.10008.5.1.4.1.1.2",
+                                  "1.2.840.10008.1.2.1", inst + 1, f"CT.{sop_uid}.dcm", 525000,
+                                  "20240101_000000", 1))
+                deliveries.append((sop_uid, "default", 1))
+        with catalog.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO studies (study_uid, folder, patient_id, patient_name, study_date, "
+                "study_time, modality, study_description, created_at, image_count, sent) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", studies)
+            conn.executemany(
+                "INSERT INTO instances (sop_instance_uid, study_uid, series_uid, sop_class_uid, "
+                "transfer_syntax, instance_number, filename, size_bytes, received_at, sent) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", instances)
+            conn.executemany(
+                "INSERT INTO deliveries (sop_instance_uid, destination, sent) VALUES (?, ?, ?)",
+                deliveries)
+        current += count
+    return current
+
+
+class Fixtures:
+    """Cópias únicas (novo SOP Instance UID) dos arquivos do corpus na raiz"""
+
+    def __init__(self, root, corpus):
+        from pydicom import dcmread
+        from pydicom.uid import generate_uid
+        self._generate_uid = generate_uid
+        self.root = Path(root)
+        self.datasets = {
+            kind: [dcmread(path) for path in paths] for kind, paths in corpus.items()
+        }
+        self._counter = 0
+
+    def fresh_files(self, kind, count, folder=None):
+        """`count` arquivos novos do tipo `kind` (rodízio sobre o corpus)"""
+        folder = Path(folder or self.root)
+        datasets = self.datasets[kind]
+        paths = []
+        for idx in range(count):
+            ds = datasets[idx % len(datasets)]
+            uid = self._generate_uid()
+            ds.SOPInstanceUID = uid
+            ds.file_meta.MediaStorageSOPInstanceUID = uid
+            self._counter += 1
+            path = folder / f"bench_{kind}_{self._counter:07d}.dcm"
+            ds.save_as(path, enforce_file_format=True)
+            paths.append(path)
+        return paths
+
+
+def run(args):
+    workdir = Path(tempfile.mkdtemp(prefix="dicom-bench-"))
+    root = workdir / "dicom"
+    root.mkdir()
+    # Configuração antes de importar o SCU (módulo lê o ambiente na importação)
+    os.environ["DICOM_ROOT"] = str(root)
+    os.environ["HEADER_WORKERS"] = "1"
+    os.environ.setdefault("ROUTING_RULES_FILE", str(root / "routing_rules.json"))
+    sys.path[:0] = [str(REPO_ROOT / "common"), str(REPO_ROOT / "scu"), str(REPO_ROOT / "benchmarks")]
+
+    from corpus import build_corpus
+    from dicom_header import summarize_dicom_file
+    import scu_script
+
+    results = {}
+
+    def record(name, samples):
+        results[name] = summarize(samples)
+        stats = results[name]
+        print(f"  {name:<44} mediana {stats['median_ms']:8.3f} ms | "
+              f"p95 {stats['p95_ms']:8.3f} ms | {stats['ops_per_s'] or 0:9.1f} ops/s", file=sys.stderr)
+
+    try:
+        print(f"📁 Gerando corpus em {workdir}...", file=sys.stderr)
+        corpus = build_corpus(workdir / "corpus", ct_series=1, ct_slices=args.ct_slices,
+                              ct_size=args.ct_size, us_frames=args.us_frames,
+                              sr_count=10, nopix_count=10)
+        fixtures = Fixtures(root, corpus)
+        scu_script.CLAIM_FOLDER.mkdir(parents=True, exist_ok=True)
+        keywords = scu_script.ROUTER.keywords
+
+        print("⏱ Etapas isoladas", file=sys.stderr)
+        for kind, paths in corpus.items():
+            inputs = [paths[idx % len(paths)] for idx in range(args.repeat)]
+            record(f"header.summarize.{kind}",
+                   measure(lambda path: summarize_dicom_file(path, keywords), inputs))
+
+        staging = workdir / "staging"
+        staging.mkdir()
+        record("quarantine.no_pixels", measure(
+            lambda path: scu_script.quarantine_invalid_dicom(path, "benchmark"),
+            fixtures.fresh_files("no_pixels", args.repeat, staging),
+        ))
+
+        catalog = scu_script.CATALOG
+        for size in sorted(args.catalog_sizes):
+            print(f"📚 Catálogo com {size} estudos", file=sys.stderr)
+            populate_catalog(catalog, size, args.instances_per_study)
+            existing = [f"2.25.9{random.randrange(size):012d}" for _ in range(args.repeat)]
+
+            record(f"catalog.get_study.{size}", measure(catalog.get_study, existing))
+            record(f"study_folder.existing.{size}", measure(
+                scu_script.get_or_create_study_folder,
+                [{'study_uid': uid, 'patient_id': 'X', 'patient_name': 'X'} for uid in existing],
+            ))
+            new_studies = [
+                {'study_uid': f"2.25.8{size:07d}{idx:06d}", 'patient_id': f"N{idx}",
+                 'patient_name': "NOVO", 'study_date': "20240601", 'modality': "CT"}
+                for idx in range(args.repeat)
+            ]
+            record(f"study_folder.new.{size}",
+                   measure(scu_script.get_or_create_study_folder, new_studies))
+            record(f"catalog.record_instances.{size}", measure(
+                lambda item: catalog.record_instances(item[0], [item[1]]),
+                [(uid, {'sop_instance_uid': f"{uid}.b{size}.{idx}", 'series_uid': f"{uid}.1",
+                        'sop_class_uid': "1.2.840.10008.5.1.4.1.1.2",
+                        'transfer_syntax': "1.2.840.10008.1.2.1", 'instance_number': idx,
+                        'filename': f"B{idx}.dcm", 'size_bytes': 525000})
+                 for idx, uid in enumerate(existing)],
+            ))
+            for kind in corpus:
+                count = max(1, args.repeat // 10) if kind == "us_multiframe" else args.repeat
+                record(f"organize.{kind}.{size}",
+                       measure(scu_script.send_and_organize, fixtures.fresh_files(kind, count)))
+    finally:
+        scu_script_module = sys.modules.get("scu_script")
+        if scu_script_module is not None:
+            scu_script_module.HEADER_PARSER.shutdown()
+        if args.keep:
+            print(f"📁 Pasta de trabalho mantida: {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    import pydicom
+    return {
+        'meta': {
+            'benchmark': "hotpath",
+            'timestamp': datetime.now().isoformat(timespec="seconds"),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'pydicom': pydicom.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': {key: str(value) if isinstance(value, Path) else value
+                     for key, value in vars(args).items() if key != "compare"},
+        },
+        'results': results,
+    }
+
+
+def compare(old_path, new_path):
+    """Mediana antes x depois de cada benchmark presente nos dois arquivos"""
+    with open(old_path) as f:
+        old = json.load(f)['results']
+    with open(new_path) as f:
+        new = json.load(f)['results']
+    regressions = 0
+    print(f"{'benchmark':<44} {'antes (ms)':>11} {'depois (ms)':>12} {'variação':>9}")
+    for name in sorted(set(old) & set(new)):
+        before, after = old[name]['median_ms'], new[name]['median_ms']
+        change = (after - before) / before if before else 0.0
+        flag = ""
+        if change > REGRESSION_THRESHOLD:
+            flag = " ⚠"
+            regressions += 1
+        print(f"{name:<44} {before:11.3f} {after:12.3f} {change * 100:+8.1f}%{flag}")
+    for name in sorted(set(old) ^ set(new)):
+        print(f"{name:<44} (só em {'antes' if name in old else 'depois'})")
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks do caminho quente do SCU")
+    parser.add_argument("--catalog-sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--instances-per-study", type=int, default=5,
+                        help="instâncias sintéticas por estudo no catálogo")
+    parser.add_argument("--repeat", type=int, default=200, help="operações por benchmark")
+    parser.add_argument("--ct-slices", type=int, default=32)
+    parser.add_argument("--ct-size", type=int, default=512)
+    parser.add_argument("--us-frames", type=int, default=60)
+    parser.add_argument("--quick", action="store_true",
+                        help="rodada curta (catálogos de 1k/10k, 30 operações)")
+    parser.add_argument("--output", type=Path, help="arquivo JSON do resultado")
+    parser.add_argument("--keep", action="store_true", help="mantém a pasta temporária")
+    parser.add_argument("--compare", nargs=2, type=Path, metavar=("ANTES", "DEPOIS"))
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare(*args.compare)
+    if args.quick:
+        args.catalog_sizes = [size for size in args.catalog_sizes if size <= 10000] or [1000]
+        args.repeat = min(args.repeat, 30)
+        args.us_frames = min(args.us_frames, 20)
+
+    report = run(args)
+    output = args.output or RESULTS_FOLDER / f"hotpath_{datetime.now():%Y%m%d_%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Resultado gravado em {output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Corpora DICOM sintéticos para benchmarks e testes de carga
+Gera, sem dados de paciente reais:
+  - séries CT (int16, opcionalmente comprimidas sem perdas)
+  - ultrassom multiframe grande (RGB)
+  - SR (documento estruturado, sem pixel data)
+  - imagens sem PixelData (vão para a quarentena)
+
+Uso:
+    python benchmarks/corpus.py PASTA [--ct-series 2] [--ct-slices 64] [...]
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, ImplicitVRLittleEndian, generate_uid
+
+CT_IMAGE_STORAGE = "1.2.840.10008.5.1.4.1.1.2"
+US_MULTIFRAME_STORAGE = "1.2.840.10008.5.1.4.1.1.3.1"
+BASIC_TEXT_SR_STORAGE = "1.2.840.10008.5.1.4.1.1.88.11"
+
+# Gerador fixo: o mesmo corpus em todas as execuções (comparáveis)
+_RNG = np.random.default_rng(20240601)
+
+
+def _base_dataset(sop_class, study_uid, series_uid, modality, patient_id, instance_number):
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = sop_class
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID = sop_class
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.StudyInstanceUID = study_uid
+    ds.SeriesInstanceUID = series_uid
+    ds.PatientID = patient_id
+    ds.PatientName = f"BENCH^{patient_id}"
+    ds.StudyDate = "20240601"
+    ds.StudyTime = "120000"
+    ds.StudyDescription = "BENCHMARK"
+    ds.Modality = modality
+    ds.SeriesNumber = 1
+    ds.InstanceNumber = instance_number
+    return ds
+
+
+def _ct_pixels(rows, cols, z):
+    """Fatia com estrutura (círculo + ruído leve): comprime como CT real"""
+    yy, xx = np.mgrid[:rows, :cols]
+    body = ((yy - rows / 2) ** 2 + (xx - cols / 2) ** 2) < (min(rows, cols) * 0.42) ** 2
+    pixels = np.where(body, 40 + (z % 50), -1000).astype(np.int16)
+    noise = _RNG.integers(-20, 20, size=(rows, cols), dtype=np.int16)
+    return (pixels + np.where(body, noise, 0)).astype(np.int16)
+
+
+def make_ct_series(folder, slices=64, rows=512, cols=512, study_uid=None,
+                   patient_id="BENCH001", transfer_syntax=None, prefix="CT"):
+    """
+    Uma série CT em `folder`; `transfer_syntax`: Implicit/Explicit VR Little
+    Endian, um UID sem perdas (RLE, JPEG-LS...) ou None (Explicit)
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    study_uid = study_uid or generate_uid()
+    series_uid = generate_uid()
+    paths = []
+    for idx in range(slices):
+        ds = _base_dataset(CT_IMAGE_STORAGE, study_uid, series_uid, "CT", patient_id, idx + 1)
+        ds.ImagePositionPatient = [0.0, 0.0, float(idx)]
+        ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        ds.PixelSpacing = [0.7, 0.7]
+        ds.SliceThickness = 1.0
+        ds.Rows, ds.Columns = rows, cols
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = "MONOCHROME2"
+        ds.BitsAllocated = 16
+        ds.BitsStored = 16
+        ds.HighBit = 15
+        ds.PixelRepresentation = 1
+        ds.RescaleIntercept = 0
+        ds.RescaleSlope = 1
+        ds.WindowCenter = 40
+        ds.WindowWidth = 400
+        ds.PixelData = _ct_pixels(rows, cols, idx).tobytes()
+        if transfer_syntax == ImplicitVRLittleEndian:
+            ds.file_meta.TransferSyntaxUID = ImplicitVRLittleEndian
+        elif transfer_syntax and transfer_syntax != ExplicitVRLittleEndian:
+            ds.compress(transfer_syntax, generate_instance_uid=False)
+        path = folder / f"{prefix}_{series_uid[-8:]}_{idx:04d}.dcm"
+        ds.save_as(path, enforce_file_format=True)
+        paths.append(path)
+    return paths
+
+
+def make_us_multiframe(folder, frames=60, rows=480, cols=640, study_uid=None,
+                       patient_id="BENCH002"):
+    """Cine de ultrassom RGB multiframe (arquivo grande, um só)"""
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    ds = _base_dataset(US_MULTIFRAME_STORAGE, study_uid or generate_uid(), generate_uid(),
+                       "US", patient_id, 1)
+    ds.Rows, ds.Columns = rows, cols
+    ds.NumberOfFrames = frames
+    ds.SamplesPerPixel = 3
+    ds.PhotometricInterpretation = "RGB"
+    ds.PlanarConfiguration = 0
+    ds.BitsAllocated = 8
+    ds.BitsStored = 8
+    ds.HighBit = 7
+    ds.PixelRepresentation = 0
+    ds.FrameTime = 33.3
+    ds.PixelData = _RNG.integers(0, 255, size=(frames, rows, cols, 3), dtype=np.uint8).tobytes()
+    path = folder / f"US_{ds.SOPInstanceUID[-8:]}.dcm"
+    ds.save_as(path, enforce_file_format=True)
+    return [path]
+
+
+def make_sr(folder, count=10, study_uid=None, patient_id="BENCH003"):
+    """Documentos SR (não imagem): passam na validação sem pixel data"""
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    study_uid = study_uid or generate_uid()
+    series_uid = generate_uid()
+    paths = []
+    for idx in range(count):
+        ds = _base_dataset(BASIC_TEXT_SR_STORAGE, study_uid, series_uid, "SR", patient_id, idx + 1)
+        ds.ValueType = "CONTAINER"
+        ds.ContinuityOfContent = "SEPARATE"
+        ds.CompletionFlag = "COMPLETE"
+        ds.VerificationFlag = "UNVERIFIED"
+        item = Dataset()
+        item.RelationshipType = "CONTAINS"
+        item.ValueType = "TEXT"
+        item.TextValue = "Laudo sintético para benchmark. " * 20
+        ds.ContentSequence = [item]
+        path = folder / f"SR_{series_uid[-8:]}_{idx:04d}.dcm"
+        ds.save_as(path, enforce_file_format=True)
+        paths.append(path)
+    return paths
+
+
+def make_missing_pixels(folder, count=10, rows=512, cols=512, patient_id="BENCH004"):
+    """Imagens CT com Rows/Columns mas sem PixelData (quarentena)"""
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    study_uid = generate_uid()
+    series_uid = generate_uid()
+    paths = []
+    for idx in range(count):
+        ds = _base_dataset(CT_IMAGE_STORAGE, study_uid, series_uid, "CT", patient_id, idx + 1)
+        ds.Rows, ds.Columns = rows, cols
+        ds.BitsAllocated = 16
+        path = folder / f"NOPIX_{series_uid[-8:]}_{idx:04d}.dcm"
+        ds.save_as(path, enforce_file_format=True)
+        paths.append(path)
+    return paths
+
+
+def build_corpus(folder, ct_series=2, ct_slices=64, ct_size=512, us_frames=60,
+                 sr_count=10, nopix_count=10):
+    """Corpus completo em subpastas de `folder`; retorna {tipo: [caminhos]}"""
+    folder = Path(folder)
+    corpus = {'ct': []}
+    for idx in range(ct_series):
+        corpus['ct'] += make_ct_series(folder / "ct", slices=ct_slices, rows=ct_size,
+                                       cols=ct_size, patient_id=f"BENCH{idx:03d}")
+    corpus['us_multiframe'] = make_us_multiframe(folder / "us", frames=us_frames)
+    corpus['sr'] = make_sr(folder / "sr", count=sr_count)
+    corpus['no_pixels'] = make_missing_pixels(folder / "nopix", count=nopix_count)
+    return corpus
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera um corpus DICOM sintético")
+    parser.add_argument("folder", type=Path)
+    parser.add_argument("--ct-series", type=int, default=2)
+    parser.add_argument("--ct-slices", type=int, default=64)
+    parser.add_argument("--ct-size", type=int, default=512)
+    parser.add_argument("--us-frames", type=int, default=60)
+    parser.add_argument("--sr", type=int, default=10)
+    parser.add_argument("--no-pixels", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    corpus = build_corpus(args.folder, args.ct_series, args.ct_slices, args.ct_size,
+                          args.us_frames, args.sr, args.no_pixels)
+    for kind, paths in corpus.items():
+        size = sum(p.stat().st_size for p in paths) / 1e6
+        print(f"📁 {kind}: {len(paths)} arquivo(s), {size:.1f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,567 @@
+#!/usr/bin/env python3
+"""
+Teste de carga ponta a ponta (C-STORE) numa só máquina
+Sobe o roteador (SCP + SCU, como no docker-compose) numa pasta temporária,
+um destino substituto (SCP local que só anota a chegada) e inunda o SCP do
+roteador com associações simultâneas, estudos de tamanhos e transfer
+syntaxes configuráveis, em degraus de taxa (instâncias/s).
+
+Por degrau e no total: instâncias/s aceitas pelo roteador e entregues ao
+destino, latência p50/p99 da recepção (C-STORE confirmado ao "modality")
+até a chegada no destino e a inclinação do backlog (recebidas - entregues).
+O primeiro degrau em que o backlog cresce é o ponto de saturação; a maior
+taxa entregue antes dele é a capacidade sustentada.
+
+Uso:
+    python benchmarks/load_test.py [--rates 10 25 50 100] [--step-seconds 30]
+        [--associations 4] [--study-sizes 20 100] [--transfer-syntaxes explicit rle]
+        [--receiver native|storescp] [--env SCU_WORKERS=8 ...]
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import shutil
+import signal
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from datetime import datetime
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+RESULTS_FOLDER = REPO_ROOT / "benchmarks" / "results"
+
+# Backlog crescendo mais que isto (fração da taxa aceita, mín. 1 inst/s) satura
+GROWTH_RATIO = 0.05
+
+# Nomes aceitos em --transfer-syntaxes
+TRANSFER_SYNTAXES = {
+    "implicit": "1.2.840.10008.1.2",
+    "explicit": "1.2.840.10008.1.2.1",
+    "rle": "1.2.840.10008.1.2.5",
+    "jpeg-ls": "1.2.840.10008.1.2.4.80",
+    "j2k": "1.2.840.10008.1.2.4.90",
+}
+CT_IMAGE_STORAGE = "1.2.840.10008.5.1.4.1.1.2"
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_destination(port, aet, log_path):
+    """Destino substituto: aceita tudo e anota "SOP<TAB>epoch" por instância"""
+    from pynetdicom import AE, ALL_TRANSFER_SYNTAXES, AllStoragePresentationContexts, evt, _config
+    from pynetdicom.sop_class import Verification
+
+    _config.UNRESTRICTED_STORAGE_SERVICE = True
+    log = open(log_path, 'a', buffering=1)
+    lock = threading.Lock()
+
+    def handle_store(event):
+        line = f"{event.request.AffectedSOPInstanceUID}\t{time.time():.6f}\n"
+        with lock:
+            log.write(line)
+        return 0x0000
+
+    ae = AE(ae_title=aet)
+    for context in AllStoragePresentationContexts:
+        ae.add_supported_context(context.abstract_syntax, ALL_TRANSFER_SYNTAXES)
+    ae.add_supported_context(Verification)
+    ae.maximum_associations = 64
+    signal.signal(signal.SIGTERM, lambda *_: os._exit(0))
+    ae.start_server(("127.0.0.1", port), block=True,
+                    evt_handlers=[(evt.EVT_C_STORE, handle_store)])
+
+
+def wait_for_echo(port, aet, timeout=30.0):
+    """Espera o SCP responder ao C-ECHO"""
+    from pynetdicom import AE
+    from pynetdicom.sop_class import Verification
+
+    ae = AE(ae_title="LOADTEST")
+    ae.add_requested_context(Verification)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        assoc = ae.associate("127.0.0.1", port, ae_title=aet)
+        if assoc.is_established:
+            status = assoc.send_c_echo()
+            assoc.release()
+            if status and status.Status == 0x0000:
+                return True
+        time.sleep(0.5)
+    return False
+
+
+class Pacer:
+    """Limita a taxa total de C-STOREs entre as associações (0 = sem limite)"""
+
+    def __init__(self):
+        self.rate = 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self.rate = rate
+            self._next = time.monotonic()
+
+    def wait(self):
+        with self._lock:
+            if not self.rate:
+                return
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + 1.0 / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Generator:
+    """
+    Modalities simuladas: cada thread abre uma associação por estudo e envia
+    as fatias em sequência (UIDs novos a cada estudo e instância)
+    """
+
+    def __init__(self, templates, study_sizes, associations, port, aet, pacer):
+        self.templates = templates  # {nome da syntax: [Dataset]}
+        self.study_sizes = study_sizes
+        self.associations = associations
+        self.port = port
+        self.aet = aet
+        self.pacer = pacer
+        self.acked = {}  # SOP -> epoch da confirmação do roteador
+        self.failures = 0
+        self.studies = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for idx in range(self.associations):
+            thread = threading.Thread(target=self._sender, args=(idx,), name=f"modality-{idx}",
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=30.0):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def acked_count(self):
+        with self._lock:
+            return len(self.acked)
+
+    def _sender(self, idx):
+        from pydicom.uid import generate_uid
+        from pynetdicom import AE
+
+        ae = AE(ae_title=f"LOAD{idx:02d}")
+        for syntax_name in self.templates:
+            ae.add_requested_context(CT_IMAGE_STORAGE, TRANSFER_SYNTAXES[syntax_name])
+        templates = {name: [copy.deepcopy(ds) for ds in datasets]
+                     for name, datasets in self.templates.items()}
+        names = list(templates)
+        study = idx
+        while not self._stop.is_set():
+            syntax_name = names[study % len(names)]
+            size = self.study_sizes[study % len(self.study_sizes)]
+            study += self.associations
+            datasets = templates[syntax_name]
+            assoc = ae.associate("127.0.0.1", self.port, ae_title=self.aet)
+            if not assoc.is_established:
+                with self._lock:
+                    self.failures += 1
+                time.sleep(1.0)
+                continue
+            study_uid, series_uid = generate_uid(), generate_uid()
+            try:
+                for number in range(size):
+                    if self._stop.is_set():
+                        break
+                    self.pacer.wait()
+                    ds = datasets[number % len(datasets)]
+                    sop_uid = generate_uid()
+                    ds.StudyInstanceUID = study_uid
+                    ds.SeriesInstanceUID = series_uid
+                    ds.SOPInstanceUID = sop_uid
+                    ds.file_meta.MediaStorageSOPInstanceUID = sop_uid
+                    ds.PatientID = f"LOAD{study:06d}"
+                    ds.InstanceNumber = number + 1
+                    ds.ImagePositionPatient = [0.0, 0.0, float(number)]
+                    status = assoc.send_c_store(ds)
+                    acked_at = time.time()
+                    with self._lock:
+                        if status and status.Status in (0x0000, 0xB000, 0xB007, 0xB006):
+                            self.acked[sop_uid] = acked_at
+                        else:
+                            self.failures += 1
+                    if not assoc.is_established:
+                        break
+                with self._lock:
+                    self.studies += 1
+            finally:
+                if assoc.is_established:
+                    assoc.release()
+
+
+class DeliveryLog:
+    """Lê incrementalmente o arquivo do destino substituto"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.delivered = {}  # SOP -> epoch da chegada ao destino
+        self._offset = 0
+        self._partial = ""
+
+    def poll(self):
+        if not self.path.exists():
+            return len(self.delivered)
+        with open(self.path, 'r') as f:
+            f.seek(self._offset)
+            chunk = f.read()
+            self._offset = f.tell()
+        lines = (self._partial + chunk).split("\n")
+        self._partial = lines.pop()
+        for line in lines:
+            sop_uid, _, stamp = line.partition("\t")
+            # Reenvio do mesmo SOP: vale a primeira chegada
+            self.delivered.setdefault(sop_uid, float(stamp))
+        return len(self.delivered)
+
+
+def build_templates(workdir, syntax_names, slices, size):
+    """Fatias CT de modelo por transfer syntax (a série é reaproveitada em rodízio)"""
+    from pydicom import dcmread
+    from corpus import make_ct_series
+
+    templates = {}
+    for name in syntax_names:
+        try:
+            paths = make_ct_series(workdir / "templates" / name, slices=slices, rows=size,
+                                   cols=size, transfer_syntax=TRANSFER_SYNTAXES[name],
+                                   prefix=name.upper())
+        except Exception as e:
+            raise SystemExit(f"❌ Não foi possível gerar instâncias {name}: {e}")
+        templates[name] = [dcmread(path) for path in paths]
+    return templates
+
+
+def start_router(args, root, logs, env_overrides):
+    """SCP (nativo ou storescp/receive.sh) + SCU apontando para o destino substituto"""
+    env = dict(
+        os.environ,
+        DICOM_ROOT=str(root),
+        ROUTING_RULES_FILE=str(root / "routing_rules.json"),
+        PYTHONPATH=os.pathsep.join([str(REPO_ROOT / "common"),
+                                    os.environ.get("PYTHONPATH", "")]).rstrip(os.pathsep),
+        PYTHONUNBUFFERED="1",
+        SCP_PORT=str(args.router_port),
+        SCP_AET=args.router_aet,
+        SCP_WORKERS=str(args.scp_workers),
+        SCP_CUT_THROUGH="1" if args.cut_through else "0",
+        TARGET_HOST="127.0.0.1",
+        TARGET_PORT=str(args.destination_port),
+        TARGET_AET=args.destination_aet,
+        METRICS_PORT="0",
+        # Falhas do destino substituto voltam logo (teste curto)
+        RETRY_BASE_DELAY="2",
+        RETRY_MAX_DELAY="10",
+        WATCH_RESCAN_MIN_AGE="1",
+    )
+    env.update(env_overrides)
+
+    if args.receiver == "native":
+        scp_cmd = [sys.executable, str(REPO_ROOT / "scp" / "storage_scp.py")]
+    else:
+        help_text = subprocess.run(["storescp", "--help"], capture_output=True, text=True).stdout
+        if "exec-on-reception" not in help_text:
+            raise SystemExit("❌ --receiver storescp exige o storescp do DCMTK no PATH")
+        scp_cmd = ["bash", str(REPO_ROOT / "scp" / "receive.sh")]
+    scu_cmd = [sys.executable, str(REPO_ROOT / "scu" / "scu_script.py")]
+
+    processes = {}
+    for name, cmd in (("scp", scp_cmd), ("scu", scu_cmd)):
+        log = open(logs / f"{name}.log", 'w')
+        processes[name] = subprocess.Popen(cmd, env=env, stdout=log, stderr=subprocess.STDOUT,
+                                           cwd=root)
+    return processes
+
+
+def stop_processes(processes, timeout=20.0):
+    for process in processes.values():
+        if process.poll() is None:
+            process.send_signal(signal.SIGTERM)
+    deadline = time.monotonic() + timeout
+    for process in processes.values():
+        try:
+            process.wait(max(0.1, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def step_summary(rate, samples, generator, deliveries, started, ended):
+    """Taxas, latência e inclinação do backlog de um degrau"""
+    duration = samples[-1]['t'] - samples[0]['t']
+    accepted = samples[-1]['acked'] - samples[0]['acked']
+    delivered = samples[-1]['delivered'] - samples[0]['delivered']
+    accepted_rate = accepted / duration if duration else 0.0
+    # Inclinação (mínimos quadrados) do backlog ao longo do degrau
+    n = len(samples)
+    mean_t = sum(s['t'] for s in samples) / n
+    mean_b = sum(s['backlog'] for s in samples) / n
+    var_t = sum((s['t'] - mean_t) ** 2 for s in samples)
+    slope = (sum((s['t'] - mean_t) * (s['backlog'] - mean_b) for s in samples) / var_t
+             if var_t else 0.0)
+    with generator._lock:
+        acked = [(sop, t) for sop, t in generator.acked.items() if started <= t < ended]
+    latencies = [deliveries.delivered[sop] - t for sop, t in acked if sop in deliveries.delivered]
+    return {
+        'offered_rate': rate or None,
+        'seconds': round(duration, 2),
+        'accepted_per_s': round(accepted_rate, 2),
+        'delivered_per_s': round(delivered / duration if duration else 0.0, 2),
+        'backlog_start': samples[0]['backlog'],
+        'backlog_end': samples[-1]['backlog'],
+        'backlog_slope_per_s': round(slope, 3),
+        'backlog_growing': slope > max(1.0, GROWTH_RATIO * accepted_rate),
+        'latency_p50_s': percentile(latencies, 0.50),
+        'latency_p99_s': percentile(latencies, 0.99),
+        'undelivered': len(acked) - len(latencies),
+    }
+
+
+def print_step(index, step):
+    rate = f"{step['offered_rate']:g}/s" if step['offered_rate'] else "sem limite"
+    p50, p99 = step['latency_p50_s'], step['latency_p99_s']
+    latency = f"p50 {p50:.2f}s p99 {p99:.2f}s" if p50 is not None else "sem entregas"
+    flag = " ⚠ backlog crescendo" if step['backlog_growing'] else ""
+    print(f"📊 Degrau {index} ({rate}): aceitas {step['accepted_per_s']:.1f}/s | "
+          f"entregues {step['delivered_per_s']:.1f}/s | backlog {step['backlog_start']}→"
+          f"{step['backlog_end']} ({step['backlog_slope_per_s']:+.1f}/s) | {latency}{flag}",
+          file=sys.stderr)
+
+
+def run(args, env_overrides):
+    workdir = Path(tempfile.mkdtemp(prefix="dicom-load-"))
+    try:
+        return _run(args, env_overrides, workdir)
+    finally:
+        if args.keep:
+            print(f"📁 Pasta de trabalho mantida: {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _run(args, env_overrides, workdir):
+    sys.path.insert(0, str(REPO_ROOT / "benchmarks"))
+    from bench_hotpath import git_commit
+
+    root = workdir / "dicom"
+    logs = workdir / "logs"
+    root.mkdir()
+    logs.mkdir()
+    delivery_path = workdir / "destination.log"
+
+    print(f"📁 Gerando instâncias de modelo em {workdir}...", file=sys.stderr)
+    templates = build_templates(workdir, args.transfer_syntaxes,
+                                min(max(args.study_sizes), args.template_slices), args.size)
+
+    destination = multiprocessing.Process(
+        target=run_destination, args=(args.destination_port, args.destination_aet, delivery_path),
+        daemon=True,
+    )
+    destination.start()
+    processes = {}
+    pacer = Pacer()
+    generator = None
+    steps = []
+    timeline = []
+    try:
+        if not wait_for_echo(args.destination_port, args.destination_aet):
+            raise SystemExit("❌ Destino substituto não respondeu ao C-ECHO")
+        processes = start_router(args, root, logs, env_overrides)
+        if not wait_for_echo(args.router_port, args.router_aet):
+            raise SystemExit(f"❌ SCP do roteador não respondeu (logs em {logs})")
+        print(f"🔌 Roteador ({args.receiver}) em 127.0.0.1:{args.router_port} → destino "
+              f"127.0.0.1:{args.destination_port}", file=sys.stderr)
+
+        deliveries = DeliveryLog(delivery_path)
+        generator = Generator(templates, args.study_sizes, args.associations,
+                              args.router_port, args.router_aet, pacer)
+        began = time.time()
+
+        def sample():
+            acked = generator.acked_count()
+            delivered = deliveries.poll()
+            point = {'t': time.time(), 'acked': acked, 'delivered': delivered,
+                     'backlog': acked - delivered}
+            timeline.append({**point, 't': round(point['t'] - began, 2)})
+            return point
+
+        pacer.set_rate(args.rates[0])
+        generator.start()
+        for index, rate in enumerate(args.rates, 1):
+            pacer.set_rate(rate)
+            started = time.time()
+            samples = [sample()]
+            while time.time() - started < args.step_seconds:
+                time.sleep(args.sample_interval)
+                samples.append(sample())
+            step = step_summary(rate, samples, generator, deliveries, started, time.time())
+            steps.append(step)
+            print_step(index, step)
+            for name, process in processes.items():
+                if process.poll() is not None:
+                    raise SystemExit(f"❌ {name} do roteador terminou (logs em {logs})")
+
+        generator.stop()
+        sent_seconds = time.time() - began
+        print(f"⏳ Drenando o backlog (até {args.drain_timeout:.0f}s)...", file=sys.stderr)
+        deadline = time.monotonic() + args.drain_timeout
+        while time.monotonic() < deadline:
+            point = sample()
+            if point['backlog'] <= 0:
+                break
+            time.sleep(args.sample_interval)
+        drained_seconds = time.time() - began
+    finally:
+        if generator is not None:
+            generator.stop(timeout=5.0)
+        stop_processes(processes)
+        destination.terminate()
+        destination.join(5.0)
+
+    deliveries.poll()
+    latencies = [deliveries.delivered[sop] - t for sop, t in generator.acked.items()
+                 if sop in deliveries.delivered]
+    stable = [step for step in steps if not step['backlog_growing']]
+    saturation = next((step for step in steps if step['backlog_growing']), None)
+    pipeline_stats = None
+    stats_path = root / ".pipeline_stats.json"
+    if stats_path.exists():
+        with open(stats_path) as f:
+            pipeline_stats = json.load(f)
+
+    summary = {
+        'studies': generator.studies,
+        'instances_acked': len(generator.acked),
+        'instances_delivered': len(latencies),
+        'instances_undelivered': len(generator.acked) - len(latencies),
+        'send_failures': generator.failures,
+        'accepted_per_s': round(len(generator.acked) / sent_seconds, 2),
+        'delivered_per_s_with_drain': round(len(latencies) / drained_seconds, 2),
+        'sustained_per_s': max((step['delivered_per_s'] for step in stable), default=None),
+        'backlog_grows_at': ({'offered_rate': saturation['offered_rate'],
+                              'accepted_per_s': saturation['accepted_per_s']}
+                             if saturation else None),
+        'latency_p50_s': percentile(latencies, 0.50),
+        'latency_p99_s': percentile(latencies, 0.99),
+        'latency_max_s': max(latencies, default=None),
+    }
+
+    print("=" * 60, file=sys.stderr)
+    print(f"✅ {summary['instances_delivered']}/{summary['instances_acked']} instâncias entregues "
+          f"({summary['studies']} estudo(s), {summary['send_failures']} falha(s) de envio)",
+          file=sys.stderr)
+    if summary['sustained_per_s'] is not None:
+        print(f"📈 Capacidade sustentada: {summary['sustained_per_s']:.1f} inst/s", file=sys.stderr)
+    if saturation:
+        rate = saturation['offered_rate']
+        print(f"⚠ Backlog começa a crescer em {f'{rate:g}/s' if rate else 'taxa livre'} "
+              f"(aceitas {saturation['accepted_per_s']:.1f}/s)", file=sys.stderr)
+    else:
+        print("✅ Backlog estável em todos os degraus", file=sys.stderr)
+    if summary['latency_p50_s'] is not None:
+        print(f"⏱ Recepção → destino: p50 {summary['latency_p50_s']:.2f}s | "
+              f"p99 {summary['latency_p99_s']:.2f}s", file=sys.stderr)
+
+    import pydicom
+    import pynetdicom
+    return {
+        'meta': {
+            'benchmark': "load",
+            'timestamp': datetime.now().isoformat(timespec="seconds"),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'pydicom': pydicom.__version__,
+            'pynetdicom': pynetdicom.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': {key: str(value) if isinstance(value, Path) else value
+                     for key, value in vars(args).items()},
+        },
+        'summary': summary,
+        'steps': steps,
+        'timeline': timeline,
+        'pipeline_stats': pipeline_stats,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Teste de carga C-STORE ponta a ponta")
+    parser.add_argument("--rates", type=float, nargs="+", default=[10, 25, 50, 100],
+                        help="degraus de taxa oferecida (instâncias/s; 0 = sem limite)")
+    parser.add_argument("--step-seconds", type=float, default=30)
+    parser.add_argument("--associations", type=int, default=4,
+                        help="associações simultâneas (modalities)")
+    parser.add_argument("--study-sizes", type=int, nargs="+", default=[20, 100],
+                        help="instâncias por estudo (em rodízio)")
+    parser.add_argument("--transfer-syntaxes", nargs="+", default=["explicit"],
+                        choices=sorted(TRANSFER_SYNTAXES), help="em rodízio por estudo")
+    parser.add_argument("--size", type=int, default=512, help="linhas/colunas das fatias CT")
+    parser.add_argument("--template-slices", type=int, default=16,
+                        help="fatias distintas geradas por syntax (reaproveitadas)")
+    parser.add_argument("--receiver", choices=["native", "storescp"], default="native",
+                        help="storage_scp.py ou receive.sh (storescp do DCMTK)")
+    parser.add_argument("--scp-workers", type=int, default=2)
+    parser.add_argument("--cut-through", type=int, choices=[0, 1], default=1,
+                        help="SCP_CUT_THROUGH do SCP nativo")
+    parser.add_argument("--router-port", type=int, default=11112)
+    parser.add_argument("--router-aet", default="DICOMRS_SCP")
+    parser.add_argument("--destination-port", type=int, default=11113)
+    parser.add_argument("--destination-aet", default="ZEROCLICK")
+    parser.add_argument("--env", action="append", default=[], metavar="CHAVE=VALOR",
+                        help="variável extra para SCP e SCU (ex.: SCU_WORKERS=8)")
+    parser.add_argument("--sample-interval", type=float, default=1.0)
+    parser.add_argument("--drain-timeout", type=float, default=120)
+    parser.add_argument("--quick", action="store_true",
+                        help="rodada curta (2 degraus de 10 s, fatias 128x128)")
+    parser.add_argument("--output", type=Path, help="arquivo JSON do resultado")
+    parser.add_argument("--keep", action="store_true",
+                        help="mantém a pasta temporária (logs, catálogo)")
+    args = parser.parse_args(argv)
+
+    env_overrides = {}
+    for item in args.env:
+        key, sep, value = item.partition("=")
+        if not sep:
+            parser.error(f"--env espera CHAVE=VALOR: {item}")
+        env_overrides[key] = value
+    if args.quick:
+        args.rates = args.rates[:2]
+        args.step_seconds = min(args.step_seconds, 10)
+        args.size = min(args.size, 128)
+        args.study_sizes = [min(size, 20) for size in args.study_sizes]
+
+    report = run(args, env_overrides)
+    output = args.output or RESULTS_FOLDER / f"load_{datetime.now():%Y%m%d_%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Resultado gravado em {output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
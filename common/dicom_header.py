@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Leitura única do cabeçalho DICOM (compartilhada por SCP, SCU e organizador)
+Lê o arquivo uma só vez até o elemento de pixel data e registra se ele existe
+e seu tamanho, sem carregar o valor. O mesmo dataset alimenta validação,
+roteamento por estudo e metadados.
+"""
+
+import os
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from pydicom.filereader import read_partial
+from pydicom.multival import MultiValue
+
+# Processos de leitura de cabeçalho (0/1 = no próprio processo)
+HEADER_WORKERS = int(os.getenv("HEADER_WORKERS", str(os.cpu_count() or 1)))
+
+IMAGE_MODALITIES = {
+    "CR", "CT", "DX", "IO", "MG", "MR", "NM", "OT", "PT", "RF",
+    "RTIMAGE", "US", "XA", "XC",
+}
+
+# Elementos de pixel data no nível raiz (a leitura para no primeiro deles)
+PIXEL_DATA_TAGS = {
+    0x7FE00008: "FloatPixelData",
+    0x7FE00009: "DoubleFloatPixelData",
+    0x7FE00010: "PixelData",
+}
+UNDEFINED_LENGTH = 0xFFFFFFFF
+
+def sanitize_filename(text, max_length=50):
+    """Remove caracteres inválidos de nomes de arquivo/pasta"""
+    if not text:
+        return "UNKNOWN"
+    # Substitui separadores DICOM de PersonName por espaço
+    text = text.replace('^', ' ').replace('=', ' ')
+    # Remove caracteres problemáticos para filesystem
+    invalid_chars = '<>:"/\\|?*'
+    for char in invalid_chars:
+        text = text.replace(char, '_')
+    # Colapsa espaços múltiplos e limita tamanho
+    text = ' '.join(text.split()).strip()
+    if max_length:
+        text = text[:max_length]
+    return text or "UNKNOWN"
+
+def clean_study_description(ds):
+    """Limpa caracteres inválidos do campo StudyDescription"""
+    if 'StudyDescription' in ds:
+        desc = ds.StudyDescription
+        # Remove caracteres não imprimíveis ou substitui por espaço
+        desc_clean = ''.join(c if c.isprintable() else ' ' for c in desc)
+        # Garante UTF-8 válido
+        desc_clean = desc_clean.encode('utf-8', errors='replace').decode('utf-8')
+        ds.StudyDescription = desc_clean
+
+def read_dicom_header(filepath):
+    """
+    Lê o cabeçalho em uma única passada, parando no pixel data.
+    `filepath` pode ser um caminho ou um arquivo já aberto (ex.: BytesIO
+    com o dataset recebido pelo SCP). O tag e o tamanho do pixel data ficam em `ds._pixel_data_keyword` e
+    `ds._pixel_data_length` (None quando encapsulado/comprimido, que tem
+    tamanho indefinido). O dataset fica marcado como lido sem pixels:
+    use safe_save_dicom() se algum dia precisar regravar.
+    """
+    pixel_info = {}
+
+    def stop_at_pixel_data(tag, vr, length):
+        if tag in PIXEL_DATA_TAGS:
+            pixel_info['keyword'] = PIXEL_DATA_TAGS[tag]
+            pixel_info['length'] = None if length == UNDEFINED_LENGTH else length
+            return True
+        return False
+
+    if hasattr(filepath, 'read'):
+        ds = read_partial(filepath, stop_when=stop_at_pixel_data)
+    else:
+        with open(filepath, 'rb') as fp:
+            ds = read_partial(fp, stop_when=stop_at_pixel_data)
+
+    ds._read_without_pixels = True
+    ds._pixel_data_keyword = pixel_info.get('keyword')
+    ds._pixel_data_length = pixel_info.get('length')
+    return ds
+
+def dataset_requires_pixel_data(ds):
+    """Heurística conservadora: imagens devem ter PixelData."""
+    modality = str(getattr(ds, "Modality", "")).upper()
+    if modality in IMAGE_MODALITIES:
+        return True
+    return hasattr(ds, "Rows") and hasattr(ds, "Columns")
+
+def dataset_has_pixel_data(ds):
+    if getattr(ds, "_pixel_data_keyword", None):
+        return True
+    return (
+        "PixelData" in ds
+        or "FloatPixelData" in ds
+        or "DoubleFloatPixelData" in ds
+    )
+
+def validate_header_has_pixels(ds):
+    """
+    Valida se um DICOM de imagem contém pixel data (a partir do cabeçalho).
+    Retorna (ok, motivo).
+    """
+    if not dataset_requires_pixel_data(ds):
+        return True, "não é imagem"
+    if not dataset_has_pixel_data(ds):
+        return False, "DICOM de imagem sem PixelData"
+    if getattr(ds, "_pixel_data_length", None) == 0:
+        return False, "DICOM de imagem com PixelData vazio"
+    return True, "ok"
+
+def validate_image_dicom_has_pixels(filepath):
+    """
+    Valida um arquivo lendo só o cabeçalho.
+    Retorna (ok, motivo, ds); ds é None se o arquivo não pôde ser lido.
+    """
+    try:
+        ds = read_dicom_header(filepath)
+    except Exception as e:
+        return False, f"falha ao ler DICOM: {e}", None
+    ok, reason = validate_header_has_pixels(ds)
+    return ok, reason, ds
+
+def safe_save_dicom(ds, filepath):
+    """
+    Bloqueia gravação acidental de datasets lidos sem pixels.
+    Isso evita corromper arquivos de imagem por save_as() após leitura parcial.
+    """
+    if getattr(ds, "_read_without_pixels", False) and dataset_requires_pixel_data(ds):
+        raise RuntimeError(
+            "Bloqueado: tentativa de salvar DICOM lido sem pixels. "
+            "Isso pode remover PixelData."
+        )
+    ds.save_as(filepath)
+
+def study_metadata_from_header(ds):
+    """Campos do estudo usados na pasta e nos metadados"""
+    clean_study_description(ds)
+    return {
+        'study_uid': str(getattr(ds, 'StudyInstanceUID', '')),
+        'patient_id': sanitize_filename(str(getattr(ds, 'PatientID', 'UNKNOWN'))),
+        'patient_name': sanitize_filename(str(getattr(ds, 'PatientName', 'UNKNOWN'))),
+        'study_date': str(getattr(ds, 'StudyDate', '')),
+        'study_time': str(getattr(ds, 'StudyTime', '')),
+        'modality': str(getattr(ds, 'Modality', 'UNKNOWN')),
+        'study_description': str(getattr(ds, 'StudyDescription', '')),
+    }
+
+def _int_or_none(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+def _first_float(value):
+    """Primeiro valor numérico de um elemento (multivalorado ou não)"""
+    if isinstance(value, (list, tuple, MultiValue)):
+        value = value[0] if len(value) else None
+    try:
+        return float(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+def slice_geometry(ds):
+    """
+    (orientação, posição) da fatia: ImageOrientationPatient arredondada como
+    texto e ImagePositionPatient projetada na normal (linha × coluna).
+    ('', None) sem geometria
+    """
+    try:
+        iop = [float(v) for v in ds.ImageOrientationPatient]
+        ipp = [float(v) for v in ds.ImagePositionPatient]
+    except (AttributeError, TypeError, ValueError):
+        return '', None
+    if len(iop) != 6 or len(ipp) != 3:
+        return '', None
+    row, col = iop[:3], iop[3:]
+    normal = (
+        row[1] * col[2] - row[2] * col[1],
+        row[2] * col[0] - row[0] * col[2],
+        row[0] * col[1] - row[1] * col[0],
+    )
+    orientation = "\\".join(f"{v:.3f}" for v in iop).replace("-0.000", "0.000")
+    return orientation, sum(n * p for n, p in zip(normal, ipp))
+
+def instance_metadata_from_header(ds):
+    """Campos da instância/série usados no catálogo e no envio"""
+    file_meta = getattr(ds, 'file_meta', None)
+    orientation, slice_position = slice_geometry(ds)
+    return {
+        'sop_instance_uid': str(
+            getattr(ds, 'SOPInstanceUID', '')
+            or getattr(file_meta, 'MediaStorageSOPInstanceUID', '')
+        ),
+        'sop_class_uid': str(
+            getattr(file_meta, 'MediaStorageSOPClassUID', '')
+            or getattr(ds, 'SOPClassUID', '')
+        ),
+        'transfer_syntax': str(getattr(file_meta, 'TransferSyntaxUID', '') or ''),
+        'series_uid': str(getattr(ds, 'SeriesInstanceUID', '')),
+        'series_number': _int_or_none(getattr(ds, 'SeriesNumber', None)),
+        'series_description': str(getattr(ds, 'SeriesDescription', '')),
+        'modality': str(getattr(ds, 'Modality', '')),
+        'instance_number': _int_or_none(getattr(ds, 'InstanceNumber', None)),
+        # Índice de fatias do visualizador (ordem na série sem reler cabeçalhos)
+        'orientation': orientation,
+        'slice_position': slice_position,
+        'image_rows': _int_or_none(getattr(ds, 'Rows', None)),
+        'image_columns': _int_or_none(getattr(ds, 'Columns', None)),
+        'frames': _int_or_none(getattr(ds, 'NumberOfFrames', None)),
+        'photometric': str(getattr(ds, 'PhotometricInterpretation', '') or ''),
+        'window_center': _first_float(getattr(ds, 'WindowCenter', None)),
+        'window_width': _first_float(getattr(ds, 'WindowWidth', None)),
+    }
+
+def header_tag_values(ds, keywords):
+    """Valores das tags `keywords` como tuplas de texto (ausente = tupla vazia)"""
+    values = {}
+    for keyword in keywords:
+        value = getattr(ds, keyword, None)
+        if value is None or value == "":
+            values[keyword] = ()
+        elif isinstance(value, (list, tuple, MultiValue)):
+            values[keyword] = tuple(str(v).strip() for v in value)
+        else:
+            values[keyword] = (str(value).strip(),)
+    return values
+
+def summarize_dicom_file(filepath, tag_keywords=()):
+    """
+    Lê o cabeçalho uma vez e devolve um resumo compacto e serializável
+    (sem Dataset), próprio para rodar no pool de processos:
+    path, readable, ok, reason, seconds (tempo de leitura e validação) e,
+    se válido, study, instance e tags (valores das `tag_keywords` usadas nas
+    regras de roteamento).
+    Nunca levanta exceção: um arquivo problemático vira ok=False (e vai para a
+    quarentena) em vez de derrubar o lote inteiro do pool.
+    """
+    started = time.perf_counter()
+    try:
+        ok, reason, ds = validate_image_dicom_has_pixels(str(filepath))
+        summary = {'path': str(filepath), 'readable': ds is not None, 'ok': ok, 'reason': reason}
+        if ds is not None and ok:
+            summary['study'] = study_metadata_from_header(ds)
+            summary['instance'] = instance_metadata_from_header(ds)
+            summary['tags'] = header_tag_values(ds, tag_keywords)
+    except Exception as e:
+        summary = {'path': str(filepath), 'readable': False, 'ok': False,
+                   'reason': f"Erro ao ler cabeçalho: {e}"}
+    summary['seconds'] = time.perf_counter() - started
+    return summary
+
+class HeaderParserPool:
+    """
+    Pool de processos para ler cabeçalhos em paralelo (usa todos os núcleos).
+    Os workers devolvem só os resumos de summarize_dicom_file().
+    """
+
+    def __init__(self, workers=HEADER_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def map(self, paths, tag_keywords=()):
+        """Resumos na mesma ordem de `paths`"""
+        paths = [str(p) for p in paths]
+        parse = partial(summarize_dicom_file, tag_keywords=tuple(tag_keywords))
+        if self.workers <= 1 or len(paths) <= 1:
+            return [parse(p) for p in paths]
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            executor = self._executor
+        chunksize = max(1, len(paths) // (self.workers * 4))
+        return list(executor.map(parse, paths, chunksize=chunksize))
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
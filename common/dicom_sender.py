@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+"""
+DICOM Storage SCU nativo (pynetdicom)
+Mantém um pool pequeno de associações persistentes por destino
+HOST:PORT:AET, reconectando automaticamente após release/abort.
+Um disjuntor (circuit breaker) por destino evita esperar timeouts a cada
+arquivo enquanto o destino está fora, testando-o com C-ECHO até voltar.
+
+Uso via linha de comando (reenvio pelo dashboard):
+    python dicom_sender.py HOST PORT AET ARQUIVO_OU_PASTA [...]
+"""
+
+import os
+import sys
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from pydicom.filereader import read_file_meta_info
+from pynetdicom import AE, _config
+from pynetdicom.sop_class import Verification
+
+from metrics import CSTORE_SECONDS, SENT_BYTES, SENT_FILES
+
+# Envia o dataset direto do arquivo em blocos, sem decodificar/recodificar
+_config.STORE_SEND_CHUNKED_DATASET = True
+
+# Configurações do pool
+SCU_AET = os.getenv("SCU_AET", "DICOMRS_SCU")
+SCU_POOL_SIZE = int(os.getenv("SCU_POOL_SIZE", "2"))
+# Teto rígido de associações simultâneas por destino (protege o receptor)
+SCU_MAX_ASSOCIATIONS = int(os.getenv("SCU_MAX_ASSOCIATIONS", "8"))
+SCU_IDLE_TIMEOUT = float(os.getenv("SCU_IDLE_TIMEOUT", "60"))
+SCU_DIMSE_TIMEOUT = float(os.getenv("SCU_DIMSE_TIMEOUT", "30"))
+SCU_CONNECT_TIMEOUT = float(os.getenv("SCU_CONNECT_TIMEOUT", "10"))
+
+# Disjuntor: falhas de conexão seguidas para abrir e intervalo entre C-ECHOs
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "3"))
+CIRCUIT_PROBE_INTERVAL = float(os.getenv("CIRCUIT_PROBE_INTERVAL", "15"))
+
+# Limite do protocolo DICOM para contextos de apresentação por associação
+MAX_PRESENTATION_CONTEXTS = 128
+
+# Status C-STORE aceitos (sucesso e avisos de coerção/descartes de elementos)
+STORE_OK_STATUSES = {0x0000, 0xB000, 0xB006, 0xB007}
+
+
+class CircuitBreaker:
+    """
+    Disjuntor de um destino. Após CIRCUIT_FAILURE_THRESHOLD falhas de conexão
+    seguidas abre: os envios falham na hora, sem esperar timeout, e uma thread
+    testa o destino com C-ECHO a cada CIRCUIT_PROBE_INTERVAL s. Quando ele
+    responde o disjuntor fecha e os ouvintes são avisados (ex.: drenar a fila).
+    """
+
+    def __init__(self, key, probe):
+        self.key = key
+        self._probe = probe
+        self._lock = threading.Lock()
+        self._listeners = []
+        self.failures = 0
+        self.is_open = False
+
+    def allow(self):
+        return not self.is_open
+
+    def add_listener(self, callback):
+        """`callback()` é chamado (na thread do teste) quando o destino volta"""
+        with self._lock:
+            if callback not in self._listeners:
+                self._listeners.append(callback)
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+
+    def record_failure(self, reason):
+        with self._lock:
+            self.failures += 1
+            if self.is_open or self.failures < CIRCUIT_FAILURE_THRESHOLD:
+                return
+            self.is_open = True
+        print(f"🔴 Disjuntor aberto para {self.key} ({reason}); "
+              f"testando com C-ECHO a cada {CIRCUIT_PROBE_INTERVAL:.0f}s")
+        threading.Thread(target=self._probe_until_up, daemon=True).start()
+
+    def _probe_until_up(self):
+        while True:
+            time.sleep(CIRCUIT_PROBE_INTERVAL)
+            try:
+                if self._probe():
+                    break
+            except Exception:
+                pass
+        with self._lock:
+            self.is_open = False
+            self.failures = 0
+            listeners = list(self._listeners)
+        print(f"🟢 Disjuntor fechado: {self.key} respondeu ao C-ECHO")
+        for callback in listeners:
+            try:
+                callback()
+            except Exception as e:
+                print(f"⚠ Erro ao retomar envios para {self.key}: {e}")
+
+
+class PooledAssociation:
+    """Associação aberta com os contextos (SOP Class, Transfer Syntax) aceitos"""
+
+    def __init__(self, assoc, requested):
+        self.assoc = assoc
+        self.requested = set(requested)
+        self.accepted = {
+            (str(cx.abstract_syntax), str(cx.transfer_syntax[0]))
+            for cx in assoc.accepted_contexts
+        }
+        self.last_used = time.monotonic()
+        self.uses = 0
+        self.broken = False
+
+    def is_usable(self):
+        if self.broken or not self.assoc.is_established:
+            return False
+        return time.monotonic() - self.last_used < SCU_IDLE_TIMEOUT
+
+    def covers(self, contexts):
+        """Todos os contextos já foram negociados (aceitos ou recusados)?"""
+        return set(contexts) <= self.requested
+
+    def close(self):
+        try:
+            if self.assoc.is_established:
+                self.assoc.release()
+        except Exception:
+            self.assoc.abort()
+
+
+class AssociationPool:
+    """
+    Pool de associações persistentes para um destino.
+    No máximo `size` associações simultâneas (limitado a SCU_MAX_ASSOCIATIONS);
+    as ociosas ficam abertas para reutilização e são renegociadas quando
+    surge um novo contexto.
+    """
+
+    def __init__(self, host, port, ae_title, size=SCU_POOL_SIZE):
+        self.host = host
+        self.port = int(port)
+        self.ae_title = ae_title
+        self.key = f"{host}:{port}:{ae_title}"
+        # Nome do destino nas métricas (o das regras de roteamento, se houver)
+        self.name = ae_title
+        self.size = max(1, min(size, SCU_MAX_ASSOCIATIONS))
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._idle = []
+        # Contextos já vistos para este destino: novas associações já
+        # nascem com eles, evitando renegociar a cada SOP Class diferente
+        self._known_contexts = []
+        # Resultado da negociação de cada contexto pedido (aceito ou não)
+        self._negotiated = {}
+        self.breaker = CircuitBreaker(self.key, self.echo)
+
+    def _remember_contexts(self, contexts):
+        with self._lock:
+            for cx in contexts:
+                if cx not in self._known_contexts:
+                    self._known_contexts.append(cx)
+            return list(self._known_contexts)
+
+    def _new_ae(self):
+        ae = AE(ae_title=SCU_AET)
+        ae.acse_timeout = SCU_CONNECT_TIMEOUT
+        ae.connection_timeout = SCU_CONNECT_TIMEOUT
+        ae.dimse_timeout = SCU_DIMSE_TIMEOUT
+        ae.network_timeout = SCU_DIMSE_TIMEOUT
+        return ae
+
+    def echo(self):
+        """C-ECHO no destino (associação própria, fora do pool); True se respondeu"""
+        ae = self._new_ae()
+        ae.add_requested_context(Verification)
+        assoc = ae.associate(self.host, self.port, ae_title=self.ae_title)
+        if not assoc.is_established:
+            return False
+        try:
+            status = assoc.send_c_echo()
+            return bool(status) and int(getattr(status, "Status", 0xFFFF)) == 0x0000
+        finally:
+            assoc.release()
+
+    def _open(self, contexts):
+        """Abre nova associação pedindo primeiro os contextos obrigatórios"""
+        required = list(dict.fromkeys(contexts))
+        known = self._remember_contexts(required)
+        selected = required[:MAX_PRESENTATION_CONTEXTS]
+        for cx in reversed(known):
+            if len(selected) >= MAX_PRESENTATION_CONTEXTS:
+                break
+            if cx not in selected:
+                selected.append(cx)
+
+        ae = self._new_ae()
+        for sop_class, transfer_syntax in selected:
+            ae.add_requested_context(sop_class, transfer_syntax)
+
+        assoc = ae.associate(self.host, self.port, ae_title=self.ae_title)
+        if not assoc.is_established:
+            raise ConnectionError(f"associação recusada/indisponível em {self.key}")
+        conn = PooledAssociation(assoc, selected)
+        with self._lock:
+            for cx in selected:
+                self._negotiated[cx] = cx in conn.accepted
+        return conn
+
+    def accepted_contexts(self, contexts):
+        """
+        Quais `contexts` o destino aceita. Os ainda não negociados são pedidos
+        numa associação do pool (que fica aberta para o envio em seguida).
+        """
+        contexts = list(dict.fromkeys(contexts))
+        with self._lock:
+            unknown = [cx for cx in contexts if cx not in self._negotiated]
+        if unknown:
+            with self.acquire(unknown):
+                pass
+        with self._lock:
+            return {cx for cx in contexts if self._negotiated.get(cx)}
+
+    def _checkout(self, contexts):
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self._open(contexts)
+            if not conn.is_usable():
+                conn.close()
+                continue
+            if not conn.covers(contexts):
+                # Renegocia com a união dos contextos (limite de 128)
+                conn.close()
+                return self._open(list(contexts) + list(conn.requested))
+            return conn
+
+    def _checkin(self, conn):
+        conn.last_used = time.monotonic()
+        conn.uses += 1
+        if conn.broken or not conn.assoc.is_established:
+            conn.close()
+            return
+        with self._lock:
+            self._idle.append(conn)
+
+    @contextmanager
+    def acquire(self, contexts=()):
+        """Empresta uma associação que negociou `contexts`"""
+        with self._slots:
+            conn = self._checkout(contexts)
+            try:
+                yield conn
+            finally:
+                self._checkin(conn)
+
+    def send_file(self, filepath, sop_class=None, transfer_syntax=None):
+        """
+        Envia um arquivo DICOM via C-STORE.
+        Retorna (ok, mensagem).
+        """
+        _, ok, message = self.send_files([(filepath, sop_class, transfer_syntax)])[0]
+        return ok, message
+
+    def send_files(self, items):
+        """
+        Envia vários arquivos pela mesma associação, negociando de uma vez
+        os contextos (SOP Class, Transfer Syntax) de todo o conjunto.
+        `items`: caminhos ou tuplas (caminho, sop_class, transfer_syntax).
+        Retorna lista de (caminho, ok, mensagem) na mesma ordem.
+        """
+        results = {}
+        entries = []
+        for idx, item in enumerate(items):
+            filepath, sop_class, transfer_syntax = (
+                item if isinstance(item, tuple) else (item, None, None)
+            )
+            if not sop_class or not transfer_syntax:
+                try:
+                    meta = read_file_meta_info(str(filepath))
+                    sop_class = meta.MediaStorageSOPClassUID
+                    transfer_syntax = meta.TransferSyntaxUID
+                except Exception as e:
+                    results[idx] = (filepath, False, f"falha ao ler file meta: {e}")
+                    continue
+            entries.append((idx, filepath, (str(sop_class), str(transfer_syntax))))
+
+        for chunk in split_by_context_limit(entries):
+            pending = chunk
+            retried = set()
+            while pending:
+                if not self.breaker.allow():
+                    # Destino fora: falha imediata, sem esperar timeout por arquivo
+                    for idx, filepath, _ in pending:
+                        results[idx] = (filepath, False, f"disjuntor aberto: {self.key} indisponível")
+                    break
+                contexts = [cx for _, _, cx in pending]
+                try:
+                    with self.acquire(contexts) as conn:
+                        pending = self._send_on(conn, pending, results, retried)
+                except ConnectionError as e:
+                    self.breaker.record_failure(str(e))
+                    for idx, filepath, _ in pending:
+                        results[idx] = (filepath, False, str(e))
+                    pending = []
+
+        return [results[idx] for idx in range(len(items))]
+
+    def _send_on(self, conn, entries, results, retried):
+        """
+        Envia `entries` em sequência na associação `conn`.
+        Se a associação cair, devolve o que faltou para reenviar em outra.
+        """
+        for pos, (idx, filepath, context) in enumerate(entries):
+            if context not in conn.accepted:
+                results[idx] = (filepath, False, "destino recusou o contexto de apresentação")
+                continue
+            reused = conn.uses > 0 or pos > 0
+            started = time.monotonic()
+            try:
+                status = conn.assoc.send_c_store(str(filepath))
+            except (RuntimeError, OSError) as e:
+                status = None
+                error = f"associação perdida: {e}"
+            else:
+                error = "sem resposta do destino (timeout/abort)"
+            if status:
+                # Destino respondeu (mesmo com status de erro): está no ar
+                self.breaker.record_success()
+                results[idx] = (filepath, *store_status_result(status))
+                CSTORE_SECONDS.observe(time.monotonic() - started, destination=self.name)
+                if results[idx][1]:
+                    self._count_sent(filepath)
+                continue
+
+            # Sem resposta: timeout DIMSE ou abort do destino.
+            # Só repete se a associação reutilizada caiu na hora
+            conn.broken = True
+            quick_failure = time.monotonic() - started < SCU_DIMSE_TIMEOUT
+            if reused and quick_failure and idx not in retried:
+                retried.add(idx)
+                return entries[pos:]
+            self.breaker.record_failure(error)
+            results[idx] = (filepath, False, error)
+            return entries[pos + 1:]
+        return []
+
+    def _count_sent(self, filepath):
+        SENT_FILES.inc(destination=self.name)
+        try:
+            SENT_BYTES.inc(os.path.getsize(filepath), destination=self.name)
+        except OSError:
+            pass
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+def store_status_result(status):
+    """Interpreta o dataset de status do C-STORE"""
+    code = int(getattr(status, "Status", 0xFFFF))
+    if code in STORE_OK_STATUSES:
+        return True, f"status 0x{code:04X}"
+    return False, f"destino retornou status 0x{code:04X}"
+
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(host, port, ae_title, name=None):
+    """
+    Retorna o pool compartilhado do destino HOST:PORT:AET
+    `name`: nome do destino nas regras, usado nas métricas
+    """
+    key = f"{host}:{port}:{ae_title}"
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = AssociationPool(host, port, ae_title)
+            _POOLS[key] = pool
+        if name:
+            pool.name = name
+        return pool
+
+
+def split_by_context_limit(entries):
+    """Divide o lote para que cada associação peça no máximo 128 contextos"""
+    chunk, contexts = [], set()
+    for entry in entries:
+        context = entry[2]
+        if context not in contexts and len(contexts) >= MAX_PRESENTATION_CONTEXTS:
+            yield chunk
+            chunk, contexts = [], set()
+        chunk.append(entry)
+        contexts.add(context)
+    if chunk:
+        yield chunk
+
+
+def send_dicom_file(filepath, host, port, ae_title, sop_class=None, transfer_syntax=None):
+    """Envia um arquivo usando o pool persistente do destino"""
+    try:
+        return get_pool(host, port, ae_title).send_file(filepath, sop_class, transfer_syntax)
+    except Exception as e:
+        return False, f"exceção no envio: {e}"
+
+
+def send_dicom_batch(items, host, port, ae_title):
+    """
+    Envia um lote (ex.: um estudo inteiro) numa única associação do pool.
+    Retorna lista de (caminho, ok, mensagem).
+    """
+    try:
+        return get_pool(host, port, ae_title).send_files(items)
+    except Exception as e:
+        return [
+            (item[0] if isinstance(item, tuple) else item, False, f"exceção no envio: {e}")
+            for item in items
+        ]
+
+
+@atexit.register
+def close_all_pools():
+    """Libera (A-RELEASE) todas as associações abertas"""
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+    for pool in pools:
+        pool.close()
+
+
+def collect_dicom_files(paths):
+    """Expande pastas em arquivos .dcm (ordenados por nome)"""
+    files = []
+    for p in map(Path, paths):
+        if p.is_dir():
+            files.extend(sorted(p.glob("*.dcm")))
+        elif p.is_file():
+            files.append(p)
+    return files
+
+
+def main(argv):
+    if len(argv) < 4:
+        print("Uso: dicom_sender.py HOST PORT AET ARQUIVO_OU_PASTA [...]")
+        return 2
+    host, port, ae_title = argv[:3]
+    files = collect_dicom_files(argv[3:])
+    sent = 0
+    for filepath, ok, message in send_dicom_batch(files, host, port, ae_title):
+        if ok:
+            sent += 1
+            print(f"✅ Enviado: {filepath.name}")
+        else:
+            print(f"❌ Falha: {filepath.name} ({message})")
+    close_all_pools()
+    print(f"RESULTADO: {sent}/{len(files)} enviados")
+    return 0 if files and sent == len(files) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Pipeline de exibição por modalidade (visualizador)
+Tudo vira uma tabela uint8 de 65536 entradas indexada pelo código int16 da
+fatia (como window_lut): janela linear, VOI LUT Sequence do cabeçalho ou
+janela automática pelo histograma, com MONOCHROME1 invertido na própria
+tabela. Janelas ficam em valores da modalidade e são levadas aos códigos pela
+escala de cada fatia (volume_cache). O perfil de exibição é calculado uma vez
+por série. Cor (RGB, YBR, paleta) já chega em RGB uint8 do frame_decoder e é
+mostrada sem janela.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+import pydicom
+
+from volume_cache import IDENTITY, window_lut
+
+CT_DEFAULT_WINDOW = (40, 400)
+MONOCHROME = ("MONOCHROME1", "MONOCHROME2")
+# Percentis da janela automática (ignora ar/fundo e pixels saturados)
+AUTO_WINDOW_PERCENTILES = (0.5, 99.5)
+# Valores int16 na ordem de índice da tabela (pixels.view(np.uint16))
+_LUT_VALUES = np.arange(65536, dtype=np.uint16).view(np.int16)
+
+
+@lru_cache(maxsize=64)
+def display_lut(wc, ww, invert=False):
+    """Janela linear (WC/WW em códigos), invertida para MONOCHROME1"""
+    lut = window_lut(wc, ww)
+    if invert:
+        lut = 255 - lut
+        lut.flags.writeable = False
+    return lut
+
+
+def apply_lut(pixels, lut):
+    """Pixels int16 → uint8 pela tabela (uma consulta por pixel)"""
+    return lut[pixels.view(np.uint16)]
+
+
+def code_window(wc, ww, mapping=IDENTITY):
+    """WC/WW em valores da modalidade → WC/WW nos códigos de uma fatia com `mapping`"""
+    scale, offset = mapping
+    return (wc - offset) / scale, ww / scale
+
+
+def code_values(mapping=IDENTITY):
+    """Valor da modalidade de cada um dos 65536 códigos (ordem de índice da tabela)"""
+    scale, offset = mapping
+    return _LUT_VALUES * scale + offset
+
+
+def voi_lut_table(ds, invert=False):
+    """
+    VOI LUT Sequence (primeiro item) como (tabela uint8, primeiro valor de
+    entrada), ou None. Invertida para MONOCHROME1
+    """
+    try:
+        item = ds.VOILUTSequence[0]
+        count, first, bits = (int(v) for v in item.LUTDescriptor)
+        data = item.LUTData
+    except (AttributeError, IndexError, TypeError, ValueError):
+        return None
+    count = count or 65536
+    if isinstance(data, bytes):
+        data = np.frombuffer(data, dtype="<u2" if bits > 8 else np.uint8)
+    data = np.asarray(data, dtype=np.float32)[:count]
+    if not len(data):
+        return None
+    # Faixa real da tabela (há LUTs com bits declarados maiores que os valores)
+    top = max(float(data.max()), 1.0)
+    scale = 255.0 / min(top, float(2 ** bits - 1)) if bits else 255.0 / top
+    table = np.clip(data * scale, 0, 255).astype(np.uint8)
+    if invert:
+        table = 255 - table
+    return table, first
+
+
+def voi_lut_codes(voi_lut, mapping=IDENTITY):
+    """
+    VOI LUT (voi_lut_table) levada aos códigos de uma fatia: tabela de 65536
+    entradas. Valores abaixo/acima da faixa da LUT saturam na primeira/última entrada
+    """
+    table, first = voi_lut
+    index = np.clip(np.rint(code_values(mapping)) - first, 0, len(table) - 1)
+    lut = table[index.astype(np.int64)]
+    lut.flags.writeable = False
+    return lut
+
+
+def profile_headers(paths, count=3):
+    """Cabeçalhos (sem pixels) de até `count` instâncias espaçadas da série, para series_profile"""
+    headers = []
+    for path in paths[::max(1, len(paths) // count)][:count]:
+        try:
+            headers.append(pydicom.dcmread(path, stop_before_pixels=True))
+        except Exception:
+            continue
+    return headers
+
+
+def header_window(ds):
+    """(WC, WW) do cabeçalho (primeiro valor) ou None"""
+    center, width = ds.get("WindowCenter"), ds.get("WindowWidth")
+    if isinstance(center, pydicom.multival.MultiValue):
+        center = center[0] if len(center) else None
+    if isinstance(width, pydicom.multival.MultiValue):
+        width = width[0] if len(width) else None
+    try:
+        center, width = float(center), float(width)
+    except (TypeError, ValueError):
+        return None
+    return (center, width) if width > 0 else None
+
+
+def auto_window(samples, percentiles=AUTO_WINDOW_PERCENTILES):
+    """
+    Janela pelo histograma das `samples` ((códigos int16, escala,
+    deslocamento)), em valores da modalidade: bincount nos 65536 códigos de
+    cada fatia (sem ordenar pixels) e percentis sobre os valores dos códigos
+    presentes, do baixo ao alto
+    """
+    values, counts = [], []
+    for pixels, *mapping in samples:
+        hist = np.bincount(pixels.view(np.uint16).ravel(), minlength=65536)
+        present = np.flatnonzero(hist)
+        values.append(code_values(mapping)[present])
+        counts.append(hist[present])
+    if not values:
+        return CT_DEFAULT_WINDOW
+    values, counts = np.concatenate(values), np.concatenate(counts)
+    order = np.argsort(values, kind="stable")
+    values, cumulative = values[order], np.cumsum(counts[order])
+    total = int(cumulative[-1])
+    low, high = (float(values[min(len(values) - 1, int(np.searchsorted(cumulative, total * p / 100.0)))])
+                 for p in percentiles)
+    return (low + high) / 2, max(high - low, 1e-6)
+
+
+def series_profile(headers, samples, modality, windows=()):
+    """
+    Perfil de exibição da série. `headers`: datasets (sem pixels) de
+    algumas instâncias; `samples`: fatias como (códigos int16, escala,
+    deslocamento) (iterável, só percorrido se a janela automática for
+    usada); `windows`: (WC, WW) ou None por fatia, vindos do catálogo.
+    Ordem da janela padrão: a do cabeçalho (por imagem), VOI LUT, partes
+    moles no CT e, por último, a automática. Janelas em valores da modalidade
+    """
+    first = headers[0] if headers else pydicom.Dataset()
+    photometric = str(first.get("PhotometricInterpretation", "MONOCHROME2"))
+    invert = photometric == "MONOCHROME1"
+    window = next(filter(None, map(header_window, headers)), None)
+    voi_lut = None if window else voi_lut_table(first, invert)
+    # Com VOI LUT a janela linear só serve de ponto de partida para ajustes
+    if window:
+        source = "cabeçalho"
+    elif modality == "CT":
+        window, source = CT_DEFAULT_WINDOW, "CT"
+    else:
+        window, source = auto_window(samples), "automática"
+    if voi_lut is not None:
+        source = "VOI LUT"
+    return {
+        'photometric': photometric,
+        'color': photometric not in MONOCHROME,
+        'invert': invert,
+        'window': tuple(float(v) for v in window),
+        'voi_lut': voi_lut,
+        'windows': list(windows),
+        'source': source,
+    }
+
+
+def frame_window(profile, index):
+    """Janela padrão da fatia `index` (valores da modalidade): a da própria imagem ou a da série"""
+    windows = profile['windows']
+    own = windows[index] if index < len(windows) else None
+    return tuple(own) if own else profile['window']
+
+
+def frame_voi_lut(profile, index, mapping=IDENTITY):
+    """VOI LUT da série nos códigos da fatia, se for ela a exibição padrão da fatia `index`"""
+    windows = profile['windows']
+    own = windows[index] if index < len(windows) else None
+    if own is not None or profile['voi_lut'] is None:
+        return None
+    return voi_lut_codes(profile['voi_lut'], mapping)
+
+
+def frame_lut(profile, index, mapping=IDENTITY, wc=None, ww=None):
+    """
+    Tabela de exibição da fatia (códigos com `mapping`): WC/WW dados, ou a
+    padrão (imagem, VOI LUT, série)
+    """
+    if wc is None or ww is None:
+        voi_lut = frame_voi_lut(profile, index, mapping)
+        if voi_lut is not None:
+            return voi_lut
+        wc, ww = frame_window(profile, index)
+    return display_lut(*code_window(float(wc), float(ww), mapping), profile['invert'])
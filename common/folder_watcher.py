@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Watcher de pasta orientado a eventos (inotify)
+Usa o inotifywait (inotify-tools) para IN_CLOSE_WRITE / IN_MOVED_TO e alimenta
+uma fila de trabalho. Uma varredura lenta periódica cobre eventos perdidos
+(ex.: overflow da fila do kernel ou arquivos que chegaram antes do start).
+
+Convenção de spool: quem grava na pasta observada escreve em outro lugar
+(ex.: DICOM_ROOT/.incoming) e faz rename atômico para a raiz ao terminar.
+O evento IN_MOVED_TO só ocorre para arquivos completos, sem espera arbitrária.
+"""
+
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+WATCH_RESCAN_INTERVAL = float(os.getenv("WATCH_RESCAN_INTERVAL", "30"))
+# Sem inotifywait disponível, cai para varredura com este intervalo
+WATCH_POLL_INTERVAL = float(os.getenv("WATCH_POLL_INTERVAL", "2"))
+# A varredura ignora arquivos alterados há menos disto: um escritor fora da
+# convenção de spool ainda pode estar gravando e gerará seu próprio evento
+WATCH_RESCAN_MIN_AGE = float(os.getenv("WATCH_RESCAN_MIN_AGE", "5"))
+
+
+class FolderWatcher:
+    """
+    Observa uma pasta (não recursivo) e entrega caminhos de arquivos prontos.
+    Pode entregar o mesmo arquivo mais de uma vez (evento + varredura):
+    o consumidor deve tolerar arquivo já movido.
+    """
+
+    def __init__(self, folder, suffix=".dcm", events=("close_write", "moved_to"),
+                 rescan_interval=WATCH_RESCAN_INTERVAL):
+        self.folder = Path(folder)
+        self.suffix = suffix
+        self.events = events
+        self.rescan_interval = rescan_interval
+        self.queue = queue.Queue()
+        self._stop = threading.Event()
+        self._process = None
+        self._threads = []
+
+    def start(self):
+        """Inicia inotifywait e a varredura de segurança (faz uma varredura inicial)"""
+        self.folder.mkdir(parents=True, exist_ok=True)
+        rescan_interval = self.rescan_interval
+        if shutil.which("inotifywait"):
+            cmd = ["inotifywait", "-m", "-q", "--format", "%f"]
+            for event in self.events:
+                cmd += ["-e", event]
+            cmd.append(str(self.folder))
+            self._process = subprocess.Popen(
+                cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                text=True, bufsize=1,
+            )
+            self._spawn(self._read_events)
+            mode = f"inotify (varredura de segurança a cada {rescan_interval:.0f}s)"
+        else:
+            rescan_interval = WATCH_POLL_INTERVAL
+            mode = f"varredura a cada {rescan_interval:.0f}s (inotifywait indisponível)"
+
+        # Varredura inicial: o que já estava na pasta antes do start
+        self.rescan(min_age=0 if self._process else WATCH_RESCAN_MIN_AGE)
+        self._spawn(self._rescan_loop, rescan_interval)
+        print(f"👁 Monitorando {self.folder} via {mode}")
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._process and self._process.poll() is None:
+            self._process.terminate()
+
+    def _spawn(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _matches(self, name):
+        return name.endswith(self.suffix) and not name.startswith(".")
+
+    def _read_events(self):
+        for line in self._process.stdout:
+            name = line.rstrip("\n")
+            if self._matches(name):
+                self.queue.put(self.folder / name)
+            if self._stop.is_set():
+                break
+        if not self._stop.is_set():
+            print("⚠ inotifywait encerrou; seguindo apenas com a varredura periódica")
+
+    def _rescan_loop(self, interval):
+        while not self._stop.wait(interval):
+            self.rescan()
+
+    def rescan(self, min_age=WATCH_RESCAN_MIN_AGE):
+        """Enfileira os arquivos presentes na pasta (rede de segurança)"""
+        newest = time.time() - min_age
+        try:
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    if not (self._matches(entry.name) and entry.is_file()):
+                        continue
+                    if entry.stat().st_mtime <= newest:
+                        self.queue.put(Path(entry.path))
+        except OSError as e:
+            print(f"⚠ Falha na varredura de {self.folder}: {e}")
+
+    def get_batch(self, timeout=1.0, max_items=500, linger=0.05):
+        """
+        Espera até `timeout` pelo primeiro arquivo e junta o que chegar em
+        seguida (até `linger` s sem novidades), sem repetir caminhos.
+        Retorna lista ordenada (pode ser vazia).
+        """
+        try:
+            first = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return []
+        batch = {first}
+        deadline = time.monotonic() + linger
+        while len(batch) < max_items:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self.queue.get(timeout=remaining)
+                else:
+                    item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item not in batch:
+                batch.add(item)
+                deadline = time.monotonic() + linger
+        return sorted(batch)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Decodificação de quadros para o visualizador
+Cada quadro é decodificado sozinho (pydicom.pixels.pixel_array com index):
+um objeto multiframe comprimido não é aberto inteiro para mostrar um quadro.
+As sintaxes comprimidas (JPEG, JPEG-LS, JPEG 2000, RLE, Deflate) usam os
+plugins pylibjpeg/pyjpegls. A decodificação roda num pool de processos e os
+quadros prontos ficam num LRU limitado em bytes, por (SOPInstanceUID, quadro).
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from pydicom import Dataset
+from pydicom.pixels import apply_color_lut, pixel_array
+
+# Processos de decodificação (0 = no próprio processo)
+DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", str(min(2, os.cpu_count() or 1))))
+# Quadros decodificados mantidos em memória
+DECODED_CACHE_MB = int(os.getenv("DECODED_CACHE_MB", "256"))
+
+
+def rescale_to_int16(pixels, slope=1.0, intercept=0.0):
+    """
+    Valores da modalidade (pixels * slope + intercept) codificados em int16:
+    (códigos, escala, deslocamento), com valor = código * escala + deslocamento.
+    Inteiros que cabem em int16 (ex.: HU) ficam exatos, com escala 1 e
+    deslocamento 0; inteiros numa faixa de até 65536 valores só são deslocados.
+    O resto (slope fracionário de PET/NM/dose, faixas maiores) tem a faixa
+    real do quadro espalhada nos 65536 códigos, em vez de saturar
+    """
+    slope = float(slope or 1)
+    intercept = float(intercept or 0)
+    if slope.is_integer() and intercept.is_integer() and pixels.dtype.kind in "iub":
+        values = pixels.astype(np.int64) * int(slope) + int(intercept)
+        low, high = int(values.min()), int(values.max())
+        if -32768 <= low and high <= 32767:
+            return values.astype(np.int16), 1.0, 0.0
+        if high - low <= 65535:
+            offset = low + 32768
+            return (values - offset).astype(np.int16), 1.0, float(offset)
+    else:
+        values = pixels * slope + intercept
+    low, high = float(values.min()), float(values.max())
+    scale = (high - low) / 65535 or 1.0
+    codes = np.clip(np.rint((values - low) / scale) - 32768, -32768, 32767)
+    return codes.astype(np.int16), scale, low + 32768 * scale
+
+
+def to_rgb8(pixels, bits_stored=8):
+    """RGB com mais de 8 bits (ou tabela de paleta de 16 bits) reduzido a uint8"""
+    if pixels.dtype == np.uint8:
+        return pixels
+    shift = max(0, int(bits_stored or 8) - 8)
+    if pixels.dtype == np.uint16 and shift == 0 and pixels.max(initial=0) > 255:
+        shift = 8  # Paleta com entradas de 16 bits
+    return (pixels >> shift).astype(np.uint8)
+
+
+def decode_frame(path, frame=0):
+    """
+    Quadro `frame` como (pixels, escala, deslocamento): tons de cinza em
+    códigos int16 (ver rescale_to_int16) ou cor em RGB uint8 (YBR já
+    convertido pelo pydicom; PALETTE COLOR pela tabela; escala 1). None se
+    não houver imagem ou a sintaxe não tiver decodificador (ex.: MPEG/HEVC)
+    """
+    # ds_out recebe o grupo 0028 (Rescale*, fotometria, paleta) na mesma leitura
+    ds = Dataset()
+    try:
+        pixels = pixel_array(path, index=frame, ds_out=ds)
+        if ds.get("PhotometricInterpretation") == "PALETTE COLOR":
+            pixels = apply_color_lut(pixels, ds)
+    except Exception:
+        return None
+    if pixels.ndim == 3 and pixels.shape[-1] == 3:
+        bits = 8 if ds.get("PhotometricInterpretation") == "PALETTE COLOR" else ds.get("BitsStored", 8)
+        return to_rgb8(pixels, bits), 1.0, 0.0
+    if pixels.ndim != 2:
+        return None
+    return rescale_to_int16(pixels, ds.get("RescaleSlope", 1), ds.get("RescaleIntercept", 0))
+
+
+def _decode_source(source):
+    path, _, frame = source[:3]
+    return decode_frame(path, frame)
+
+
+class FrameCache:
+    """LRU de quadros decodificados ((pixels, escala, deslocamento)) limitado pela soma de `nbytes`"""
+
+    def __init__(self, max_bytes=DECODED_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            frame = self._items.get(key)
+            if frame is not None:
+                self._items.move_to_end(key)
+            return frame
+
+    def put(self, key, frame):
+        if frame is None or frame[0].nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[0].nbytes
+            self._items[key] = frame
+            self.nbytes += frame[0].nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.nbytes -= evicted[0].nbytes
+
+
+class FrameDecoder:
+    """
+    Quadros por fonte (caminho, SOPInstanceUID, índice do quadro e,
+    opcionalmente, a versão do arquivo): do LRU ou decodificados no pool de
+    processos
+    """
+
+    def __init__(self, workers=DECODE_WORKERS, cache=None):
+        self.workers = workers
+        self.cache = cache if cache is not None else FrameCache()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    @staticmethod
+    def key(source):
+        path, sop_uid, frame = source[:3]
+        # A versão do arquivo (se houver) separa uma instância corrigida da antiga
+        return (sop_uid or str(path), frame, *source[3:])
+
+    def frame(self, source):
+        """Quadro de uma fonte ((pixels, escala, deslocamento)) ou None"""
+        return self.frames([source])[0]
+
+    def frames(self, sources):
+        """Quadros de várias fontes; as que faltam no LRU são decodificadas em paralelo"""
+        results = [self.cache.get(self.key(source)) for source in sources]
+        missing = [idx for idx, frame in enumerate(results) if frame is None]
+        if not missing:
+            return results
+        todo = [sources[idx] for idx in missing]
+        if self.enabled:
+            decoded = list(self._pool().map(_decode_source, todo))
+        else:
+            decoded = [_decode_source(source) for source in todo]
+        for idx, frame in zip(missing, decoded):
+            if frame is not None:
+                frame[0].flags.writeable = False
+                self.cache.put(self.key(sources[idx]), frame)
+            results[idx] = frame
+        return results
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
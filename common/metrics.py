@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Métricas no formato texto do Prometheus, sem dependências externas
+Contadores, gauges e histogramas com rótulos, servidos em
+http://<host>:METRICS_PORT/metrics (0 desliga o servidor).
+
+Com vários processos (workers do SCP na mesma porta), cada worker grava
+periodicamente um retrato do próprio registro em DICOM_ROOT/.metrics/ e o
+processo principal soma todos a cada coleta.
+"""
+
+import os
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+DICOM_ROOT = Path(os.getenv("DICOM_ROOT", "/home/dicom"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Retratos dos workers (um arquivo por worker)
+METRICS_FOLDER = DICOM_ROOT / ".metrics"
+METRICS_DUMP_INTERVAL = float(os.getenv("METRICS_DUMP_INTERVAL", "5"))
+
+# Latências (s): de um C-STORE de milissegundos a reenvios de uma hora
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60, 120, 300, 600, 1800, 3600)
+
+
+class Metric:
+    """Valores por combinação de rótulos (na ordem de `labelnames`)"""
+
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def snapshot(self):
+        with self._lock:
+            values = [[list(key), value] for key, value in self._values.items()]
+        return {'kind': self.kind, 'help': self.help,
+                'labelnames': list(self.labelnames), 'values': values}
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """Valor por rótulos: [contagem por faixa..., soma, total]"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[idx] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        snapshot['buckets'] = list(self.buckets)
+        return snapshot
+
+
+class Registry:
+    """Métricas do processo + coletores chamados a cada coleta (gauges derivados)"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._get(Counter, name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._get(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def add_collector(self, collect):
+        """`collect()` atualiza gauges logo antes de cada coleta"""
+        self._collectors.append(collect)
+
+    def snapshot(self, collect=True):
+        """Retrato serializável (JSON) de todas as métricas"""
+        if collect:
+            for collect_fn in self._collectors:
+                try:
+                    collect_fn()
+                except Exception as e:
+                    print(f"⚠ Falha ao coletar métricas: {e}")
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+add_collector = REGISTRY.add_collector
+
+
+def merge_snapshots(snapshots):
+    """Soma retratos de vários processos (contadores, gauges e faixas)"""
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, {**metric, 'values': {}})
+            for labels, value in metric['values']:
+                key = tuple(labels)
+                current = target['values'].get(key)
+                if current is None:
+                    target['values'][key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    target['values'][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target['values'][key] = current + value
+    return merged
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(merged):
+    """Formato de exposição texto do Prometheus (0.0.4)"""
+    lines = []
+    for name in sorted(merged):
+        metric = merged[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        names = metric['labelnames']
+        for key in sorted(metric['values']):
+            value = metric['values'][key]
+            if metric['kind'] != "histogram":
+                lines.append(f"{name}{_labels(names, key)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric['buckets'], value):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(names, key, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(names, key, [('le', '+Inf')])} {value[-1]}")
+            lines.append(f"{name}_sum{_labels(names, key)} {_number(value[-2])}")
+            lines.append(f"{name}_count{_labels(names, key)} {value[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def read_snapshots(folder=METRICS_FOLDER, pattern="*.json"):
+    """Retratos gravados pelos workers"""
+    snapshots = []
+    for path in sorted(Path(folder).glob(pattern)):
+        try:
+            with open(path, 'r') as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def write_snapshot(path):
+    """Grava o retrato deste processo (temporário + rename)"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(REGISTRY.snapshot(), f)
+    os.replace(tmp_path, path)
+
+
+def start_snapshot_writer(path, interval=METRICS_DUMP_INTERVAL):
+    """Thread que publica o retrato deste processo a cada `interval` s"""
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                write_snapshot(path)
+            except OSError as e:
+                print(f"⚠ Falha ao gravar métricas em {path}: {e}")
+
+    thread = threading.Thread(target=loop, name="metrics-writer", daemon=True)
+    thread.start()
+    return thread
+
+
+def start_metrics_server(port=METRICS_PORT, sources=None):
+    """
+    Serve /metrics numa thread. `sources()`: retratos extras (ex.: dos
+    workers) somados aos deste processo. Retorna o servidor ou None.
+    """
+    if port <= 0:
+        return None
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            snapshots = [REGISTRY.snapshot()] + (list(sources()) if sources else [])
+            body = render(merge_snapshots(snapshots)).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass  # Sem log por coleta
+
+    try:
+        server = ThreadingHTTPServer(("", port), Handler)
+    except OSError as e:
+        print(f"⚠ Métricas indisponíveis na porta {port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"📈 Métricas Prometheus em http://0.0.0.0:{port}/metrics")
+    return server
+
+
+# Métricas compartilhadas por SCU e SCP (cada serviço é um alvo do Prometheus)
+RECEIVED_FILES = counter("dicom_router_received_files_total",
+                         "Instâncias recebidas pelo SCP", ("calling_aet",))
+RECEIVED_BYTES = counter("dicom_router_received_bytes_total",
+                         "Bytes recebidos pelo SCP", ("calling_aet",))
+SENT_FILES = counter("dicom_router_sent_files_total",
+                     "Instâncias aceitas pelo destino (C-STORE ok)", ("destination",))
+SENT_BYTES = counter("dicom_router_sent_bytes_total",
+                     "Bytes enviados (após transcodificação) e aceitos pelo destino", ("destination",))
+SEND_FAILURES = counter("dicom_router_send_failures_total",
+                        "Entregas que falharam (voltam para a fila de reenvio)", ("destination",))
+SEND_RETRIES = counter("dicom_router_send_retries_total",
+                       "Reenvios tentados de entregas que já falharam", ("destination",))
+QUARANTINED = counter("dicom_router_quarantined_files_total",
+                      "Instâncias inválidas movidas para a quarentena")
+DISCOVER_SECONDS = histogram("dicom_router_discover_latency_seconds",
+                             "Da gravação da instância até o roteador pegá-la para envio")
+VALIDATE_SECONDS = histogram("dicom_router_validate_seconds",
+                             "Leitura e validação do cabeçalho, por instância")
+CSTORE_SECONDS = histogram("dicom_router_cstore_seconds",
+                           "Ida e volta de um C-STORE", ("destination",))
+END_TO_END_SECONDS = histogram("dicom_router_end_to_end_seconds",
+                               "Da recepção até a entrega aceita pelo destino", ("destination",))
+QUEUE_DEPTH = gauge("dicom_router_queue_depth",
+                    "Itens aguardando em cada fila", ("queue",))
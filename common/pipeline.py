@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Pipeline assíncrono em estágios (asyncio) com filas limitadas
+Cada estágio tem fila de entrada com tamanho máximo (contrapressão: quem
+produz espera quando ela enche), concorrência própria e contadores próprios,
+gravados periodicamente em DICOM_ROOT/.pipeline_stats.json: dá para ver
+qual estágio está saturado quando o backlog cresce.
+
+Trabalho bloqueante (rede, SQLite, arquivos) roda em threads via
+asyncio.to_thread; o loop só coordena.
+
+Encerramento: as fontes param de buscar trabalho, cada estágio drena a
+própria fila e só então repassa o fim ao próximo; nada do que já entrou
+no pipeline é descartado.
+"""
+
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from metrics import QUEUE_DEPTH, add_collector, counter, gauge
+
+PIPELINE_STATS_INTERVAL = float(os.getenv("PIPELINE_STATS_INTERVAL", "15"))
+STATS_FILENAME = ".pipeline_stats.json"
+
+# Marca de fim repassada de estágio em estágio
+_STOP = object()
+
+# Métricas por estágio (Prometheus); a profundidade das filas vai em QUEUE_DEPTH
+STAGE_ITEMS = counter("dicom_router_stage_items_total",
+                      "Lotes processados por estágio do pipeline", ("stage",))
+STAGE_ERRORS = counter("dicom_router_stage_errors_total",
+                       "Erros por estágio do pipeline", ("stage",))
+STAGE_BUSY = counter("dicom_router_stage_busy_seconds_total",
+                     "Tempo ocupado por estágio (somando os workers)", ("stage",))
+STAGE_BLOCKED = counter("dicom_router_stage_blocked_seconds_total",
+                        "Tempo esperando vaga na fila do estágio seguinte", ("stage",))
+STAGE_ACTIVE = gauge("dicom_router_stage_active",
+                     "Workers ocupados por estágio", ("stage",))
+STAGE_CONCURRENCY = gauge("dicom_router_stage_concurrency",
+                          "Workers configurados por estágio", ("stage",))
+
+
+class _Node:
+    """Contadores comuns a fontes e estágios"""
+
+    kind = "stage"
+
+    def __init__(self, name, concurrency=1):
+        self.name = name
+        self.concurrency = max(1, int(concurrency))
+        self.downstream = None
+        self.active = 0
+        self.processed = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.last_error = None
+        self._last_busy = 0.0
+        self._last_processed = 0
+        self.queue = None
+
+    def _record(self, processed=0, errors=0, busy=0.0, blocked=0.0, error=None):
+        """Soma nos contadores do estágio e nas métricas"""
+        self.processed += processed
+        self.errors += errors
+        self.busy_seconds += busy
+        self.blocked_seconds += blocked
+        if error is not None:
+            self.last_error = error
+        for metric, amount in ((STAGE_ITEMS, processed), (STAGE_ERRORS, errors),
+                               (STAGE_BUSY, busy), (STAGE_BLOCKED, blocked)):
+            if amount:
+                metric.inc(amount, stage=self.name)
+
+    def to(self, stage):
+        """Liga a saída deste nó à entrada de `stage`; retorna `stage`"""
+        self.downstream = stage
+        return stage
+
+    async def _emit(self, items):
+        """Entrega itens ao próximo estágio (espera com a fila cheia)"""
+        if self.downstream is None or not items:
+            return
+        started = time.monotonic()
+        for item in items:
+            await self.downstream.queue.put(item)
+        self._record(blocked=time.monotonic() - started)
+
+    async def _finish(self):
+        if self.downstream is not None:
+            for _ in range(self.downstream.concurrency):
+                await self.downstream.queue.put(_STOP)
+
+    def snapshot(self, elapsed):
+        busy = self.busy_seconds - self._last_busy
+        processed = self.processed - self._last_processed
+        self._last_busy, self._last_processed = self.busy_seconds, self.processed
+        return {
+            'name': self.name,
+            'kind': self.kind,
+            'concurrency': self.concurrency,
+            'active': self.active,
+            'queue': self.queue.qsize() if self.queue else None,
+            'queue_max': self.queue.maxsize if self.queue else None,
+            'processed': self.processed,
+            'processed_recent': processed,
+            'errors': self.errors,
+            'busy_seconds': round(self.busy_seconds, 3),
+            'blocked_seconds': round(self.blocked_seconds, 3),
+            # Fração do tempo em que os workers do estágio estiveram ocupados
+            'utilization': round(min(1.0, busy / (elapsed * self.concurrency)), 3) if elapsed > 0 else 0.0,
+            'last_error': self.last_error,
+        }
+
+
+class Stage(_Node):
+    """
+    Estágio: `handler(item)` (bloqueante, roda em thread) processa um item
+    da fila e devolve a lista de itens para o próximo estágio (ou None).
+    Se o handler levantar exceção, `on_error(item, erro)` (também em thread)
+    devolve o trabalho em andamento (arquivos reservados, entregas) para ser
+    retomado, em vez de perdê-lo até o próximo início.
+    """
+
+    def __init__(self, name, handler, concurrency=1, queue_size=8, on_error=None):
+        super().__init__(name, concurrency)
+        self.handler = handler
+        self.on_error = on_error
+        self.queue = asyncio.Queue(maxsize=max(1, int(queue_size)))
+
+    def free_slots(self):
+        return self.queue.maxsize - self.queue.qsize()
+
+    async def _worker(self):
+        while True:
+            item = await self.queue.get()
+            if item is _STOP:
+                return
+            self.active += 1
+            started = time.monotonic()
+            try:
+                result = await asyncio.to_thread(self.handler, item)
+            except Exception as e:
+                self._record(errors=1, error=str(e))
+                print(f"❌ Estágio {self.name}: {e}")
+                result = None
+                if self.on_error is not None:
+                    try:
+                        await asyncio.to_thread(self.on_error, item, e)
+                    except Exception as error:
+                        print(f"❌ Estágio {self.name}: falha ao devolver o item: {error}")
+            else:
+                self._record(processed=1)
+            finally:
+                self._record(busy=time.monotonic() - started)
+                self.active -= 1
+            await self._emit(result)
+
+    async def run(self, stopping):
+        await asyncio.gather(*(self._worker() for _ in range(self.concurrency)))
+        await self._finish()
+
+
+class Source(_Node):
+    """
+    Fonte: `poll(free_slots)` (bloqueante, roda em thread) busca trabalho
+    novo e devolve a lista de itens. Sem resultado, espera `idle_wait` s
+    ou até wake(). Para de buscar quando o pipeline começa a encerrar.
+    """
+
+    kind = "source"
+
+    def __init__(self, name, poll, idle_wait=1.0):
+        super().__init__(name)
+        self.poll = poll
+        self.idle_wait = idle_wait
+        self._wake = None
+        self._loop = None
+
+    def wake(self):
+        """Pede nova busca imediata (pode ser chamado de qualquer thread)"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def run(self, stopping):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        while not stopping.is_set():
+            self._wake.clear()
+            started = time.monotonic()
+            try:
+                items = await asyncio.to_thread(self.poll, max(1, self.downstream.free_slots()))
+            except Exception as e:
+                self._record(errors=1, error=str(e))
+                print(f"❌ Fonte {self.name}: {e}")
+                items = []
+            if items:
+                # Busca vazia é espera por trabalho, não conta como ocupação
+                self._record(processed=len(items), busy=time.monotonic() - started)
+                await self._emit(items)
+                continue
+            if self.idle_wait > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.idle_wait)
+                except asyncio.TimeoutError:
+                    pass
+        await self._finish()
+
+
+class Pipeline:
+    """Conjunto de fontes e estágios executados até stop()"""
+
+    def __init__(self, nodes, stats_root=None, threads=None):
+        self.nodes = list(nodes)
+        self.stats_file = Path(stats_root) / STATS_FILENAME if stats_root else None
+        self.threads = threads or sum(n.concurrency for n in self.nodes) + 4
+        self._stopping = None
+        self._loop = None
+        self._started = time.time()
+        add_collector(self._collect_metrics)
+
+    def _collect_metrics(self):
+        """Gauges lidos na hora da coleta (chamado pela thread do /metrics)"""
+        for node in self.nodes:
+            STAGE_ACTIVE.set(node.active, stage=node.name)
+            STAGE_CONCURRENCY.set(node.concurrency, stage=node.name)
+            if node.queue is not None:
+                QUEUE_DEPTH.set(node.queue.qsize(), queue=node.name)
+
+    def stop(self):
+        """Começa o encerramento gracioso (pode ser chamado de qualquer thread)"""
+        if self._loop is not None and not self._stopping.is_set():
+            print("⚠ Encerrando pipeline: drenando estágios...")
+            self._loop.call_soon_threadsafe(self._stopping.set)
+            for node in self.nodes:
+                if isinstance(node, Source):
+                    node.wake()
+
+    def snapshot(self, elapsed):
+        return {
+            'updated_at': time.time(),
+            'started_at': self._started,
+            'stages': [node.snapshot(elapsed) for node in self.nodes],
+        }
+
+    def _write_stats(self, stats):
+        if self.stats_file is None:
+            return
+        tmp_file = self.stats_file.with_name(f"{STATS_FILENAME}.tmp")
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump(stats, f, indent=2)
+            os.replace(tmp_file, self.stats_file)
+        except OSError as e:
+            print(f"⚠ Falha ao gravar {self.stats_file.name}: {e}")
+
+    async def _report(self, done):
+        last = time.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(done.wait(), timeout=PIPELINE_STATS_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            now = time.monotonic()
+            stats = self.snapshot(now - last)
+            last = now
+            await asyncio.to_thread(self._write_stats, stats)
+            if any(stage['processed_recent'] for stage in stats['stages']):
+                print("📊 " + " | ".join(format_stage(stage) for stage in stats['stages']))
+            if done.is_set():
+                return
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop.set_default_executor(
+            ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="pipeline")
+        )
+        self._stopping = asyncio.Event()
+        done = asyncio.Event()
+        # O último relatório sai depois da drenagem
+        reporter = asyncio.create_task(self._report(done))
+        await asyncio.gather(*(node.run(self._stopping) for node in self.nodes))
+        done.set()
+        await reporter
+
+
+def format_stage(stage):
+    """Uma linha curta por estágio: fila, ativos e utilização"""
+    queue = f" fila {stage['queue']}/{stage['queue_max']}" if stage['queue_max'] else ""
+    return (f"{stage['name']}{queue} ativos {stage['active']}/{stage['concurrency']} "
+            f"uso {stage['utilization'] * 100:.0f}%")
+
+
+def load_pipeline_stats(root):
+    """Últimas estatísticas gravadas (dashboard); {} se não houver"""
+    stats_file = Path(root) / STATS_FILENAME
+    try:
+        with open(stats_file, 'r') as f:
+            return json.load(f)
+    except Exception:
+        return {}
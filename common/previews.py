@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Prévias por série geradas na ingestão (miniaturas do visualizador)
+Para cada série, alguns quadros espaçados (fatias ou quadros de multiframe)
+são decodificados pelo frame_decoder, reduzidos a PREVIEW_SIZE px e
+mostrados com o mesmo perfil de exibição do visualizador (display.py: janela
+do cabeçalho, VOI LUT, partes moles no CT ou automática; cor em RGB). A pilha
+uint8 compacta vai para <pasta do estudo>/.preview/<SeriesInstanceUID>.npy,
+com um .json ao lado. O dashboard mostra as prévias sem decodificar nenhum DICOM.
+
+Roda como estágio de baixa prioridade do SCU: processos com nice 19 e só
+séries que pararam de receber instâncias há PREVIEW_SETTLE s.
+"""
+
+import os
+import json
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from display import apply_lut, frame_lut, profile_headers, series_profile
+from frame_decoder import decode_frame
+
+# Processos de geração de prévias (0 desliga)
+PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", "1"))
+PREVIEW_SIZE = int(os.getenv("PREVIEW_SIZE", "96"))
+PREVIEW_TILES = int(os.getenv("PREVIEW_TILES", "12"))
+# Série sem instâncias novas há este tempo (s) é considerada completa
+PREVIEW_SETTLE = float(os.getenv("PREVIEW_SETTLE", "20"))
+PREVIEW_NICE = 19
+
+PREVIEW_FOLDER = ".preview"
+
+
+def _lower_priority():
+    try:
+        os.nice(PREVIEW_NICE)
+    except OSError:
+        pass
+
+
+def downsample(pixels, size):
+    """
+    Reduz por média de blocos e encaixa (proporção mantida) num quadrado
+    `size`, no tipo de `pixels` (códigos int16 ou RGB uint8)
+    """
+    dtype = pixels.dtype
+    factor = max(1, min(pixels.shape[:2]) // size)
+    if factor > 1:
+        rows = pixels.shape[0] // factor * factor
+        cols = pixels.shape[1] // factor * factor
+        pixels = pixels[:rows, :cols].reshape(
+            rows // factor, factor, cols // factor, factor, *pixels.shape[2:]).mean(axis=(1, 3))
+    scale = size / max(pixels.shape[:2])
+    out_rows = max(1, round(pixels.shape[0] * scale))
+    out_cols = max(1, round(pixels.shape[1] * scale))
+    row_idx = np.minimum((np.arange(out_rows) / scale).astype(int), pixels.shape[0] - 1)
+    col_idx = np.minimum((np.arange(out_cols) / scale).astype(int), pixels.shape[1] - 1)
+    small = np.rint(pixels[row_idx][:, col_idx]).astype(dtype)
+    tile = np.full((size, size, *pixels.shape[2:]), small.min(), dtype=dtype)
+    top, left = (size - out_rows) // 2, (size - out_cols) // 2
+    tile[top:top + out_rows, left:left + out_cols] = small
+    return tile
+
+
+def build_series_preview(study_folder, series, entry, size=PREVIEW_SIZE, tiles=PREVIEW_TILES):
+    """
+    Gera a prévia de uma série (roda no processo de prévias).
+    `entry`: a série no índice do catálogo (study_catalog.series_index:
+    filenames na ordem de exibição, frame_counts e windows).
+    Retorna o caminho do .npy ou None se nenhum quadro tiver imagem
+    """
+    study_folder = Path(study_folder)
+    paths = [str(study_folder / name) for name in entry['filenames']]
+    # Um quadro por fatia do visualizador: multiframe entra quadro a quadro
+    sources = [(path, frame) for path, count in zip(paths, entry['frame_counts'])
+               for frame in range(count)]
+    windows = [window for window, count in zip(entry['windows'], entry['frame_counts'])
+               for _ in range(count)]
+    step = max(1, len(sources) / tiles)
+    picks = sorted({int(idx * step) for idx in range(min(tiles, len(sources)))})
+    frames, chosen = [], []
+    for idx in picks:
+        frame = decode_frame(*sources[idx])
+        if frame is None:
+            continue
+        pixels, scale, offset = frame
+        # Cor ou cinza conforme o primeiro quadro decodificado
+        if frames and pixels.ndim != frames[0][0].ndim:
+            continue
+        frames.append((downsample(pixels, size), scale, offset))
+        chosen.append(idx)
+    if not frames:
+        return None
+
+    color = frames[0][0].ndim == 3
+    # Colorida não tem janela: sem amostras para a janela automática
+    profile = series_profile(profile_headers(paths), () if color else frames,
+                             series.get('modality') or '', windows)
+    if color:
+        stack = np.stack([tile for tile, _, _ in frames])
+    else:
+        stack = np.stack([
+            apply_lut(tile, frame_lut(profile, idx, (scale, offset)))
+            for idx, (tile, scale, offset) in zip(chosen, frames)
+        ])
+
+    folder = study_folder / PREVIEW_FOLDER
+    folder.mkdir(exist_ok=True)
+    series_uid = series['series_uid']
+    npy_path = folder / f"{series_uid}.npy"
+    tmp_path = folder / f".{series_uid}.npy.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, stack)
+    os.replace(tmp_path, npy_path)
+    # .json por último: é ele que publica a prévia
+    meta = {
+        'series_uid': series_uid,
+        'series_number': series.get('series_number'),
+        'series_description': series.get('series_description') or '',
+        'modality': series.get('modality') or '',
+        'image_count': len(sources),
+        'tiles': [{'index': idx, 'filename': Path(sources[idx][0]).name, 'frame': sources[idx][1]}
+                  for idx in chosen],
+        'window': None if color else list(profile['window']),
+        'window_source': 'cor' if color else profile['source'],
+        'size': size,
+        'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    tmp_path = folder / f".{series_uid}.json.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, folder / f"{series_uid}.json")
+    return str(npy_path)
+
+
+def load_previews(study_folder):
+    """Prévias publicadas de um estudo, por número de série"""
+    folder = Path(study_folder) / PREVIEW_FOLDER
+    previews = []
+    try:
+        meta_paths = list(folder.glob("*.json"))
+    except OSError:
+        return []
+    for meta_path in meta_paths:
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            meta['path'] = str(meta_path.with_suffix(".npy"))
+            meta['mtime'] = meta_path.stat().st_mtime
+        except (OSError, ValueError):
+            continue
+        previews.append(meta)
+    previews.sort(key=lambda meta: (meta.get('series_number') is None,
+                                    meta.get('series_number') or 0, meta['series_uid']))
+    return previews
+
+
+class PreviewBuilder:
+    """Pool de processos de baixa prioridade (nice 19) que gera as prévias"""
+
+    def __init__(self, workers=PREVIEW_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     initializer=_lower_priority)
+            return self._executor
+
+    def build(self, study_folder, series, entry):
+        """Gera a prévia e espera; retorna (caminho ou None, segundos)"""
+        started = time.monotonic()
+        future = self._pool().submit(build_series_preview, str(study_folder), series, entry)
+        return future.result(), time.monotonic() - started
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
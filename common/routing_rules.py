@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Roteamento por regras de tags DICOM com vários destinos
+As regras (JSON) são compiladas uma vez em funções de teste; cada instância é
+avaliada contra o cabeçalho já lido (microssegundos), e cada destino casado
+vira uma entrega separada na fila do catálogo.
+
+Formato de ROUTING_RULES_FILE (ver routing_rules.example.json):
+    {
+      "destinations": {"ia": {"host": "10.0.0.5", "port": 104, "aet": "IA",
+                              "transcode": ["jpeg-ls", "rle"]}},
+      "rules": [
+        {"name": "CT tórax", "match": {"Modality": ["CT"],
+                                       "StudyDescription": "t[oó]rax"},
+         "destinations": ["ia", "default"], "stop": true}
+      ]
+    }
+Condição com lista: valor igual a um dos itens (sem diferenciar maiúsculas);
+com texto: expressão regular (re.search, sem diferenciar maiúsculas);
+com true/false: tag presente/ausente. Todas as condições devem casar.
+Regras casadas somam destinos; "stop" encerra a avaliação. Além das tags,
+valem CallingAET e CalledAET da associação de entrada.
+Sem arquivo, tudo vai para o destino "default" (TARGET_HOST/PORT/AET).
+"transcode" (opcional) lista, em ordem de preferência, as syntaxes sem perdas
+para recodificar antes do envio (ver transcoder.py).
+"""
+
+import os
+import re
+import json
+from collections import namedtuple
+from pathlib import Path
+
+from pydicom.multival import MultiValue
+
+from study_catalog import DEFAULT_DESTINATION
+from transcoder import parse_syntaxes
+
+DICOM_ROOT = Path(os.getenv("DICOM_ROOT", "/home/dicom"))
+ROUTING_RULES_FILE = Path(os.getenv("ROUTING_RULES_FILE", str(DICOM_ROOT / "routing_rules.json")))
+
+# Destino padrão (o mesmo das versões com destino único)
+TARGET_HOST = os.getenv("TARGET_HOST", "192.168.10.16")
+TARGET_PORT = os.getenv("TARGET_PORT", "4243")
+TARGET_AET = os.getenv("TARGET_AET", "ZEROCLICK")
+# Transcodificação sem perdas para o destino padrão (ex.: "jpeg-ls,rle")
+TARGET_TRANSCODE = os.getenv("TARGET_TRANSCODE", "")
+
+# Campos da associação de entrada que também podem ser usados nas regras
+ASSOCIATION_FIELDS = {"CallingAET", "CalledAET"}
+
+Destination = namedtuple("Destination", "name host port aet transcode", defaults=((),))
+Rule = namedtuple("Rule", "name conditions destinations stop")
+
+
+def _tag_values(ds, keyword, association):
+    """
+    Valores da tag como textos (tupla vazia se ausente). `ds` pode ser o
+    Dataset ou o dict `tags` do resumo de cabeçalho (header_tag_values)
+    """
+    if keyword in ASSOCIATION_FIELDS:
+        value = association.get(keyword)
+    else:
+        value = ds.get(keyword)
+    if value is None or value == "":
+        return ()
+    if isinstance(value, (list, tuple, MultiValue)):
+        return tuple(str(v).strip() for v in value)
+    return (str(value).strip(),)
+
+
+def _compile_condition(keyword, expected):
+    """Transforma uma condição do JSON em função(valores) -> bool"""
+    if isinstance(expected, bool):
+        return lambda values: bool(values) == expected
+    if isinstance(expected, list):
+        allowed = frozenset(str(item).strip().upper() for item in expected)
+        return lambda values: any(v.upper() in allowed for v in values)
+    try:
+        pattern = re.compile(str(expected), re.IGNORECASE)
+    except re.error as e:
+        raise ValueError(f"regex inválida em {keyword}: {e}") from e
+    return lambda values: any(pattern.search(v) for v in values)
+
+
+def compile_rules(config):
+    """Valida e compila a configuração; retorna (destinos, regras)"""
+    destinations = {
+        DEFAULT_DESTINATION: Destination(
+            DEFAULT_DESTINATION, TARGET_HOST, int(TARGET_PORT), TARGET_AET,
+            parse_syntaxes(TARGET_TRANSCODE),
+        ),
+    }
+    for name, dest in (config.get("destinations") or {}).items():
+        destinations[name] = Destination(
+            name, dest["host"], int(dest["port"]), dest["aet"],
+            parse_syntaxes(dest.get("transcode") or ()),
+        )
+
+    rules = []
+    for idx, rule in enumerate(config.get("rules") or [], start=1):
+        name = rule.get("name") or f"regra {idx}"
+        targets = tuple(rule.get("destinations") or ())
+        unknown = [t for t in targets if t not in destinations]
+        if unknown:
+            raise ValueError(f"{name}: destino(s) não definido(s): {', '.join(unknown)}")
+        conditions = tuple(
+            (keyword, _compile_condition(keyword, expected))
+            for keyword, expected in (rule.get("match") or {}).items()
+        )
+        rules.append(Rule(name, conditions, targets, bool(rule.get("stop"))))
+
+    if not config.get("rules"):
+        rules.append(Rule("padrão", (), (DEFAULT_DESTINATION,), True))
+    return destinations, rules
+
+
+class Router:
+    """Regras compiladas + destinos; `route()` devolve os destinos de um cabeçalho"""
+
+    def __init__(self, config=None, source="padrão"):
+        self.destinations, self.rules = compile_rules(config or {})
+        self.source = source
+        # Tags lidas pelas regras (vão no resumo do cabeçalho)
+        self.keywords = tuple(sorted({
+            keyword for rule in self.rules for keyword, _ in rule.conditions
+        } - ASSOCIATION_FIELDS))
+
+    @classmethod
+    def from_file(cls, path=ROUTING_RULES_FILE):
+        path = Path(path)
+        if not path.exists():
+            return cls()
+        with open(path, "r") as f:
+            return cls(json.load(f), source=str(path))
+
+    def route(self, ds, calling_aet=None, called_aet=None):
+        """Nomes dos destinos (sem repetição, na ordem das regras); `ds`: Dataset ou tags"""
+        association = {"CallingAET": calling_aet, "CalledAET": called_aet}
+        matched = []
+        for rule in self.rules:
+            if all(test(_tag_values(ds, keyword, association))
+                   for keyword, test in rule.conditions):
+                for name in rule.destinations:
+                    if name not in matched:
+                        matched.append(name)
+                if rule.stop:
+                    break
+        return matched
+
+    def describe(self):
+        """Resumo para log de inicialização"""
+        lines = [f"Regras de roteamento ({self.source}):"]
+        for rule in self.rules:
+            keys = ", ".join(keyword for keyword, _ in rule.conditions) or "tudo"
+            stop = " [stop]" if rule.stop else ""
+            lines.append(f"  • {rule.name}: {keys} → {', '.join(rule.destinations)}{stop}")
+        return "\n".join(lines)
+
+
+def load_router(path=ROUTING_RULES_FILE):
+    """Carrega as regras; com arquivo inválido mantém só o destino padrão"""
+    try:
+        return Router.from_file(path)
+    except Exception as e:
+        print(f"❌ Regras de roteamento inválidas em {path}: {e}; usando só o destino padrão")
+        return Router()
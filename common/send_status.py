@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Status de envio por estudo (.send_status.json), exibido pelo dashboard
+Atualizado pelo SCU e pelo encaminhamento cut-through do SCP, em processos
+diferentes: cada atualização é feita sob flock e gravada com rename atômico.
+"""
+
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+STATUS_FILENAME = ".send_status.json"
+LOCK_FILENAME = ".send_status.lock"
+
+# flock é por processo; entre threads do mesmo processo serializa aqui
+_THREAD_LOCK = threading.Lock()
+
+
+def load_send_status(root):
+    """Carrega status de envio"""
+    status_file = Path(root) / STATUS_FILENAME
+    if status_file.exists():
+        try:
+            with open(status_file, 'r') as f:
+                return json.load(f)
+        except Exception:
+            return {}
+    return {}
+
+
+def save_send_status(root, status):
+    """Salva status de envio (arquivo temporário + rename)"""
+    status_file = Path(root) / STATUS_FILENAME
+    tmp_file = status_file.with_name(f"{STATUS_FILENAME}.tmp")
+    try:
+        with open(tmp_file, 'w') as f:
+            json.dump(status, f, indent=2)
+        os.replace(tmp_file, status_file)
+    except Exception as e:
+        print(f"Erro ao salvar status: {e}")
+
+
+@contextmanager
+def _locked(root):
+    with _THREAD_LOCK, open(Path(root) / LOCK_FILENAME, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def reset_study_status(root, folder_name, message=''):
+    """Reenvio agendado: o estudo volta a pendente, com as contagens zeradas"""
+    with _locked(root):
+        status = load_send_status(root)
+        status[folder_name] = {
+            'status': 'pendente',
+            'message': message,
+            'sent_count': 0,
+            'failed_count': 0,
+            'total_count': 0,
+            'last_update': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+        save_send_status(root, status)
+
+
+def update_study_status(root, folder_name, results, counts):
+    """
+    Atualiza status de envio do estudo
+    `results`: lista de (arquivo, ok, mensagem), um item por instância
+    `counts`: entregas do estudo no catálogo (StudyCatalog.delivery_counts):
+    cada arquivo e destino conta uma vez, e um reenvio sobrescreve a falha
+    """
+    if not results:
+        return
+    with _locked(root):
+        status = load_send_status(root)
+
+        if folder_name not in status:
+            status[folder_name] = {
+                'status': 'pendente',
+                'sent_count': 0,
+                'failed_count': 0,
+                'total_count': 0,
+                'last_update': ''
+            }
+        study_status = status[folder_name]
+        # Aviso do reenvio agendado (dashboard) sai com o primeiro resultado
+        study_status.pop('message', None)
+        failed_instances = study_status.setdefault('failed_instances', {})
+
+        for filename, sent_success, message in results:
+            if sent_success:
+                failed_instances.pop(filename, None)
+            else:
+                failed_instances[filename] = message
+        study_status['sent_count'] = counts['sent']
+        study_status['failed_count'] = counts['failed']
+        study_status['total_count'] = counts['total']
+
+        # Estado do estudo pelo acumulado (lotes, workers e destinos terminam
+        # em qualquer ordem): falha enquanto algum arquivo seguir com falha
+        study_status['status'] = 'falha' if failed_instances else 'enviado'
+        study_status['last_update'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        save_send_status(root, status)
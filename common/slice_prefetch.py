@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Pré-carregamento de fatias do visualizador
+Uma thread em segundo plano decodifica e prepara as fatias em volta da posição
+atual, primeiro no sentido da rolagem, e guarda o resultado (pixels para o
+navegador ou PNG janelado do cine) num cache limitado em bytes. Ao mover o slider (ou no cine) a fatia seguinte em geral
+já está pronta; o que faltar é renderizado na hora e também vai ao cache.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+# Fatias prontas mantidas em memória pelo processo
+PREFETCH_CACHE_MB = int(os.getenv("PREFETCH_CACHE_MB", "64"))
+# Fatias pré-carregadas à frente (sentido da rolagem) e atrás
+PREFETCH_AHEAD = int(os.getenv("PREFETCH_AHEAD", "24"))
+PREFETCH_BEHIND = int(os.getenv("PREFETCH_BEHIND", "6"))
+
+
+def prefetch_order(center, direction, total, ahead=PREFETCH_AHEAD, behind=PREFETCH_BEHIND):
+    """
+    Índices a pré-carregar em volta de `center`, por prioridade: três à
+    frente para cada um atrás (`direction` +1/-1; 0 = parado, alterna os lados)
+    """
+    if direction == 0:
+        ahead = behind = max(ahead, behind) // 2 or 1
+        direction = 1
+    forward = [center + direction * step for step in range(1, ahead + 1)]
+    backward = [center - direction * step for step in range(1, behind + 1)]
+    order = []
+    while forward or backward:
+        order.extend(forward[:3])
+        del forward[:3]
+        if backward:
+            order.append(backward.pop(0))
+    return [idx for idx in order if 0 <= idx < total]
+
+
+class SliceCache:
+    """LRU de fatias prontas (bytes) limitado pela soma dos tamanhos"""
+
+    def __init__(self, max_bytes=PREFETCH_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        if data is None or len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.nbytes -= len(old)
+            self._items[key] = data
+            self.nbytes += len(data)
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.nbytes -= len(evicted)
+
+
+class SlicePrefetcher:
+    """
+    Renderiza fatias de um volume (volume_cache.Volume) para o cache.
+    `render(volume, index, *params)` devolve os bytes da fatia ou None;
+    `params` distinguem variantes (ex.: WC/WW do PNG janelado).
+    `preload(volume, indices)`, se dado, recebe a fatia da vez e as `batch`
+    seguintes do plano antes de renderizar (ex.: decodificar em paralelo).
+    Só o último pedido de `schedule` vale: rolar descarta o plano anterior
+    """
+
+    def __init__(self, render, cache=None, ahead=PREFETCH_AHEAD, behind=PREFETCH_BEHIND,
+                 preload=None, batch=4):
+        self.render = render
+        self.cache = cache if cache is not None else SliceCache()
+        self.ahead = ahead
+        self.behind = behind
+        self.preload = preload
+        self.batch = batch
+        self._plan = None
+        self._cond = threading.Condition()
+        self._thread = None
+
+    @staticmethod
+    def key(volume, index, *params):
+        return (volume.key, index, *params)
+
+    def get(self, volume, index, *params):
+        """Fatia: do cache ou renderizada agora (e guardada)"""
+        key = self.key(volume, index, *params)
+        data = self.cache.get(key)
+        if data is None:
+            data = self.render(volume, index, *params)
+            self.cache.put(key, data)
+        return data
+
+    def ready(self, volume, index, *params):
+        return self.key(volume, index, *params) in self.cache
+
+    def schedule(self, volume, center, direction, *params):
+        """Troca o plano da thread pelas fatias em volta de `center`"""
+        indices = prefetch_order(center, direction, len(volume), self.ahead, self.behind)
+        with self._cond:
+            self._plan = (volume, indices, params)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="slice-prefetch",
+                                                daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _next(self):
+        with self._cond:
+            while True:
+                if self._plan is not None:
+                    volume, indices, params = self._plan
+                    while indices:
+                        index = indices.pop(0)
+                        if not self.ready(volume, index, *params):
+                            return volume, index, params, indices[:self.batch]
+                    self._plan = None
+                self._cond.wait()
+
+    def _run(self):
+        while True:
+            volume, index, params, upcoming = self._next()
+            try:
+                if self.preload is not None:
+                    self.preload(volume, [index, *upcoming])
+                self.cache.put(self.key(volume, index, *params),
+                               self.render(volume, index, *params))
+            except Exception:
+                pass  # Fatia com problema: o visualizador mostra o aviso ao chegar nela
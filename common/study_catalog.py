@@ -0,0 +1,968 @@
+#!/usr/bin/env python3
+"""
+Catálogo de estudos em SQLite (modo WAL) compartilhado por SCU, organizador e dashboard
+Substitui o .metadata.json: estudos, séries e instâncias indexados por UID,
+cada atualização toca só as linhas envolvidas e é transacional entre processos.
+Cada estudo guarda também o resumo exibido pelo dashboard (quantidade,
+tamanho, nome de exibição), mantido incrementalmente na ingestão, e um
+carimbo de mudança (studies_version) avisa quando a lista precisa ser refeita.
+"""
+
+import json
+import os
+import random
+import sqlite3
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+CATALOG_FILENAME = ".catalog.db"
+LEGACY_METADATA_FILENAME = ".metadata.json"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS studies (
+    study_uid         TEXT PRIMARY KEY,
+    folder            TEXT NOT NULL UNIQUE,
+    patient_id        TEXT,
+    patient_name      TEXT,
+    study_date        TEXT,
+    study_time        TEXT,
+    modality          TEXT,
+    study_description TEXT,
+    created_at        TEXT,
+    image_count       INTEGER NOT NULL DEFAULT 0,
+    sent              INTEGER NOT NULL DEFAULT 0,
+    sent_at           TEXT,
+    size_bytes        INTEGER NOT NULL DEFAULT 0,
+    display_name      TEXT,
+    updated_at        REAL
+);
+
+CREATE TABLE IF NOT EXISTS series (
+    series_uid         TEXT PRIMARY KEY,
+    study_uid          TEXT NOT NULL REFERENCES studies(study_uid) ON DELETE CASCADE,
+    modality           TEXT,
+    series_number      INTEGER,
+    series_description TEXT,
+    image_count        INTEGER NOT NULL DEFAULT 0,
+    last_instance_at   REAL,
+    preview_count      INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_series_study ON series(study_uid);
+
+CREATE TABLE IF NOT EXISTS instances (
+    sop_instance_uid TEXT PRIMARY KEY,
+    study_uid        TEXT NOT NULL REFERENCES studies(study_uid) ON DELETE CASCADE,
+    series_uid       TEXT,
+    sop_class_uid    TEXT,
+    transfer_syntax  TEXT,
+    instance_number  INTEGER,
+    filename         TEXT,
+    size_bytes       INTEGER,
+    received_at      TEXT,
+    received_epoch   REAL,
+    sent             INTEGER NOT NULL DEFAULT 0,
+    attempts         INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at  REAL,
+    last_error       TEXT,
+    orientation      TEXT,
+    slice_position   REAL,
+    image_rows       INTEGER,
+    image_columns    INTEGER,
+    frames           INTEGER,
+    photometric      TEXT,
+    window_center    REAL,
+    window_width     REAL
+);
+CREATE INDEX IF NOT EXISTS idx_instances_study ON instances(study_uid);
+CREATE INDEX IF NOT EXISTS idx_instances_series ON instances(series_uid);
+CREATE INDEX IF NOT EXISTS idx_instances_sent ON instances(sent);
+
+CREATE TABLE IF NOT EXISTS deliveries (
+    sop_instance_uid TEXT NOT NULL REFERENCES instances(sop_instance_uid) ON DELETE CASCADE,
+    destination      TEXT NOT NULL,
+    sent             INTEGER NOT NULL DEFAULT 0,
+    attempts         INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at  REAL,
+    last_error       TEXT,
+    claimed_by       TEXT,
+    claimed_at       REAL,
+    PRIMARY KEY (sop_instance_uid, destination)
+);
+CREATE INDEX IF NOT EXISTS idx_deliveries_queue ON deliveries(sent, next_attempt_at);
+
+CREATE TABLE IF NOT EXISTS transcode_stats (
+    destination    TEXT PRIMARY KEY,
+    files          INTEGER NOT NULL DEFAULT 0,
+    skipped        INTEGER NOT NULL DEFAULT 0,
+    failures       INTEGER NOT NULL DEFAULT 0,
+    original_bytes INTEGER NOT NULL DEFAULT 0,
+    encoded_bytes  INTEGER NOT NULL DEFAULT 0,
+    encode_seconds REAL NOT NULL DEFAULT 0,
+    updated_at     TEXT
+);
+
+CREATE TABLE IF NOT EXISTS catalog_info (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Estado de envio por destino (deliveries.sent). Em instances.sent fica o
+# resumo: falhou se algum destino falhou, pendente se algum ainda não saiu
+SEND_FAILED = -1    # envio falhou (reenvio agendado)
+SEND_PENDING = 0    # aguardando o SCU
+SEND_OK = 1         # enviada ao destino
+SEND_CLAIMED = 2    # reservada por um worker (em envio)
+SEND_NO_ROUTE = 3   # nenhuma regra de roteamento casou (só em instances.sent)
+
+# Destino configurado por TARGET_HOST/PORT/AET (e das filas antigas)
+DEFAULT_DESTINATION = "default"
+
+# Colunas adicionadas depois da primeira versão do catálogo (migração)
+INSTANCE_COLUMNS_ADDED = {
+    "received_epoch": "REAL",
+    "attempts": "INTEGER NOT NULL DEFAULT 0",
+    "next_attempt_at": "REAL",
+    "last_error": "TEXT",
+    "orientation": "TEXT",
+    "slice_position": "REAL",
+    "image_rows": "INTEGER",
+    "image_columns": "INTEGER",
+    "frames": "INTEGER",
+    "photometric": "TEXT",
+    "window_center": "REAL",
+    "window_width": "REAL",
+}
+# Geometria das fatias (índice do visualizador). orientation NULL = ainda não
+# lida (catálogo antigo); '' = instância sem ImageOrientation/PositionPatient
+GEOMETRY_FIELDS = ("orientation", "slice_position", "image_rows", "image_columns", "frames")
+# Exibição por instância (fotometria e WindowCenter/Width do cabeçalho)
+DISPLAY_FIELDS = ("photometric", "window_center", "window_width")
+INDEX_FIELDS = GEOMETRY_FIELDS + DISPLAY_FIELDS
+STUDY_COLUMNS_ADDED = {
+    "size_bytes": "INTEGER NOT NULL DEFAULT 0",
+    "display_name": "TEXT",
+    "updated_at": "REAL",
+}
+SERIES_COLUMNS_ADDED = {
+    "last_instance_at": "REAL",
+    "preview_count": "INTEGER NOT NULL DEFAULT 0",
+}
+DELIVERY_COLUMNS_ADDED = {
+    "claimed_by": "TEXT",
+    "claimed_at": "REAL",
+}
+
+# catalog_info: contador incrementado a cada mudança na tabela studies
+STUDIES_VERSION_KEY = "studies_version"
+
+# Dono das reservas (deliveries.claimed_by): cada processo só devolve as suas;
+# reservas de outros donos voltam à fila depois deste prazo sem conclusão
+SCU_CLAIM_OWNER = "scu"
+CLAIM_LEASE_SECONDS = float(os.getenv("CLAIM_LEASE_SECONDS", "3600"))
+
+# Fila de reenvio: backoff exponencial com jitter, sem limite de tentativas
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "30"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "3600"))
+
+STUDY_FIELDS = (
+    "patient_id", "patient_name", "study_date", "study_time",
+    "modality", "study_description",
+)
+
+
+def send_state(sent):
+    """Converte o `sent` de uma instância (None/bool/estado) no estado gravado"""
+    if sent is None:
+        return SEND_PENDING
+    if isinstance(sent, bool):
+        return SEND_OK if sent else SEND_FAILED
+    return int(sent)
+
+
+def _positions_usable(rows):
+    """Todas as fatias com posição e a mesma orientação (senão vale o InstanceNumber)"""
+    orientations = {row['orientation'] for row in rows}
+    return (len(rows) > 1 and len(orientations) == 1 and '' not in orientations
+            and None not in orientations
+            and all(row['slice_position'] is not None for row in rows))
+
+def order_slices(rows):
+    """
+    Ordem de exibição das instâncias de uma série: ImagePositionPatient
+    projetada na normal da fatia quando todas têm a mesma orientação, no
+    sentido em que o InstanceNumber cresce; senão InstanceNumber e nome
+    """
+    by_number = sorted(rows, key=lambda row: (row['instance_number'] is None,
+                                              row['instance_number'] or 0, row['filename']))
+    if not _positions_usable(rows):
+        return by_number
+    ordered = sorted(rows, key=lambda row: (row['slice_position'],
+                                            row['instance_number'] or 0, row['filename']))
+    first, last = ordered[0]['instance_number'], ordered[-1]['instance_number']
+    if first is not None and last is not None and first > last:
+        ordered.reverse()
+    return ordered
+
+def series_index(series, rows):
+    """
+    Agrupa as instâncias (`rows`: series_uid, sop_instance_uid, filename,
+    instance_number e INDEX_FIELDS) nas séries (`series`: dicts da tabela
+    series). Cada série ganha filenames (ordem de exibição) com sop_uids,
+    frame_counts e windows ((WC, WW) do cabeçalho ou None) alinhados, shape
+    (linhas, colunas; None se variar), frames, photometric, by_position e
+    indexed (geometria já lida)
+    """
+    entries = {entry['series_uid']: dict(entry) for entry in series}
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row['series_uid'] or '', []).append(row)
+    index = []
+    for series_uid, members in grouped.items():
+        entry = entries.get(series_uid) or {
+            'series_uid': series_uid, 'modality': '', 'series_number': None,
+            'series_description': '',
+        }
+        shapes = {(row['image_rows'], row['image_columns']) for row in members
+                  if row['image_rows'] and row['image_columns']}
+        ordered = order_slices(members)
+        entry['filenames'] = [row['filename'] for row in ordered]
+        entry['sop_uids'] = [row['sop_instance_uid'] for row in ordered]
+        entry['frame_counts'] = [row['frames'] or 1 for row in ordered]
+        entry['windows'] = [
+            (row['window_center'], row['window_width'])
+            if row['window_center'] is not None and row['window_width'] else None
+            for row in ordered
+        ]
+        # Forma única na série: o volume é criado sem ler o primeiro cabeçalho
+        entry['shape'] = list(shapes.pop()) if len(shapes) == 1 else None
+        entry['frames'] = max(row['frames'] or 1 for row in members)
+        entry['photometric'] = next(
+            (row['photometric'] for row in ordered if row['photometric']), '')
+        entry['by_position'] = _positions_usable(members)
+        entry['indexed'] = all(row['orientation'] is not None for row in members)
+        index.append(entry)
+    index.sort(key=lambda entry: (entry['series_number'] is None,
+                                  entry['series_number'] or 0, entry['series_uid']))
+    return index
+
+def study_display_name(folder):
+    """Nome exibido: "NOME (DD/MM/AAAA)" a partir da pasta YYYYMMDD_HHMMSS_ID_NOME"""
+    parts = folder.split('_', 3)
+    if len(parts) < 4:
+        return folder
+    date_str = parts[0]
+    display_date = (f"{date_str[6:8]}/{date_str[4:6]}/{date_str[:4]}"
+                    if len(date_str) == 8 else date_str)
+    return f"{parts[3]} ({display_date})"
+
+
+def _scan_dicom_files(folder):
+    """Entradas .dcm de uma pasta de estudo (vazio se não existir)"""
+    try:
+        with os.scandir(folder) as entries:
+            return [entry for entry in entries
+                    if entry.name.endswith(".dcm") and entry.is_file()]
+    except OSError:
+        return []
+
+
+def retry_delay(attempts):
+    """Espera antes da próxima tentativa: base * 2^(n-1), limitada, com jitter"""
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** max(0, attempts - 1))
+    return random.uniform(delay / 2, delay)
+
+
+class StudyCatalog:
+    """
+    Acesso ao catálogo de um DICOM_ROOT.
+    Uma conexão SQLite por thread; escritas concorrentes entre processos
+    são serializadas pelo próprio SQLite (WAL + busy_timeout).
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.path = self.root / CATALOG_FILENAME
+        self._local = threading.local()
+        self._ready = False
+        self._ready_lock = threading.Lock()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.root.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        if not self._ready:
+            with self._ready_lock:
+                if not self._ready:
+                    conn.executescript(SCHEMA)
+                    self._migrate(conn)
+                    self._import_legacy_metadata(conn)
+                    self._once(conn, "study_summaries_backfilled", self._backfill_study_summaries)
+                    self._ready = True
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Transação com lock de escrita desde o início (BEGIN IMMEDIATE)"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # --- Estudos ---
+
+    def get_study(self, study_uid):
+        row = self._connect().execute(
+            "SELECT * FROM studies WHERE study_uid = ?", (study_uid,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def get_study_by_folder(self, folder):
+        row = self._connect().execute(
+            "SELECT * FROM studies WHERE folder = ?", (folder,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def list_studies(self):
+        """Todos os estudos, mais recentes primeiro"""
+        rows = self._connect().execute("SELECT * FROM studies ORDER BY folder DESC")
+        return [dict(row) for row in rows]
+
+    def studies_version(self):
+        """Carimbo de mudança dos estudos: igual ao anterior, a lista não mudou"""
+        row = self._connect().execute(
+            "SELECT value FROM catalog_info WHERE key = ?", (STUDIES_VERSION_KEY,)
+        ).fetchone()
+        return int(row['value']) if row else 0
+
+    def get_or_create_study(self, study_meta, folder=None):
+        """
+        Retorna o estudo pelo StudyInstanceUID, criando registro e pasta
+        (YYYYMMDD_HHMMSS_PatientID_PatientName) se for novo.
+        `folder`: pasta já existente no disco (cópia manual) a usar no lugar
+        de uma nova. Retorna (estudo, criado).
+        """
+        study_uid = study_meta['study_uid']
+        study = self.get_study(study_uid)
+        if study:
+            return study, False
+
+        with self.transaction() as conn:
+            # Outro processo pode ter criado entre a leitura e o lock
+            row = conn.execute(
+                "SELECT * FROM studies WHERE study_uid = ?", (study_uid,)
+            ).fetchone()
+            if row:
+                return dict(row), False
+
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            folder_name = folder or f"{timestamp}_{study_meta['patient_id']}_{study_meta['patient_name']}"
+
+            # Garante nome único no disco e no catálogo
+            counter = 1
+            original_name = folder_name
+            while (folder is None and (self.root / folder_name).exists()) or conn.execute(
+                "SELECT 1 FROM studies WHERE folder = ?", (folder_name,)
+            ).fetchone():
+                folder_name = f"{original_name}_{counter}"
+                counter += 1
+
+            study = {
+                'study_uid': study_uid,
+                'folder': folder_name,
+                **{field: study_meta.get(field, '') for field in STUDY_FIELDS},
+                'created_at': timestamp,
+                'image_count': 0,
+                'sent': 0,
+                'sent_at': None,
+                'size_bytes': 0,
+                'display_name': study_display_name(folder_name),
+                'updated_at': time.time(),
+            }
+            conn.execute(
+                f"INSERT INTO studies ({', '.join(study)}) "
+                f"VALUES ({', '.join('?' * len(study))})",
+                tuple(study.values()),
+            )
+            self._touch_studies(conn)
+            (self.root / folder_name).mkdir(parents=True, exist_ok=True)
+        return study, True
+
+    def mark_study_sent(self, study_uid, sent):
+        with self.transaction() as conn:
+            conn.execute(
+                "UPDATE studies SET sent = ?, sent_at = CASE WHEN ? THEN ? ELSE sent_at END, "
+                "updated_at = ? WHERE study_uid = ?",
+                (int(sent), int(sent), datetime.now().strftime("%Y%m%d_%H%M%S"), time.time(),
+                 study_uid),
+            )
+            self._touch_studies(conn)
+
+    def delete_study_by_folder(self, folder):
+        """Remove estudo (e em cascata séries/instâncias) pelo nome da pasta"""
+        with self.transaction() as conn:
+            cursor = conn.execute("DELETE FROM studies WHERE folder = ?", (folder,))
+            if cursor.rowcount:
+                self._touch_studies(conn)
+        return cursor.rowcount
+
+    def clear(self):
+        """Apaga todo o catálogo (botão 'Limpar Metadados' do dashboard)"""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM instances")
+            conn.execute("DELETE FROM series")
+            conn.execute("DELETE FROM studies")
+            self._touch_studies(conn)
+
+    # --- Instâncias ---
+
+    def record_instances(self, study_uid, instances, claim_owner=None):
+        """
+        Registra instâncias organizadas de um estudo numa única transação,
+        atualiza os contadores do estudo/séries e enfileira os envios.
+        `instances`: dicts com sop_instance_uid, series_uid, sop_class_uid,
+        transfer_syntax, instance_number, filename, size_bytes e,
+        opcionalmente, series_number/series_description/modality, a
+        geometria e exibição (INDEX_FIELDS, de instance_metadata_from_header) e
+        received_epoch (time.time() da recepção; padrão: agora; o SCU usa o
+        mtime do arquivo). received_at é só o texto de exibição derivado dele.
+        `deliveries`: {destino: estado} vindo do roteamento; sem ele vale
+        {DEFAULT_DESTINATION: sent} (`sent` None = pendente, False = falhou,
+        com `error` opcional). Falhas já entram na fila de reenvio.
+        Entregas já reservadas (SEND_CLAIMED, cut-through do SCP) ficam em
+        nome de `claim_owner`.
+        """
+        if not instances:
+            return
+        now = time.time()
+        with self.transaction() as conn:
+            new_count = 0
+            size_delta = 0
+            for inst in instances:
+                sop_uid = inst['sop_instance_uid']
+                series_uid = inst.get('series_uid') or ''
+                received = inst.get('received_epoch') or now
+                if series_uid:
+                    conn.execute(
+                        "INSERT INTO series (series_uid, study_uid, modality, series_number, "
+                        "series_description, last_instance_at) VALUES (?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT(series_uid) DO UPDATE SET "
+                        "last_instance_at = excluded.last_instance_at",
+                        (series_uid, study_uid, inst.get('modality', ''),
+                         inst.get('series_number'), inst.get('series_description', ''), now),
+                    )
+                existed = conn.execute(
+                    "SELECT size_bytes FROM instances WHERE sop_instance_uid = ?", (sop_uid,)
+                ).fetchone()
+                # Recebida de novo: o tamanho do estudo troca o antigo pelo novo
+                size_delta += (inst.get('size_bytes') or 0) - (
+                    (existed['size_bytes'] or 0) if existed else 0)
+                conn.execute(
+                    "INSERT INTO instances (sop_instance_uid, study_uid, series_uid, "
+                    "sop_class_uid, transfer_syntax, instance_number, filename, size_bytes, "
+                    f"received_at, received_epoch, {', '.join(INDEX_FIELDS)}) "
+                    f"VALUES ({', '.join('?' * (10 + len(INDEX_FIELDS)))}) "
+                    "ON CONFLICT(sop_instance_uid) DO UPDATE SET study_uid = excluded.study_uid, "
+                    "series_uid = excluded.series_uid, sop_class_uid = excluded.sop_class_uid, "
+                    "transfer_syntax = excluded.transfer_syntax, "
+                    "instance_number = excluded.instance_number, filename = excluded.filename, "
+                    "size_bytes = excluded.size_bytes, received_at = excluded.received_at, "
+                    "received_epoch = excluded.received_epoch, "
+                    + ", ".join(f"{field} = excluded.{field}" for field in INDEX_FIELDS),
+                    (sop_uid, study_uid, series_uid,
+                     inst.get('sop_class_uid', ''), inst.get('transfer_syntax', ''),
+                     inst.get('instance_number'), inst.get('filename', ''),
+                     inst.get('size_bytes'),
+                     datetime.fromtimestamp(received).strftime("%Y%m%d_%H%M%S"), received,
+                     *(inst.get(field) for field in INDEX_FIELDS)),
+                )
+
+                # Instância recebida de novo é reenviada: a fila recomeça
+                conn.execute("DELETE FROM deliveries WHERE sop_instance_uid = ?", (sop_uid,))
+                deliveries = inst.get('deliveries')
+                if deliveries is None:
+                    deliveries = {DEFAULT_DESTINATION: send_state(inst.get('sent'))}
+                for destination, state in deliveries.items():
+                    conn.execute(
+                        "INSERT INTO deliveries (sop_instance_uid, destination) VALUES (?, ?)",
+                        (sop_uid, destination),
+                    )
+                    self._set_delivery(conn, sop_uid, destination, send_state(state),
+                                       inst.get('error'), now, claim_owner)
+                self._refresh_instances(conn, [sop_uid])
+
+                if not existed:
+                    new_count += 1
+                    if series_uid:
+                        conn.execute(
+                            "UPDATE series SET image_count = image_count + 1 WHERE series_uid = ?",
+                            (series_uid,),
+                        )
+            conn.execute(
+                "UPDATE studies SET image_count = image_count + ?, size_bytes = size_bytes + ?, "
+                "updated_at = ? WHERE study_uid = ?",
+                (new_count, size_delta, now, study_uid),
+            )
+            self._refresh_study(conn, study_uid)
+            self._touch_studies(conn)
+
+    # --- Fila de envio (uma entrega por instância e destino) ---
+
+    def claim_pending_deliveries(self, limit=500, exclude_destinations=(), owner=SCU_CLAIM_OWNER):
+        """
+        Reserva (SEND_CLAIMED, em nome de `owner`) até `limit` entregas
+        pendentes, na ordem de chegada, mais as falhas cujo reenvio já venceu
+        e as reservas de mais de CLAIM_LEASE_SECONDS (worker travado ou morto
+        com o outro processo ainda no ar), para um único worker.
+        `exclude_destinations`: destinos a pular (ex.: disjuntor aberto).
+        Retorna dicts com os campos da instância + `folder` e `destination`.
+        """
+        excluded = list(exclude_destinations)
+        now = time.time()
+        skip = f"AND d.destination NOT IN ({', '.join('?' * len(excluded))}) " if excluded else ""
+        with self.transaction() as conn:
+            rows = conn.execute(
+                "SELECT i.*, s.folder, d.destination, d.attempts AS attempts "
+                "FROM deliveries d "
+                "JOIN instances i ON i.sop_instance_uid = d.sop_instance_uid "
+                "JOIN studies s ON s.study_uid = i.study_uid "
+                "WHERE (d.sent = ? OR (d.sent = ? AND d.next_attempt_at <= ?) "
+                "OR (d.sent = ? AND COALESCE(d.claimed_at, 0) < ?)) "
+                f"{skip}ORDER BY d.sent DESC, d.rowid LIMIT ?",
+                (SEND_PENDING, SEND_FAILED, now, SEND_CLAIMED, now - CLAIM_LEASE_SECONDS,
+                 *excluded, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE deliveries SET sent = ?, claimed_by = ?, claimed_at = ? "
+                "WHERE sop_instance_uid = ? AND destination = ?",
+                [(SEND_CLAIMED, owner, now, row['sop_instance_uid'], row['destination'])
+                 for row in rows],
+            )
+        return [dict(row) for row in rows]
+
+    def release_claimed_deliveries(self, owner=SCU_CLAIM_OWNER, lease=CLAIM_LEASE_SECONDS):
+        """
+        Devolve à fila as entregas reservadas por uma execução interrompida de
+        `owner`, as sem dono (catálogos antigos) e as de outros donos
+        reservadas há mais de `lease` s. Reservas recentes de outro processo
+        (ex.: cut-through do SCP em andamento) ficam
+        """
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE deliveries SET sent = ?, claimed_by = NULL, claimed_at = NULL "
+                "WHERE sent = ? AND (claimed_by IS NULL OR claimed_by = ? "
+                "OR COALESCE(claimed_at, 0) < ?)",
+                (SEND_PENDING, SEND_CLAIMED, owner, time.time() - lease),
+            )
+        return cursor.rowcount
+
+    def mark_deliveries(self, study_uid, results, errors=None):
+        """
+        Grava o resultado do envio (`results`: {(sop_instance_uid, destino):
+        ok ou estado}) e atualiza o resumo das instâncias e do estudo.
+        Falhas são reagendadas com backoff; `errors`: {(sop, destino): motivo}.
+        """
+        if not results:
+            return
+        errors = errors or {}
+        now = time.time()
+        with self.transaction() as conn:
+            for (sop_uid, destination), ok in results.items():
+                self._set_delivery(conn, sop_uid, destination, send_state(ok),
+                                   errors.get((sop_uid, destination)), now)
+            self._refresh_instances(conn, {sop_uid for sop_uid, _ in results})
+            self._refresh_study(conn, study_uid)
+
+    def requeue_study(self, study_uid):
+        """
+        Reenvio manual: volta para pendente as entregas do estudo em cada
+        destino roteado (as reservadas, em envio agora, ficam), para o SCU
+        enviá-las. Retorna {destino: entregas reenfileiradas}
+        """
+        with self.transaction() as conn:
+            rows = conn.execute(
+                "SELECT d.sop_instance_uid, d.destination FROM deliveries d "
+                "JOIN instances i ON i.sop_instance_uid = d.sop_instance_uid "
+                "WHERE i.study_uid = ? AND d.sent != ?",
+                (study_uid, SEND_CLAIMED),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE deliveries SET sent = ?, attempts = 0, next_attempt_at = NULL, "
+                "last_error = NULL WHERE sop_instance_uid = ? AND destination = ?",
+                [(SEND_PENDING, row['sop_instance_uid'], row['destination']) for row in rows],
+            )
+            self._refresh_instances(conn, {row['sop_instance_uid'] for row in rows})
+            self._refresh_study(conn, study_uid)
+        requeued = {}
+        for row in rows:
+            requeued[row['destination']] = requeued.get(row['destination'], 0) + 1
+        return requeued
+
+    def delivery_counts(self, study_uid):
+        """
+        Entregas do estudo (uma por instância e destino): {'sent', 'failed',
+        'total'}; cada entrega conta uma vez, com o estado atual (reenvio
+        sobrescreve a falha)
+        """
+        row = self._connect().execute(
+            "SELECT COALESCE(SUM(d.sent = ?), 0) AS sent, COALESCE(SUM(d.sent = ?), 0) AS failed, "
+            "COUNT(*) AS total FROM deliveries d "
+            "JOIN instances i ON i.sop_instance_uid = d.sop_instance_uid WHERE i.study_uid = ?",
+            (SEND_OK, SEND_FAILED, study_uid),
+        ).fetchone()
+        return dict(row)
+
+    def reschedule_failed(self, destination=None):
+        """Destino voltou: antecipa para agora o reenvio das suas falhas"""
+        query = "UPDATE deliveries SET next_attempt_at = ? WHERE sent = ?"
+        params = [time.time(), SEND_FAILED]
+        if destination is not None:
+            query += " AND destination = ?"
+            params.append(destination)
+        with self.transaction() as conn:
+            cursor = conn.execute(query, params)
+        return cursor.rowcount
+
+    def delivery_backlog(self):
+        """Entregas ainda não concluídas: {(destino, estado): quantidade}"""
+        rows = self._connect().execute(
+            "SELECT destination, sent, COUNT(*) AS total FROM deliveries "
+            "WHERE sent IN (?, ?, ?) GROUP BY destination, sent",
+            (SEND_PENDING, SEND_CLAIMED, SEND_FAILED),
+        ).fetchall()
+        return {(row['destination'], row['sent']): row['total'] for row in rows}
+
+    def retry_backlog(self):
+        """Quantidade de entregas aguardando reenvio e a próxima tentativa"""
+        row = self._connect().execute(
+            "SELECT COUNT(*) AS total, MIN(next_attempt_at) AS next_attempt_at "
+            "FROM deliveries WHERE sent = ?",
+            (SEND_FAILED,),
+        ).fetchone()
+        return dict(row)
+
+    def _set_delivery(self, conn, sop_uid, destination, state, error, now, owner=None):
+        if state != SEND_FAILED:
+            claimed = state == SEND_CLAIMED
+            conn.execute(
+                "UPDATE deliveries SET sent = ?, next_attempt_at = NULL, last_error = NULL, "
+                "claimed_by = ?, claimed_at = ? WHERE sop_instance_uid = ? AND destination = ?",
+                (state, owner if claimed else None, now if claimed else None, sop_uid, destination),
+            )
+            return
+        row = conn.execute(
+            "SELECT attempts FROM deliveries WHERE sop_instance_uid = ? AND destination = ?",
+            (sop_uid, destination),
+        ).fetchone()
+        attempts = (row['attempts'] if row else 0) + 1
+        conn.execute(
+            "UPDATE deliveries SET sent = ?, attempts = ?, next_attempt_at = ?, last_error = ?, "
+            "claimed_by = NULL, claimed_at = NULL WHERE sop_instance_uid = ? AND destination = ?",
+            (SEND_FAILED, attempts, now + retry_delay(attempts), error, sop_uid, destination),
+        )
+
+    def _refresh_instances(self, conn, sop_uids):
+        """Resume em instances.* o estado das entregas de cada instância"""
+        conn.executemany(
+            "UPDATE instances SET "
+            "sent = (SELECT CASE WHEN COUNT(*) = 0 THEN ? "
+            "    WHEN SUM(d.sent = ?) > 0 THEN ? "
+            "    WHEN SUM(d.sent IN (?, ?)) > 0 THEN ? ELSE ? END "
+            "    FROM deliveries d WHERE d.sop_instance_uid = instances.sop_instance_uid), "
+            "attempts = (SELECT COALESCE(MAX(d.attempts), 0) FROM deliveries d "
+            "    WHERE d.sop_instance_uid = instances.sop_instance_uid), "
+            "next_attempt_at = (SELECT MIN(d.next_attempt_at) FROM deliveries d "
+            "    WHERE d.sop_instance_uid = instances.sop_instance_uid AND d.sent = ?), "
+            "last_error = (SELECT d.last_error FROM deliveries d "
+            "    WHERE d.sop_instance_uid = instances.sop_instance_uid AND d.sent = ? LIMIT 1) "
+            "WHERE sop_instance_uid = ?",
+            [(SEND_NO_ROUTE, SEND_FAILED, SEND_FAILED, SEND_PENDING, SEND_CLAIMED,
+              SEND_PENDING, SEND_OK, SEND_FAILED, SEND_FAILED, sop_uid)
+             for sop_uid in sop_uids],
+        )
+
+    def _refresh_study(self, conn, study_uid):
+        """
+        Estudo enviado quando nenhuma instância tem entrega pendente/falha.
+        Só grava (e muda o carimbo) quando o estado do estudo muda
+        """
+        all_sent = not conn.execute(
+            "SELECT 1 FROM instances WHERE study_uid = ? AND sent NOT IN (?, ?) LIMIT 1",
+            (study_uid, SEND_OK, SEND_NO_ROUTE),
+        ).fetchone()
+        cursor = conn.execute(
+            "UPDATE studies SET sent = ?, sent_at = CASE WHEN ? THEN ? ELSE sent_at END, "
+            "updated_at = ? WHERE study_uid = ? AND sent != ?",
+            (int(all_sent), int(all_sent), datetime.now().strftime("%Y%m%d_%H%M%S"),
+             time.time(), study_uid, int(all_sent)),
+        )
+        if cursor.rowcount:
+            self._touch_studies(conn)
+
+    def _touch_studies(self, conn):
+        """Avança o carimbo de mudança dos estudos (na mesma transação)"""
+        conn.execute(
+            "INSERT INTO catalog_info (key, value) VALUES (?, '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+            (STUDIES_VERSION_KEY,),
+        )
+
+    # --- Prévias (miniaturas por série) ---
+
+    def pending_previews(self, settle_seconds, limit=1, exclude=()):
+        """
+        Séries com instâncias que ainda não entraram na prévia e sem
+        instâncias novas há `settle_seconds`; as mais antigas primeiro
+        """
+        excluded = list(exclude)
+        skip = f"AND se.series_uid NOT IN ({', '.join('?' * len(excluded))}) " if excluded else ""
+        rows = self._connect().execute(
+            "SELECT se.*, st.folder FROM series se "
+            "JOIN studies st ON st.study_uid = se.study_uid "
+            "WHERE se.image_count > se.preview_count "
+            "AND COALESCE(se.last_instance_at, 0) <= ? "
+            f"{skip}ORDER BY COALESCE(se.last_instance_at, 0) LIMIT ?",
+            (time.time() - settle_seconds, *excluded, limit),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def study_filenames(self, study_uid):
+        """Arquivos do estudo já catalogados (nomes na pasta do estudo)"""
+        rows = self._connect().execute(
+            "SELECT filename FROM instances WHERE study_uid = ?", (study_uid,)
+        ).fetchall()
+        return {row['filename'] for row in rows}
+
+    def series_entry(self, series_uid):
+        """Uma série no índice do visualizador (ver series_index), ou None"""
+        conn = self._connect()
+        series = [dict(row) for row in conn.execute(
+            "SELECT series_uid, modality, series_number, series_description "
+            "FROM series WHERE series_uid = ?", (series_uid,))]
+        rows = conn.execute(
+            "SELECT series_uid, sop_instance_uid, filename, instance_number, "
+            f"{', '.join(INDEX_FIELDS)} FROM instances WHERE series_uid = ?",
+            (series_uid,),
+        ).fetchall()
+        index = series_index(series, rows)
+        return index[0] if index else None
+
+    # --- Índice de fatias do visualizador ---
+
+    def study_series_index(self, study_uid):
+        """
+        Séries do estudo (por SeriesNumber) com os arquivos na ordem de
+        exibição e a forma da imagem, só com o catálogo: o visualizador abre
+        uma série sem ler nenhum cabeçalho
+        """
+        conn = self._connect()
+        series = [dict(row) for row in conn.execute(
+            "SELECT series_uid, modality, series_number, series_description "
+            "FROM series WHERE study_uid = ?", (study_uid,))]
+        rows = conn.execute(
+            "SELECT series_uid, sop_instance_uid, filename, instance_number, "
+            f"{', '.join(INDEX_FIELDS)} FROM instances WHERE study_uid = ?",
+            (study_uid,),
+        ).fetchall()
+        return series_index(series, rows)
+
+    def instances_without_geometry(self, study_uid):
+        """(sop_instance_uid, filename) ainda sem geometria (catálogos antigos)"""
+        rows = self._connect().execute(
+            "SELECT sop_instance_uid, filename FROM instances "
+            "WHERE study_uid = ? AND orientation IS NULL",
+            (study_uid,),
+        ).fetchall()
+        return [(row['sop_instance_uid'], row['filename']) for row in rows]
+
+    def record_geometry(self, geometry):
+        """Grava o índice lido depois: {sop_instance_uid: dict com INDEX_FIELDS}"""
+        if not geometry:
+            return
+        with self.transaction() as conn:
+            conn.executemany(
+                f"UPDATE instances SET {', '.join(f'{field} = ?' for field in INDEX_FIELDS)} "
+                "WHERE sop_instance_uid = ?",
+                [(*(values.get(field) for field in INDEX_FIELDS), sop_uid)
+                 for sop_uid, values in geometry.items()],
+            )
+
+    def mark_preview(self, series_uid, image_count):
+        """Prévia gerada com `image_count` instâncias (mais instâncias: gera de novo)"""
+        with self.transaction() as conn:
+            conn.execute(
+                "UPDATE series SET preview_count = ? WHERE series_uid = ?",
+                (image_count, series_uid),
+            )
+
+    # --- Transcodificação ---
+
+    def add_transcode_stats(self, destination, stats):
+        """Soma os contadores de uma rajada (transcoder.new_stats) ao destino"""
+        if not (stats['files'] or stats['skipped'] or stats['failures']):
+            return
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO transcode_stats (destination, files, skipped, failures, "
+                "original_bytes, encoded_bytes, encode_seconds, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(destination) DO UPDATE SET "
+                "files = files + excluded.files, skipped = skipped + excluded.skipped, "
+                "failures = failures + excluded.failures, "
+                "original_bytes = original_bytes + excluded.original_bytes, "
+                "encoded_bytes = encoded_bytes + excluded.encoded_bytes, "
+                "encode_seconds = encode_seconds + excluded.encode_seconds, "
+                "updated_at = excluded.updated_at",
+                (destination, stats['files'], stats['skipped'], stats['failures'],
+                 stats['original_bytes'], stats['encoded_bytes'], stats['encode_seconds'],
+                 datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+            )
+
+    def transcode_stats(self):
+        """Totais por destino (dashboard)"""
+        rows = self._connect().execute(
+            "SELECT * FROM transcode_stats ORDER BY destination"
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    # --- Migração ---
+
+    def _migrate(self, conn):
+        """Adiciona colunas novas em catálogos criados por versões anteriores"""
+        for table, columns in (("instances", INSTANCE_COLUMNS_ADDED),
+                               ("studies", STUDY_COLUMNS_ADDED),
+                               ("series", SERIES_COLUMNS_ADDED),
+                               ("deliveries", DELIVERY_COLUMNS_ADDED)):
+            existing = {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}
+            for column, definition in columns.items():
+                if column not in existing:
+                    try:
+                        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                    except sqlite3.OperationalError:
+                        pass  # Outro processo adicionou ao mesmo tempo
+
+        self._once(conn, "deliveries_migrated", self._migrate_deliveries)
+
+    def _once(self, conn, key, migrate):
+        """Executa `migrate(conn)` uma única vez por catálogo (marca `key` em catalog_info)"""
+        if conn.execute("SELECT 1 FROM catalog_info WHERE key = ?", (key,)).fetchone():
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not conn.execute("SELECT 1 FROM catalog_info WHERE key = ?", (key,)).fetchone():
+                migrate(conn)
+                conn.execute(
+                    "INSERT INTO catalog_info (key, value) VALUES (?, ?)",
+                    (key, datetime.now().isoformat(timespec='seconds')),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _migrate_deliveries(self, conn):
+        """A fila por instância vira uma entrega para o destino padrão"""
+        conn.execute(
+            "INSERT OR IGNORE INTO deliveries (sop_instance_uid, destination, sent, "
+            "attempts, next_attempt_at, last_error) "
+            "SELECT sop_instance_uid, ?, sent, attempts, "
+            "CASE WHEN sent = ? THEN COALESCE(next_attempt_at, ?) END, last_error "
+            "FROM instances WHERE sent IN (?, ?, ?, ?)",
+            (DEFAULT_DESTINATION, SEND_FAILED, time.time(),
+             SEND_FAILED, SEND_PENDING, SEND_OK, SEND_CLAIMED),
+        )
+
+    def _backfill_study_summaries(self, conn):
+        """
+        Resumo dos estudos de catálogos antigos: tamanho pela soma das
+        instâncias; estudos importados do .metadata.json (sem instâncias)
+        são medidos no disco uma única vez
+        """
+        conn.execute(
+            "UPDATE studies SET size_bytes = COALESCE((SELECT SUM(i.size_bytes) "
+            "FROM instances i WHERE i.study_uid = studies.study_uid), 0)"
+        )
+        rows = conn.execute(
+            "SELECT study_uid, folder, NOT EXISTS (SELECT 1 FROM instances i "
+            "WHERE i.study_uid = studies.study_uid) AS legacy FROM studies"
+        ).fetchall()
+        now = time.time()
+        for row in rows:
+            updates = {'display_name': study_display_name(row['folder']), 'updated_at': now}
+            if row['legacy']:
+                files = _scan_dicom_files(self.root / row['folder'])
+                updates['image_count'] = len(files)
+                updates['size_bytes'] = sum(entry.stat().st_size for entry in files)
+            conn.execute(
+                f"UPDATE studies SET {', '.join(f'{column} = ?' for column in updates)} "
+                "WHERE study_uid = ?",
+                (*updates.values(), row['study_uid']),
+            )
+        self._touch_studies(conn)
+
+    def _import_legacy_metadata(self, conn):
+        """Importa uma única vez o .metadata.json antigo para o catálogo"""
+        if conn.execute(
+            "SELECT 1 FROM catalog_info WHERE key = 'legacy_metadata_imported'"
+        ).fetchone():
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute(
+                "SELECT 1 FROM catalog_info WHERE key = 'legacy_metadata_imported'"
+            ).fetchone():
+                conn.execute("COMMIT")
+                return
+            imported = 0
+            legacy_file = self.root / LEGACY_METADATA_FILENAME
+            if legacy_file.exists():
+                try:
+                    with open(legacy_file, 'r') as f:
+                        legacy = json.load(f)
+                except Exception as e:
+                    print(f"⚠ .metadata.json ilegível, importação ignorada: {e}")
+                    legacy = {}
+                for study_uid, data in legacy.items():
+                    if not isinstance(data, dict) or not data.get('folder'):
+                        continue
+                    cursor = conn.execute(
+                        "INSERT OR IGNORE INTO studies (study_uid, folder, patient_id, "
+                        "patient_name, study_date, study_time, modality, study_description, "
+                        "created_at, image_count, sent, sent_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (data.get('study_uid') or study_uid, data['folder'],
+                         *(str(data.get(field, '')) for field in STUDY_FIELDS),
+                         data.get('created_at', ''), int(data.get('image_count', 0)),
+                         int(bool(data.get('sent'))), data.get('sent_at')),
+                    )
+                    imported += cursor.rowcount
+            conn.execute(
+                "INSERT INTO catalog_info (key, value) VALUES ('legacy_metadata_imported', ?)",
+                (datetime.now().isoformat(timespec='seconds'),),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if imported:
+            print(f"📚 Catálogo: {imported} estudo(s) importado(s) de {LEGACY_METADATA_FILENAME}")
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Transcodificação sem perdas antes do envio (economia de banda)
+Instâncias não comprimidas (Implicit/Explicit VR Little Endian) podem ser
+recodificadas para JPEG-LS lossless, JPEG 2000 lossless ou RLE quando o
+destino aceita o contexto comprimido. A codificação roda num pool de
+processos e grava uma cópia temporária em DICOM_ROOT/.transcode/<serviço>:
+o arquivo original na pasta do estudo nunca é alterado.
+
+Cada destino declara a ordem de preferência (routing_rules.json:
+"transcode": ["jpeg-ls", "rle"]; destino padrão: TARGET_TRANSCODE).
+Sem preferência, ou sem ganho de tamanho, o original é enviado.
+"""
+
+import os
+import time
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from pydicom import dcmread
+from pydicom.pixels import get_encoder
+from pydicom.uid import (
+    ExplicitVRLittleEndian,
+    ImplicitVRLittleEndian,
+    JPEG2000Lossless,
+    JPEGLSLossless,
+    RLELossless,
+)
+
+DICOM_ROOT = Path(os.getenv("DICOM_ROOT", "/home/dicom"))
+# Cópias transcodificadas existem só durante o envio
+TRANSCODE_FOLDER = DICOM_ROOT / ".transcode"
+# Processos de codificação (0 desliga a transcodificação)
+TRANSCODE_WORKERS = int(os.getenv("TRANSCODE_WORKERS", "2"))
+
+# Nomes aceitos nas regras -> Transfer Syntax sem perdas
+LOSSLESS_SYNTAXES = {
+    "jpeg-ls": str(JPEGLSLossless),
+    "j2k": str(JPEG2000Lossless),
+    "rle": str(RLELossless),
+}
+# Só recodifica o que chegou sem compressão
+UNCOMPRESSED_SYNTAXES = {str(ExplicitVRLittleEndian), str(ImplicitVRLittleEndian)}
+
+
+def parse_syntaxes(names):
+    """Converte nomes ("jpeg-ls", "j2k", "rle") em UIDs, na mesma ordem"""
+    if isinstance(names, str):
+        names = names.split(",")
+    syntaxes = []
+    for name in names:
+        name = name.strip().lower()
+        if not name:
+            continue
+        if name not in LOSSLESS_SYNTAXES:
+            raise ValueError(
+                f"transcodificação desconhecida: {name} "
+                f"(use {', '.join(LOSSLESS_SYNTAXES)})"
+            )
+        syntaxes.append(LOSSLESS_SYNTAXES[name])
+    return tuple(dict.fromkeys(syntaxes))
+
+
+def syntax_names(syntaxes):
+    """Nomes curtos ("jpeg-ls", ...) das syntaxes, para log"""
+    names = {uid: name for name, uid in LOSSLESS_SYNTAXES.items()}
+    return [names.get(uid, uid) for uid in syntaxes]
+
+
+def available_syntaxes(syntaxes):
+    """Filtra as syntaxes cujo codificador está instalado"""
+    return tuple(uid for uid in syntaxes if get_encoder(uid).is_available)
+
+
+def encode_file(src, dest, syntaxes):
+    """
+    Executado no processo de codificação: recodifica `src` na primeira syntax
+    de `syntaxes` que funcionar e grava em `dest` (temporário + rename).
+    Retorna dict simples (serializável) com o resultado.
+    """
+    started = time.perf_counter()
+    original_bytes = os.path.getsize(src)
+    result = {'path': None, 'transfer_syntax': None, 'original_bytes': original_bytes,
+              'encoded_bytes': original_bytes, 'seconds': 0.0, 'error': None}
+    try:
+        ds = dcmread(src)
+        if 'PixelData' not in ds:
+            result['error'] = "sem pixel data"
+            return result
+        errors = []
+        for uid in syntaxes:
+            try:
+                # Sem perdas: a instância é a mesma, mantém o SOP Instance UID
+                ds.compress(uid, generate_instance_uid=False)
+            except Exception as e:
+                errors.append(f"{uid}: {e}")
+                continue
+            tmp_path = Path(dest).with_name(f".{Path(dest).name}.tmp")
+            ds.save_as(tmp_path, enforce_file_format=True)
+            os.replace(tmp_path, dest)
+            result.update(path=str(dest), transfer_syntax=uid,
+                          encoded_bytes=os.path.getsize(dest))
+            break
+        else:
+            result['error'] = "; ".join(errors) or "nenhuma syntax disponível"
+    except Exception as e:
+        result['error'] = str(e)
+    finally:
+        result['seconds'] = time.perf_counter() - started
+    return result
+
+
+class Transcoder:
+    """Pool de processos compartilhado para recodificar lotes antes do envio"""
+
+    def __init__(self, workers=TRANSCODE_WORKERS, folder=TRANSCODE_FOLDER):
+        self.workers = workers
+        self.folder = Path(folder)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self.folder.mkdir(parents=True, exist_ok=True)
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def cleanup_stale(self):
+        """Remove cópias deixadas por uma execução interrompida"""
+        if not self.folder.exists():
+            return
+        for path in self.folder.iterdir():
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def prepare(self, pool, destination, items):
+        """
+        Recodifica, para `destination`, os itens de `items` (caminho, sop_class,
+        transfer_syntax) que vieram sem compressão e cujo contexto comprimido
+        o destino aceita. Retorna (itens para enviar, temporários, tamanhos,
+        estatísticas); `tamanhos`: {posição: (bytes originais, recodificados)}.
+        Os itens mantêm a ordem; o que não for recodificado segue o original.
+        """
+        stats = new_stats()
+        syntaxes = available_syntaxes(getattr(destination, 'transcode', ()))
+        candidates = [
+            idx for idx, (_, _, transfer_syntax) in enumerate(items)
+            if str(transfer_syntax) in UNCOMPRESSED_SYNTAXES
+        ]
+        if not (self.enabled and syntaxes and candidates and pool.breaker.allow()):
+            return list(items), [], {}, stats
+
+        # Negocia (uma vez por destino) quais contextos comprimidos ele aceita,
+        # junto com os originais: a associação serve também para o envio
+        sop_classes = {str(items[idx][1]) for idx in candidates}
+        try:
+            accepted = pool.accepted_contexts(
+                [(sop_class, uid) for sop_class in sop_classes for uid in syntaxes]
+                + [(str(sop_class), str(ts)) for _, sop_class, ts in items]
+            )
+        except ConnectionError:
+            return list(items), [], {}, stats
+
+        futures = {}
+        for idx in candidates:
+            filepath, sop_class, _ = items[idx]
+            allowed = [uid for uid in syntaxes if (str(sop_class), uid) in accepted]
+            if not allowed:
+                stats['skipped'] += 1
+                continue
+            dest = self.folder / f"{uuid.uuid4().hex}.dcm"
+            futures[idx] = self._pool().submit(encode_file, str(filepath), str(dest), allowed)
+
+        prepared = list(items)
+        temporaries = []
+        sizes = {}
+        for idx, future in futures.items():
+            filepath, sop_class, _ = items[idx]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'path': None, 'error': str(e), 'seconds': 0.0}
+            stats['encode_seconds'] += result['seconds']
+            if not result['path']:
+                stats['failures'] += 1
+                print(f"⚠ Transcodificação falhou para {Path(filepath).name}: {result['error']}")
+                continue
+            temporaries.append(Path(result['path']))
+            if result['encoded_bytes'] >= result['original_bytes']:
+                # Sem ganho: envia o original
+                stats['skipped'] += 1
+                continue
+            sizes[idx] = (result['original_bytes'], result['encoded_bytes'])
+            prepared[idx] = (Path(result['path']), sop_class, result['transfer_syntax'])
+        return prepared, temporaries, sizes, stats
+
+    def send(self, pool, destination, items):
+        """
+        Envia `items` pelo `pool`, recodificando o que o destino aceitar.
+        Retorna (resultados com os caminhos originais, estatísticas); os bytes
+        economizados contam só para as instâncias entregues.
+        """
+        prepared, temporaries, sizes, stats = self.prepare(pool, destination, items)
+        try:
+            results = pool.send_files(prepared)
+        finally:
+            self.discard(temporaries)
+        for idx, (_, ok, _) in enumerate(results):
+            if ok and idx in sizes:
+                stats['files'] += 1
+                stats['original_bytes'] += sizes[idx][0]
+                stats['encoded_bytes'] += sizes[idx][1]
+        return [
+            (item[0], ok, message) for item, (_, ok, message) in zip(items, results)
+        ], stats
+
+    @staticmethod
+    def discard(temporaries):
+        for path in temporaries:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+
+
+def new_stats():
+    """Contadores de uma rajada (somados por destino no catálogo)"""
+    return {'files': 0, 'skipped': 0, 'failures': 0, 'original_bytes': 0,
+            'encoded_bytes': 0, 'encode_seconds': 0.0}
+
+
+def format_stats(stats):
+    """Resumo de uma rajada para o log"""
+    original = stats['original_bytes']
+    encoded = stats['encoded_bytes']
+    saved = (1 - encoded / original) * 100 if original else 0
+    return (f"{stats['files']} arquivo(s) {original / 1e6:.1f} MB → {encoded / 1e6:.1f} MB "
+            f"(-{saved:.0f}%) em {stats['encode_seconds']:.1f}s de CPU")
+
+
+_TRANSCODER = None
+_TRANSCODER_LOCK = threading.Lock()
+
+
+def get_transcoder(service):
+    """Transcoder compartilhado do processo (pool de processos criado sob demanda)"""
+    global _TRANSCODER
+    with _TRANSCODER_LOCK:
+        if _TRANSCODER is None:
+            _TRANSCODER = Transcoder(folder=TRANSCODE_FOLDER / service)
+        return _TRANSCODER
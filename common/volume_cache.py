@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Cache de volumes do visualizador CT
+Cada pilha de fatias (ou quadros de um multiframe) é decodificada uma única
+vez, pelo frame_decoder, para um array int16 (imagens coloridas: RGB uint8)
+mapeado em memória num arquivo local, e as fatias são lidas dali sem reabrir
+o DICOM. O int16 guarda códigos: valor = código * escala + deslocamento, com
+a escala de cada fatia ao lado (no CT, escala 1: o código é o próprio HU).
+O janelamento é uma tabela de 65536 entradas (uint8) indexada pelo código:
+trocar WC/WW custa uma consulta por pixel, sem conta em ponto flutuante nem E/S.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pydicom
+
+from frame_decoder import FrameDecoder
+
+# Sem escala: o código int16 é o próprio valor
+IDENTITY = (1.0, 0.0)
+
+VOLUME_CACHE_DIR = Path(os.getenv("VOLUME_CACHE_DIR", "/tmp/dicom-volumes"))
+# Espaço em disco dos volumes; os usados há mais tempo saem primeiro
+VOLUME_CACHE_MB = int(os.getenv("VOLUME_CACHE_MB", "2048"))
+# Volumes mantidos abertos (mapeados) pelo processo
+VOLUME_CACHE_OPEN = int(os.getenv("VOLUME_CACHE_OPEN", "8"))
+
+META_FILENAME = "volume.json"
+PIXELS_FILENAME = "pixels.i16"
+STATE_FILENAME = "state.u8"
+SCALE_FILENAME = "scale.f8"
+
+# Estado de cada fatia no volume
+SLICE_PENDING = 0       # ainda não decodificada
+SLICE_LOADED = 1        # pixels no arquivo mapeado
+SLICE_UNAVAILABLE = 2   # sem pixel data, não decodificável ou dimensão diferente
+
+
+@lru_cache(maxsize=64)
+def window_lut(wc, ww):
+    """
+    Tabela uint8 de janelamento indexada pelos 16 bits do pixel (int16 lido
+    como uint16): lut[pixels.view(np.uint16)] aplica a janela. WC/WW em
+    códigos (iguais aos valores com escala 1; ver display.code_window)
+    """
+    values = np.arange(65536, dtype=np.uint16).view(np.int16).astype(np.float32)
+    lower = wc - ww / 2
+    lut = ((np.clip(values, lower, lower + ww) - lower) / ww * 255).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+
+def as_source(item):
+    """Fonte de uma fatia: (caminho, SOPInstanceUID ou None, quadro); aceita só o caminho"""
+    if isinstance(item, (str, os.PathLike)):
+        return (str(item), None, 0)
+    path, sop_uid, frame = item[:3]
+    return (str(path), sop_uid, int(frame))
+
+
+def file_stamp(path):
+    """Versão do arquivo (mtime em ns e tamanho): instância corrigida com o mesmo nome muda a chave"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return ""
+    return f"{st.st_mtime_ns}:{st.st_size}"
+
+
+def volume_dtype(shape):
+    """int16 para (fatias, linhas, colunas); uint8 para cor (fatias, linhas, colunas, 3)"""
+    return np.uint8 if len(shape) == 4 else np.int16
+
+
+class Volume:
+    """
+    Pilha (fatias, linhas, colunas) int16 — ou (…, 3) RGB uint8 — num arquivo
+    mapeado em memória, com (escala, deslocamento) de cada fatia. Cada fatia
+    é decodificada na primeira leitura e fica no arquivo
+    """
+
+    def __init__(self, key, folder, sources, shape, decoder, create=False):
+        self.key = key
+        self.folder = Path(folder)
+        self.sources = list(sources)
+        self.shape = tuple(shape)
+        self.decoder = decoder
+        mode = "w+" if create else "r+"
+        self.pixels = np.memmap(self.folder / PIXELS_FILENAME, dtype=volume_dtype(self.shape),
+                                mode=mode, shape=self.shape)
+        self._state = np.memmap(self.folder / STATE_FILENAME, dtype=np.uint8,
+                                mode=mode, shape=(self.shape[0],))
+        self._scale = np.memmap(self.folder / SCALE_FILENAME, dtype=np.float64,
+                                mode=mode, shape=(self.shape[0], 2))
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.pixels.nbytes
+
+    @property
+    def color(self):
+        return len(self.shape) == 4
+
+    def slice(self, index):
+        """Fatia `index` (view do arquivo mapeado) ou None se indisponível"""
+        state = self._state[index]
+        if state == SLICE_PENDING:
+            with self._lock:
+                state = self._state[index]
+                if state == SLICE_PENDING:
+                    state = self._load(index)
+        return self.pixels[index] if state == SLICE_LOADED else None
+
+    def mapping(self, index):
+        """(escala, deslocamento) da fatia `index`: valor = código * escala + deslocamento"""
+        if self._state[index] != SLICE_LOADED:
+            return IDENTITY
+        scale, offset = self._scale[index]
+        return float(scale), float(offset)
+
+    def frame(self, index):
+        """(pixels, escala, deslocamento) da fatia `index` ou None"""
+        pixels = self.slice(index)
+        return None if pixels is None else (pixels, *self.mapping(index))
+
+    def loaded(self):
+        """Quantidade de fatias já decodificadas"""
+        return int(np.count_nonzero(self._state == SLICE_LOADED))
+
+    def preload(self, indices):
+        """Decodifica de uma vez (em paralelo no pool) as fatias pendentes de `indices`"""
+        pending = [idx for idx in indices if self._state[idx] == SLICE_PENDING]
+        if not pending:
+            return
+        frames = self.decoder.frames([self.sources[idx] for idx in pending])
+        with self._lock:
+            for index, frame in zip(pending, frames):
+                if self._state[index] == SLICE_PENDING:
+                    self._store(index, frame)
+
+    def _load(self, index):
+        return self._store(index, self.decoder.frame(self.sources[index]))
+
+    def _store(self, index, frame):
+        if frame is None or frame[0].shape != self.shape[1:]:
+            state = SLICE_UNAVAILABLE
+        else:
+            pixels, scale, offset = frame
+            self.pixels[index] = pixels
+            self._scale[index] = (scale, offset)
+            state = SLICE_LOADED
+        # Estado só depois dos pixels e da escala: fatia marcada está sempre completa
+        self._state[index] = state
+        return state
+
+
+def _stack_shape(sources):
+    """Forma do volume pela primeira fatia com Rows/Columns (cor: 3 amostras)"""
+    for path, *_ in sources:
+        try:
+            ds = pydicom.dcmread(path, stop_before_pixels=True)
+            rows, cols = int(ds.Rows), int(ds.Columns)
+        except Exception:
+            continue
+        color = int(ds.get("SamplesPerPixel", 1)) == 3 or \
+            ds.get("PhotometricInterpretation") == "PALETTE COLOR"
+        return (len(sources), rows, cols, 3) if color else (len(sources), rows, cols)
+    return None
+
+
+class VolumeCache:
+    """Volumes por pilha de fatias (chave: hash das fontes, com a versão de cada arquivo, na ordem de exibição)"""
+
+    def __init__(self, root=VOLUME_CACHE_DIR, max_bytes=VOLUME_CACHE_MB * 1024 * 1024,
+                 max_open=VOLUME_CACHE_OPEN, decoder=None):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.max_open = max_open
+        self.decoder = decoder if decoder is not None else FrameDecoder(workers=0)
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(sources, color=False):
+        text = "\n".join(f"{path}#{frame}@{stamp}" for path, _, frame, stamp in sources)
+        return hashlib.sha1((text + ("\nrgb" if color else "")).encode()).hexdigest()[:24]
+
+    def open(self, sources, shape=None, color=False):
+        """
+        Volume da pilha `sources` (caminhos ou (caminho, SOPInstanceUID,
+        quadro), na ordem de exibição); None se não houver imagem. `shape`
+        (linhas, colunas) e `color` vindos do catálogo evitam ler o primeiro
+        cabeçalho. Cada fonte ganha a versão do arquivo (file_stamp): um
+        arquivo substituído gera outro volume e outra chave no LRU de quadros
+        """
+        sources = [as_source(item) for item in sources]
+        if not sources:
+            return None
+        stamps = {path: file_stamp(path) for path in dict.fromkeys(path for path, _, _ in sources)}
+        sources = [(path, sop_uid, frame, stamps[path]) for path, sop_uid, frame in sources]
+        if shape:
+            shape = (*shape, 3) if color else tuple(shape)
+        key = self.key_for(sources, color)
+        with self._lock:
+            volume = self._open.get(key)
+            if volume is None:
+                volume = self._reopen(key, sources) or self._create(key, sources, shape)
+                if volume is None:
+                    return None
+                self._open[key] = volume
+                while len(self._open) > self.max_open:
+                    self._open.popitem(last=False)
+            self._open.move_to_end(key)
+        return volume
+
+    def _reopen(self, key, sources):
+        folder = self.root / key
+        meta_path = folder / META_FILENAME
+        if not meta_path.exists():
+            return None
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            volume = Volume(key, folder, sources, meta['shape'], self.decoder)
+            os.utime(meta_path)  # Uso recente (despejo pelo mais antigo)
+            return volume
+        except (OSError, ValueError, KeyError):
+            shutil.rmtree(folder, ignore_errors=True)
+            return None
+
+    def _create(self, key, sources, image_shape=None):
+        shape = (len(sources), *image_shape) if image_shape else _stack_shape(sources)
+        if shape is None:
+            return None
+        folder = self.root / key
+        self._evict(int(np.prod(shape)) * np.dtype(volume_dtype(shape)).itemsize)
+        folder.mkdir(parents=True, exist_ok=True)
+        volume = Volume(key, folder, sources, shape, self.decoder, create=True)
+        # Metadados por último: pasta sem volume.json é descartada
+        tmp_path = folder / f".{META_FILENAME}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'shape': list(shape), 'first': sources[0][0], 'last': sources[-1][0]}, f)
+        os.replace(tmp_path, folder / META_FILENAME)
+        return volume
+
+    def _evict(self, needed):
+        """Remove os volumes usados há mais tempo até caber `needed` bytes"""
+        if not self.root.exists():
+            return
+        entries = []
+        for folder in self.root.iterdir():
+            if not folder.is_dir() or folder.name in self._open:
+                continue
+            meta_path = folder / META_FILENAME
+            try:
+                used = meta_path.stat().st_mtime
+                size = (folder / PIXELS_FILENAME).stat().st_size
+            except OSError:
+                shutil.rmtree(folder, ignore_errors=True)  # Criação interrompida
+                continue
+            entries.append((used, size, folder))
+        total = sum(size for _, size, _ in entries) + sum(v.nbytes for v in self._open.values())
+        for _, size, folder in sorted(entries):
+            if total + needed <= self.max_bytes:
+                break
+            shutil.rmtree(folder, ignore_errors=True)
+            total -= size
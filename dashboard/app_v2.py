@@ -10,12 +10,27 @@ import socket
 import os
 import shutil
 import io
+import math
+
+from study_catalog import StudyCatalog, study_display_name, series_index, INDEX_FIELDS, SEND_PENDING
+from pipeline import load_pipeline_stats
+from dicom_header import summarize_dicom_file
+from routing_rules import load_router
+import send_status
 
 # Tenta importar dependências do visualizador CT
 try:
     import pydicom
     import numpy as np
     from PIL import Image
+    from volume_cache import VolumeCache, Volume
+    from frame_decoder import FrameDecoder
+    from previews import load_previews
+    from slice_prefetch import SlicePrefetcher
+    import streamlit.components.v1 as components
+    from slice_viewer import slice_payload, viewer_html, VIEWER_HEIGHT
+    from dicom_header import instance_metadata_from_header
+    from display import MONOCHROME, CT_DEFAULT_WINDOW, profile_headers, series_profile, frame_lut, frame_window, frame_voi_lut, apply_lut
     VIEWER_AVAILABLE = True
 except ImportError:
     VIEWER_AVAILABLE = False
@@ -54,10 +69,14 @@ st.markdown("""<style>
 
 # Constantes
 DICOM_ROOT = Path(os.getenv("DICOM_ROOT", "/home/dicom"))
-METADATA_FILE = DICOM_ROOT / ".metadata.json"
+CATALOG = StudyCatalog(DICOM_ROOT)
+# Mesmas regras do SCU: o reenvio cria as entregas dos destinos roteados
+ROUTER = load_router()
 STATUS_FILE = DICOM_ROOT / ".send_status.json"
 ENV_FILE = Path("/home/prowess/dicomrs/.env")
 DICOM_ARCHIVE_ROOT = Path(os.getenv("DICOM_ROOT", "/home/dicom"))  # Pasta com estudos organizados
+CINE_FPS = int(os.getenv("CINE_FPS", "10"))  # Quadros por segundo padrão do cine
+CINE_MAX_SECONDS = 600  # Cine para sozinho (sessão esquecida aberta)
 
 # --- Funções Auxiliares ---
 
@@ -73,16 +92,6 @@ def load_env():
                     env_vars[key] = value
     return env_vars
 
-def load_metadata():
-    """Carrega metadados dos estudos"""
-    if METADATA_FILE.exists():
-        try:
-            with open(METADATA_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
-
 def load_send_status():
     """Carrega status de envio dos estudos"""
     if STATUS_FILE.exists():
@@ -109,97 +118,135 @@ def update_study_status(study_name: str, status: str, message: str = "", sent_co
         'status': status,  # 'enviado', 'falha', 'pendente', 'enviando'
         'message': message,
         'sent_count': sent_count,
+        'failed_count': 0,
         'total_count': total_count,
         'last_update': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     }
     save_send_status(status_data)
 
-def save_metadata(metadata):
-    """Salva metadados dos estudos"""
+def _status_mtime():
     try:
-        with open(METADATA_FILE, 'w') as f:
-            json.dump(metadata, f, indent=2)
-        return True
-    except Exception as e:
-        st.error(f"Erro ao salvar metadados: {e}")
-        return False
-
-def get_study_folders():
-    """Lista pastas de estudos no disco com status de envio, mais recentes primeiro"""
+        return STATUS_FILE.stat().st_mtime_ns
+    except OSError:
+        return 0
+
+@st.cache_data(ttl=60, max_entries=4, show_spinner=False)
+def _load_study_folders(stamp):
+    """
+    Monta a lista pelos resumos do catálogo (contagem, tamanho, nome),
+    sem varrer os arquivos: refeita só quando `stamp` muda (ou a cada 60s,
+    para pegar pastas alteradas fora do roteador)
+    """
     folders = []
     status_data = load_send_status()
     try:
-        for d in DICOM_ARCHIVE_ROOT.iterdir():
-            if d.is_dir() and not d.name.startswith('.'):
-                dcm_files = list(d.glob("*.dcm"))
-                if dcm_files:
-                    study_status = status_data.get(d.name, {})
-                    # Extrai nome do paciente e data do nome da pasta: YYYYMMDD_HHMMSS_ID_NOME
-                    parts = d.name.split('_', 3)
-                    if len(parts) >= 4:
-                        patient_name = parts[3]
-                        date_str = parts[0]
-                        display_date = f"{date_str[6:8]}/{date_str[4:6]}/{date_str[:4]}" if len(date_str) == 8 else date_str
-                        display_name = f"{patient_name} ({display_date})"
-                    else:
-                        display_name = d.name
-                    folders.append({
-                        'path': d,
-                        'name': d.name,
-                        'display_name': display_name,
-                        'file_count': len(dcm_files),
-                        'size_mb': sum(f.stat().st_size for f in dcm_files) / (1024*1024),
-                        'status': study_status.get('status', 'pendente'),
-                        'status_message': study_status.get('message', ''),
-                        'last_update': study_status.get('last_update', ''),
-                        'sent_count': study_status.get('sent_count', 0),
-                        'total_count': study_status.get('total_count', 0)
-                    })
+        with os.scandir(DICOM_ARCHIVE_ROOT) as entries:
+            on_disk = {e.name for e in entries if e.is_dir() and not e.name.startswith('.')}
+        cataloged = set()
+        for study in CATALOG.list_studies():
+            name = study['folder']
+            cataloged.add(name)
+            if name not in on_disk or not study['image_count']:
+                continue
+            study_status = status_data.get(name, {})
+            folders.append({
+                'path': DICOM_ARCHIVE_ROOT / name,
+                'name': name,
+                'display_name': study['display_name'] or name,
+                'file_count': study['image_count'],
+                'size_mb': (study['size_bytes'] or 0) / (1024*1024),
+                'status': study_status.get('status', 'enviado' if study['sent'] else 'pendente'),
+                'status_message': study_status.get('message', ''),
+                'last_update': study_status.get('last_update', ''),
+                'sent_count': study_status.get('sent_count', 0),
+                'total_count': study_status.get('total_count', 0)
+            })
+        # Pastas fora do catálogo (cópias manuais): contadas no disco
+        for name in on_disk - cataloged:
+            d = DICOM_ARCHIVE_ROOT / name
+            dcm_files = list(d.glob("*.dcm"))
+            if dcm_files:
+                study_status = status_data.get(name, {})
+                folders.append({
+                    'path': d,
+                    'name': name,
+                    'display_name': study_display_name(name),
+                    'file_count': len(dcm_files),
+                    'size_mb': sum(f.stat().st_size for f in dcm_files) / (1024*1024),
+                    'status': study_status.get('status', 'pendente'),
+                    'status_message': study_status.get('message', ''),
+                    'last_update': study_status.get('last_update', ''),
+                    'sent_count': study_status.get('sent_count', 0),
+                    'total_count': study_status.get('total_count', 0)
+                })
     except Exception as e:
         st.error(f"Erro ao listar pastas: {e}")
     # Ordena por nome da pasta decrescente (mais recentes primeiro)
     folders.sort(key=lambda f: f['name'], reverse=True)
     return folders
 
-def resend_study(folder_path: Path, target_host: str, target_port: str, target_aet: str):
-    """Reenvia um estudo DICOM para o destino usando gdcmscu dentro do container storescu"""
-    dcm_files = list(folder_path.glob("*.dcm"))
-    if not dcm_files:
-        update_study_status(folder_path.name, 'falha', 'Nenhum arquivo DICOM encontrado')
-        return False, "Nenhum arquivo DICOM encontrado na pasta"
-    
-    total_files = len(dcm_files)
-    
-    # Atualiza status para "enviando"
-    update_study_status(folder_path.name, 'enviando', f'Enviando {total_files} arquivos...', 0, total_files)
-    
-    container = get_container("storescu")
-    if not container:
-        update_study_status(folder_path.name, 'falha', 'Container storescu não encontrado')
-        return False, "Container storescu não encontrado"
-    
-    # Caminho dentro do container
-    container_path = f"/home/dicom/{folder_path.name}"
-    
+def get_study_folders():
+    """Lista pastas de estudos com status de envio, mais recentes primeiro"""
+    # Carimbo: catálogo (estudos) + .send_status.json; sem mudança, usa o cache
+    return _load_study_folders((CATALOG.studies_version(), _status_mtime()))
+
+def index_study_folder(folder_path: Path, study):
+    """
+    Cataloga os .dcm da pasta que ainda não estão no catálogo (estudos
+    importados do .metadata.json antigo, pastas copiadas à mão), com uma
+    entrega pendente por destino roteado, como na ingestão do SCU.
+    Retorna (estudo, instâncias catalogadas); estudo None se não houver DICOM válido
+    """
+    known = CATALOG.study_filenames(study['study_uid']) if study else set()
+    instances = []
+    for path in sorted(folder_path.glob("*.dcm")):
+        if path.name in known:
+            continue
+        summary = summarize_dicom_file(path, ROUTER.keywords)
+        if not summary['ok']:
+            continue
+        if study is None:
+            study, _ = CATALOG.get_or_create_study(summary['study'], folder=folder_path.name)
+        # Pasta com mais de um estudo: só o estudo da pasta entra
+        if summary['study']['study_uid'] != study['study_uid'] or study['folder'] != folder_path.name:
+            continue
+        stat = path.stat()
+        instances.append({
+            **summary['instance'],
+            'filename': path.name,
+            'size_bytes': stat.st_size,
+            'received_epoch': stat.st_mtime,
+            'deliveries': {name: SEND_PENDING for name in ROUTER.route(summary['tags'])},
+        })
+    if instances:
+        CATALOG.record_instances(study['study_uid'], instances)
+    return study, len(instances)
+
+def resend_study(folder_path: Path):
+    """
+    Reenvia um estudo: as entregas do catálogo voltam a pendentes em cada
+    destino roteado e o SCU as envia (status no catálogo e no .send_status.json).
+    Arquivos da pasta fora do catálogo são catalogados antes
+    """
     try:
-        # Envia todos os arquivos da pasta de uma vez usando sintaxe correta do gdcmscu
-        # gdcmscu --store -H host -p port --call AET -r -i "pasta"
-        cmd = f'gdcmscu --store -H {target_host} -p {target_port} --call {target_aet} -r -i "{container_path}" --verbose'
-        exec_result = container.exec_run(["bash", "-c", cmd], tty=True)
-        output = exec_result.output.decode('utf-8', errors='ignore')
-        
-        if exec_result.exit_code == 0:
-            update_study_status(folder_path.name, 'enviado', f'Enviado com sucesso!', total_files, total_files)
-            return True, f"Estudo reenviado com sucesso! ({total_files} arquivos)"
-        else:
-            # Tenta contar quantos foram enviados
-            sent_count = output.count('successfully')
-            error_msg = output[:300] if output else "Erro desconhecido"
-            update_study_status(folder_path.name, 'falha', f'Erro no envio: {error_msg}', sent_count, total_files)
-            return False, f"Erro ao reenviar: {error_msg}"
+        study, indexed = index_study_folder(folder_path, CATALOG.get_study_by_folder(folder_path.name))
+        if study is None:
+            update_study_status(folder_path.name, 'falha', 'Nenhum arquivo DICOM válido encontrado')
+            return False, "Nenhum arquivo DICOM válido encontrado na pasta"
+        if study['folder'] != folder_path.name:
+            return False, f"Estudo já catalogado na pasta {study['folder']}: reenvie por ela"
+        requeued = CATALOG.requeue_study(study['study_uid'])
     except Exception as e:
         update_study_status(folder_path.name, 'falha', f'Exceção: {str(e)}')
         return False, f"Exceção: {str(e)}"
+    if not requeued:
+        return False, "Nenhuma entrega para reenviar: nenhuma regra de roteamento casou ou o envio já está em andamento"
+
+    total = sum(requeued.values())
+    targets = ", ".join(f"{name} ({count})" for name, count in sorted(requeued.items()))
+    catalogued = f" ({indexed} arquivo(s) catalogado(s))" if indexed else ""
+    send_status.reset_study_status(DICOM_ROOT, folder_path.name, f'Reenvio agendado: {targets}')
+    return True, f"Reenvio agendado: {total} entrega(s) para {targets}{catalogued}"
 
 def test_connection(host, port, timeout=2):
     """Testa conexão TCP"""
@@ -252,13 +299,8 @@ def delete_study(folder_path: Path):
         status_data = load_send_status()
         status_data.pop(folder_name, None)
         save_send_status(status_data)
-        # Remove dos metadados
-        metadata = load_metadata()
-        keys_to_remove = [k for k, v in metadata.items() if v.get('folder') == folder_name]
-        for k in keys_to_remove:
-            del metadata[k]
-        if keys_to_remove:
-            save_metadata(metadata)
+        # Remove do catálogo (estudo, séries e instâncias)
+        CATALOG.delete_study_by_folder(folder_name)
         return True, "Estudo deletado com sucesso"
     except Exception as e:
         return False, f"Erro ao deletar: {e}"
@@ -275,28 +317,78 @@ CT_PRESETS = {
 }
 
 if VIEWER_AVAILABLE:
-    @st.cache_data(ttl=300)
-    def get_sorted_dcm_files(study_path_str: str) -> list[str]:
-        """Lista e ordena arquivos .dcm por InstanceNumber (headers only)."""
+    def series_label(series: dict) -> str:
+        """Série N · modalidade · descrição (índice do catálogo ou prévia)."""
+        label = f"Série {series.get('series_number') or '?'} · {series.get('modality') or '?'}"
+        if series.get('series_description'):
+            label += f" · {series['series_description']}"
+        return label
+
+    def _read_instance(path: Path) -> dict:
+        """Campos de índice de um arquivo (só estudos antigos ou fora do catálogo)."""
+        try:
+            return instance_metadata_from_header(pydicom.dcmread(str(path), stop_before_pixels=True))
+        except Exception:
+            # Ilegível: entra pelo nome, sem geometria (não é lido de novo)
+            return {'series_uid': '', 'instance_number': None, 'orientation': ''}
+
+    @st.cache_data(ttl=300, max_entries=20, show_spinner=False)
+    def get_series_index(study_path_str: str, study_uid: str | None, stamp) -> list[dict]:
+        """
+        Séries do estudo com as fatias na ordem de exibição, pelo índice do
+        catálogo montado na ingestão (nenhum cabeçalho lido). Instâncias de
+        catálogos antigos têm a geometria lida e gravada uma única vez; pastas
+        fora do catálogo são indexadas pelos cabeçalhos.
+        """
         study_path = Path(study_path_str)
-        dcm_files = list(study_path.glob("*.dcm"))
-        if not dcm_files:
-            return []
-        indexed = []
-        for f in dcm_files:
-            try:
-                ds = pydicom.dcmread(str(f), stop_before_pixels=True)
-                idx = int(getattr(ds, "InstanceNumber", 0))
-            except Exception:
-                idx = 0
-            indexed.append((idx, str(f)))
-        indexed.sort(key=lambda x: x[0])
-        return [path for _, path in indexed]
+        if study_uid:
+            missing = CATALOG.instances_without_geometry(study_uid)
+            if missing:
+                CATALOG.record_geometry({
+                    sop_uid: _read_instance(study_path / filename) for sop_uid, filename in missing
+                })
+            index = CATALOG.study_series_index(study_uid)
+        else:
+            series, rows = {}, []
+            for f in study_path.glob("*.dcm"):
+                inst = _read_instance(f)
+                rows.append({**dict.fromkeys(INDEX_FIELDS), 'sop_instance_uid': None,
+                             **inst, 'filename': f.name})
+                if inst['series_uid']:
+                    series.setdefault(inst['series_uid'], {
+                        'series_uid': inst['series_uid'], 'modality': inst.get('modality', ''),
+                        'series_number': inst.get('series_number'),
+                        'series_description': inst.get('series_description', ''),
+                    })
+            index = series_index(series.values(), rows)
+        for entry in index:
+            entry['paths'] = [str(study_path / name) for name in entry['filenames']]
+            # Uma fatia por quadro: multiframe é decodificado quadro a quadro
+            entry['sources'] = [
+                (path, sop_uid, frame)
+                for path, sop_uid, count in zip(entry['paths'], entry['sop_uids'], entry['frame_counts'])
+                for frame in range(count)
+            ]
+            # Janela do cabeçalho por fatia, alinhada com sources
+            entry['windows'] = [
+                window for window, count in zip(entry['windows'], entry['frame_counts'])
+                for _ in range(count)
+            ]
+        return index
 
     @st.cache_data(ttl=300)
     def get_study_info(study_path_str: str) -> dict:
-        """Extrai metadados do paciente do primeiro DICOM."""
+        """Metadados do paciente: do catálogo, ou do primeiro DICOM fora dele."""
         study_path = Path(study_path_str)
+        study = CATALOG.get_study_by_folder(study_path.name)
+        if study:
+            return {
+                "patient_name": ' '.join((study['patient_name'] or "N/A").split()),
+                "patient_id": study['patient_id'] or "N/A",
+                "study_date": study['study_date'] or "N/A",
+                "modality": study['modality'] or "N/A",
+                "total_slices": study['image_count'],
+            }
         dcm_files = list(study_path.glob("*.dcm"))
         if not dcm_files:
             return {}
@@ -315,35 +407,103 @@ if VIEWER_AVAILABLE:
         except Exception:
             return {"patient_name": "N/A", "patient_id": "N/A", "study_date": "N/A", "modality": "N/A", "total_slices": len(dcm_files)}
 
-    def apply_ct_windowing(pixel_array: "np.ndarray", intercept: float, slope: float, wc: int, ww: int) -> "np.ndarray":
-        """Converte pixel data para HU e aplica janelamento Window/Level."""
-        hu = pixel_array.astype(np.float64) * slope + intercept
-        lower = wc - ww / 2
-        upper = wc + ww / 2
-        img = np.clip(hu, lower, upper)
-        img = ((img - lower) / (upper - lower) * 255).astype(np.uint8)
-        return img
+    @st.cache_data(ttl=600, max_entries=200)
+    def render_preview_sheet(npy_path: str, mtime: float, columns: int = 3) -> bytes | None:
+        """Prévia da série (gerada na ingestão) em uma folha PNG, sem ler DICOM (cinza ou RGB)."""
+        try:
+            tiles = np.load(npy_path)
+            count, size = tiles.shape[0], tiles.shape[1]
+            rows = -(-count // columns)
+            sheet = np.zeros((rows * size, columns * size, *tiles.shape[3:]), dtype=np.uint8)
+            for i, tile in enumerate(tiles):
+                r, c = divmod(i, columns)
+                sheet[r * size:(r + 1) * size, c * size:(c + 1) * size] = tile
+            buf = io.BytesIO()
+            Image.fromarray(sheet, mode="RGB" if sheet.ndim == 3 else "L").save(
+                buf, format="PNG", compress_level=1)
+            return buf.getvalue()
+        except Exception:
+            return None
 
-    @st.cache_data(ttl=600, max_entries=500)
-    def render_slice(dcm_path: str, wc: int, ww: int, size: tuple[int, int] | None = None) -> bytes | None:
-        """Lê DICOM, aplica janelamento, retorna PNG bytes."""
+    @st.cache_resource
+    def get_volume_cache() -> VolumeCache:
+        """Volumes int16 mapeados em disco local, compartilhados pelas sessões"""
+        return VolumeCache(decoder=get_frame_decoder())
+
+    @st.cache_resource
+    def get_frame_decoder() -> FrameDecoder:
+        """Pool de decodificação (todas as sintaxes aceitas) + LRU de quadros por SOP/quadro"""
+        return FrameDecoder()
+
+    @st.cache_resource
+    def get_display_profiles() -> dict:
+        """Perfis de exibição por volume (lidos também pela thread de pré-carregamento)"""
+        return {}
+
+    def display_profile(volume, series: dict | None = None) -> dict:
+        """
+        Perfil de exibição do volume (display.series_profile), calculado uma
+        vez: poucos cabeçalhos e, sem janela no cabeçalho nem VOI LUT, o
+        histograma de algumas fatias
+        """
+        profiles = get_display_profiles()
+        profile = profiles.get(volume.key)
+        if profile is not None or series is None:
+            return profile or series_profile([], (), "CT")
+        headers = profile_headers(series['paths'])
+        step = max(1, len(volume) // 5)
+        samples = () if volume.color else (
+            frame for frame in map(volume.frame, range(step // 2, len(volume), step))
+            if frame is not None)
+        profile = series_profile(headers, samples, series.get('modality') or '', series['windows'])
+        profiles[volume.key] = profile
+        while len(profiles) > 64:
+            profiles.pop(next(iter(profiles)))
+        return profile
+
+    def window_step(width: float) -> float:
+        """Passo dos campos WC/WW: 10 em janelas de HU; frações em faixas pequenas (SUV, dose)"""
+        return 10.0 if width >= 100 else 10.0 ** (math.floor(math.log10(max(width, 1e-6))) - 1)
+
+    def window_png(volume, index: int, wc: float | None, ww: float | None,
+                   size: tuple[int, int] | None = None) -> bytes | None:
+        """
+        Fatia do volume em cache em PNG (decodifica só na 1ª vez): janelada
+        pela tabela do perfil (WC/WW None = janela padrão da fatia) ou, se
+        colorida, em RGB direto.
+        """
         try:
-            ds = pydicom.dcmread(dcm_path)
-            if not hasattr(ds, "PixelData"):
+            pixels = volume.slice(index)
+            if pixels is None:
                 return None
-            pixel_array = ds.pixel_array
-            intercept = float(getattr(ds, "RescaleIntercept", 0))
-            slope = float(getattr(ds, "RescaleSlope", 1))
-            img_array = apply_ct_windowing(pixel_array, intercept, slope, wc, ww)
-            img = Image.fromarray(img_array, mode="L")
+            if volume.color:
+                img = Image.fromarray(np.asarray(pixels), mode="RGB")
+            else:
+                lut = frame_lut(display_profile(volume), index, volume.mapping(index), wc, ww)
+                img = Image.fromarray(apply_lut(pixels, lut), mode="L")
             if size:
-                img = img.resize(size, Image.LANCZOS)
+                img = img.resize(size, Image.LANCZOS, reducing_gap=3.0)
             buf = io.BytesIO()
-            img.save(buf, format="PNG")
+            img.save(buf, format="PNG", compress_level=1)
             return buf.getvalue()
         except Exception:
             return None
 
+    @st.cache_data(ttl=600, max_entries=500)
+    def render_slice(volume_key: str, _volume, index: int, wc: float | None, ww: float | None,
+                     size: tuple[int, int] | None = None) -> bytes | None:
+        """Miniatura (ou fatia) em PNG com cache por volume/posição/janela."""
+        return window_png(_volume, index, wc, ww, size)
+
+    def render_for_cache(volume, index: int, *window) -> bytes | None:
+        """Com WC/WW (None = padrão): PNG janelado (cine); sem janela: pixels para o navegador."""
+        return window_png(volume, index, *window) if window else slice_payload(volume, index)
+
+    @st.cache_resource
+    def get_prefetcher() -> SlicePrefetcher:
+        """Fatias em volta da posição atual, renderizadas em segundo plano (todas as sessões)"""
+        return SlicePrefetcher(render_for_cache, preload=Volume.preload)
+
 # --- Conexão Docker ---
 try:
     client = docker.from_env()
@@ -476,8 +636,8 @@ with tab1:
                     b1, b2, b3 = st.columns(3)
                     with b1:
                         if st.button("🔄 Reenviar", key=f"resend_{idx}", type="primary", use_container_width=True):
-                            with st.spinner("Enviando..."):
-                                success, message = resend_study(folder['path'], TARGET_HOST, TARGET_PORT, TARGET_AET)
+                            with st.spinner("Agendando reenvio..."):
+                                success, message = resend_study(folder['path'])
                                 if success:
                                     st.success(message)
                                 else:
@@ -520,7 +680,7 @@ with tab1:
                 for i, sn in enumerate(selected_studies):
                     fl = next((f for f in study_folders if f['name'] == sn), None)
                     if fl:
-                        ok, msg = resend_study(fl['path'], TARGET_HOST, TARGET_PORT, TARGET_AET)
+                        ok, msg = resend_study(fl['path'])
                         (st.success if ok else st.error)(f"{fl['display_name']}: {msg}")
                     bar.progress((i + 1) / len(selected_studies))
 
@@ -541,7 +701,7 @@ with tab2:
             st.info("Nenhum estudo encontrado.")
         else:
             # Barra de controles compacta — tudo em uma linha
-            sel_c, preset_c, wc_c, ww_c = st.columns([3, 2, 1, 1])
+            sel_c, series_c, preset_c, wc_c, ww_c = st.columns([3, 3, 2, 1, 1])
             with sel_c:
                 viewer_names = [f["name"] for f in viewer_folders]
                 selected_vname = st.selectbox(
@@ -551,15 +711,66 @@ with tab2:
                     key="ct_viewer_study"
                 )
                 selected_vfolder = next(f for f in viewer_folders if f["name"] == selected_vname)
+
+            study_path_str = str(selected_vfolder["path"])
+            # Índice do catálogo: refeito quando o estudo recebe instâncias
+            vstudy = CATALOG.get_study_by_folder(selected_vname)
+            series_list = get_series_index(study_path_str,
+                                           vstudy['study_uid'] if vstudy else None,
+                                           vstudy['updated_at'] if vstudy else None)
+            selected_series = None
+            with series_c:
+                if series_list:
+                    series_by_uid = {entry['series_uid']: entry for entry in series_list}
+                    # Padrão: a maior série (topograma e reconstruções curtas ficam para trás)
+                    largest = max(series_list, key=lambda entry: len(entry['sources']))
+                    series_uids = list(series_by_uid)
+                    selected_suid = st.selectbox(
+                        "Série:",
+                        options=series_uids,
+                        index=series_uids.index(largest['series_uid']),
+                        format_func=lambda uid: f"{series_label(series_by_uid[uid])} "
+                                                f"({len(series_by_uid[uid]['sources'])})",
+                        key=f"ct_series_{selected_vname}"
+                    )
+                    selected_series = series_by_uid[selected_suid]
+
+            # Volume e perfil de exibição (janela padrão, VOI LUT, inversão, cor) da série
+            volume = profile = None
+            if selected_series:
+                photometric = selected_series['photometric']
+                # Fotometria desconhecida (catálogo antigo): forma pelo 1º cabeçalho
+                volume = get_volume_cache().open(
+                    selected_series['sources'], selected_series['shape'] if photometric else None,
+                    color=photometric not in ('', *MONOCHROME))
+                if volume:
+                    profile = display_profile(volume, selected_series)
+            color = bool(volume and volume.color)
+            # Presets de HU só fazem sentido no CT; "Padrão" segue o perfil da série
+            presets = CT_PRESETS if selected_series and selected_series.get('modality') == "CT" else {}
+            default_name = f"Padrão ({profile['source']})" if profile else "Padrão"
+            # Janela em valores da modalidade; passo e casas pela largura (HU, SUV, dose)
+            default_wc, default_ww = profile['window'] if profile else CT_DEFAULT_WINDOW
+            wstep = window_step(default_ww)
+            decimals = max(0, -math.floor(math.log10(wstep)))
+            default_wc, default_ww = round(default_wc, decimals), max(wstep, round(default_ww, decimals))
+            preset_scope = selected_series['series_uid'] if selected_series else ""
             with preset_c:
-                preset_name = st.selectbox("Preset:", list(CT_PRESETS.keys()), key="ct_preset")
-            preset = CT_PRESETS[preset_name]
+                preset_name = st.selectbox("Preset:", [default_name, *presets], disabled=color,
+                                           key=f"ct_preset_{preset_scope}")
+            preset = presets.get(preset_name, {"wc": default_wc, "ww": default_ww})
+            wformat = f"%.{decimals}f"
+            # Chaves por preset: trocar de preset (ou de série) recarrega os valores
             with wc_c:
-                wc = st.number_input("WC", value=preset["wc"], step=10, key="ct_wc")
+                wc = st.number_input("WC", value=float(preset["wc"]), step=wstep, format=wformat,
+                                     disabled=color, key=f"ct_wc_{preset_scope}_{preset_name}")
             with ww_c:
-                ww = st.number_input("WW", value=preset["ww"], min_value=1, step=10, key="ct_ww")
-
-            study_path_str = str(selected_vfolder["path"])
+                ww = st.number_input("WW", value=float(preset["ww"]), min_value=wstep, step=wstep,
+                                     format=wformat, disabled=color,
+                                     key=f"ct_ww_{preset_scope}_{preset_name}")
+            # Janela da página: None = padrão de cada fatia (cabeçalho, VOI LUT ou série)
+            custom = preset_name != default_name or (wc, ww) != (default_wc, default_ww)
+            window = (wc, ww) if custom else (None, None)
 
             # Info compacta em uma linha
             info = get_study_info(study_path_str)
@@ -572,39 +783,110 @@ with tab2:
                     f"{info.get('total_slices', 0)} fatias"
                 )
 
-            sorted_files = get_sorted_dcm_files(study_path_str)
-            if not sorted_files:
+            if not selected_series:
                 st.warning("Nenhum arquivo DICOM encontrado neste estudo.")
             else:
-                total = len(sorted_files)
+                sources = selected_series['sources']
+                total = len(sources)
+                prefetcher = get_prefetcher()
+                slider_key = f"ct_slice_slider_{selected_series['series_uid']}"
+
+                # Cine interrompido (parado ou outro controle mexido): o slider
+                # continua de onde o cine estava, se o usuário não o arrastou
+                cine_stop = st.session_state.pop("ct_cine_pos", None)
+                if cine_stop and cine_stop[0] == slider_key and \
+                        st.session_state.get(slider_key) == cine_stop[1]:
+                    st.session_state[slider_key] = cine_stop[2]
 
                 # Layout 2 colunas: controles+thumbs à esquerda, imagem à direita
                 panel_left, panel_right = st.columns([1, 3])
 
                 with panel_left:
-                    slice_idx = st.slider("Fatia", 0, total - 1, total // 2, key="ct_slice_slider")
-                    st.caption(f"Fatia {slice_idx + 1} / {total}")
-
-                    # Thumbnails compactos no painel esquerdo
-                    max_thumbs = 12
-                    step = max(1, total // max_thumbs)
-                    thumb_indices = list(range(0, total, step))[:max_thumbs]
-
-                    cols_per_row = 3
-                    for row_start in range(0, len(thumb_indices), cols_per_row):
-                        row_indices = thumb_indices[row_start:row_start + cols_per_row]
-                        tcols = st.columns(cols_per_row)
-                        for tc, tidx in zip(tcols, row_indices):
-                            tb = render_slice(sorted_files[tidx], wc, ww, size=(96, 96))
-                            if tb:
-                                tc.image(tb, caption=f"#{tidx + 1}", use_container_width=True)
+                    slice_idx = st.slider("Fatia", 0, max(1, total - 1), total // 2,
+                                          key=slider_key, disabled=total < 2)
+                    slice_idx = min(slice_idx, total - 1)
+                    order = "posição" if selected_series['by_position'] else "InstanceNumber"
+                    slice_caption = st.empty()
+                    slice_caption.caption(f"Fatia {slice_idx + 1} / {total} · ordem por {order}")
+                    cine_c, fps_c = st.columns(2)
+                    with cine_c:
+                        cine = st.toggle("▶ Cine", key="ct_cine", disabled=volume is None or total < 2)
+                    with fps_c:
+                        cine_fps = st.number_input("Quadros/s", min_value=1, max_value=30,
+                                                   value=CINE_FPS, key="ct_cine_fps")
+
+                    # Sentido da rolagem: o pré-carregamento vai primeiro para esse lado
+                    last = st.session_state.get("ct_last_slice")
+                    direction = 0
+                    if last and last[0] == slider_key:
+                        direction = (slice_idx > last[1]) - (slice_idx < last[1]) or last[2]
+                    st.session_state["ct_last_slice"] = (slider_key, slice_idx, direction)
+
+                    # Prévia da série gerada na ingestão (janela padrão); sem
+                    # ela (estudo antigo ou série ainda chegando), miniaturas do volume
+                    previews = [pv for pv in load_previews(study_path_str)
+                                if pv['series_uid'] == selected_series['series_uid']]
+                    for pv in previews:
+                        sheet = render_preview_sheet(pv['path'], pv['mtime'])
+                        if sheet:
+                            st.image(sheet, caption=f"{series_label(pv)} ({pv['image_count']} imagens)",
+                                     use_container_width=True)
+                    if not previews:
+                        max_thumbs = 12
+                        step = max(1, total // max_thumbs)
+                        thumb_indices = list(range(0, total, step))[:max_thumbs]
+
+                        cols_per_row = 3
+                        for row_start in range(0, len(thumb_indices), cols_per_row):
+                            row_indices = thumb_indices[row_start:row_start + cols_per_row]
+                            tcols = st.columns(cols_per_row)
+                            for tc, tidx in zip(tcols, row_indices):
+                                tb = render_slice(volume.key, volume, tidx, *window, size=(96, 96)) if volume else None
+                                if tb:
+                                    tc.image(tb, caption=f"#{tidx + 1}", use_container_width=True)
 
                 with panel_right:
-                    img_bytes = render_slice(sorted_files[slice_idx], wc, ww)
-                    if img_bytes:
-                        st.image(img_bytes, use_container_width=True)
-                    else:
-                        st.warning(f"Sem imagem para fatia {slice_idx + 1}.")
+                    # Pixels int16 (ou PNG colorido) enviados uma vez por fatia;
+                    # janela, presets e zoom são aplicados no navegador, sem rerun
+                    image_slot = st.empty()
+                    payload = prefetcher.get(volume, slice_idx) if volume and not cine else None
+                    if payload:
+                        slice_wc, slice_ww = (wc, ww) if custom else frame_window(profile, slice_idx)
+                        mapping = volume.mapping(slice_idx)
+                        with image_slot.container():
+                            components.html(
+                                viewer_html(payload, volume.shape[1:3], slice_wc, slice_ww, presets,
+                                            state_key=f"{preset_scope}:{preset_name}:{wc}:{ww}",
+                                            caption=f"Fatia {slice_idx + 1}/{total}",
+                                            invert=profile['invert'],
+                                            lut=None if custom else frame_voi_lut(profile, slice_idx, mapping),
+                                            mapping=mapping, step=wstep,
+                                            color=color),
+                                height=VIEWER_HEIGHT,
+                            )
+                        prefetcher.schedule(volume, slice_idx, direction)
+                    elif not cine:
+                        image_slot.warning(f"Sem imagem para fatia {slice_idx + 1}.")
+
+                    # Cine: quadros PNG (janela da página) do cache de pré-carregamento
+                    # a taxa fixa, até o usuário mexer em qualquer controle (o rerun
+                    # encerra o laço)
+                    if cine and volume:
+                        frame_time = 1.0 / cine_fps
+                        idx = slice_idx
+                        started = deadline = time.monotonic()
+                        while time.monotonic() - started < CINE_MAX_SECONDS:
+                            idx = (idx + 1) % total
+                            prefetcher.schedule(volume, idx, 1, *window)
+                            frame = prefetcher.get(volume, idx, *window)
+                            deadline += frame_time
+                            time.sleep(max(0.0, deadline - time.monotonic()))
+                            # Quadro renderizado na hora (atrasado): não acumula atraso
+                            deadline = max(deadline, time.monotonic() - frame_time)
+                            if frame:
+                                image_slot.image(frame, use_container_width=True)
+                            slice_caption.caption(f"▶ Fatia {idx + 1} / {total} · {cine_fps} quadros/s")
+                            st.session_state["ct_cine_pos"] = (slider_key, slice_idx, idx)
 
 # ==================== ABA 3: LOGS ====================
 with tab3:
@@ -676,9 +958,49 @@ with tab4:
             st.code(firewall_status, language="bash")
         except:
             st.error("Erro ao verificar firewall")
-    
+
+    st.write("**⚙️ Pipeline do SCU (por estágio):**")
+    pipeline_stats = load_pipeline_stats(DICOM_ROOT)
+    if pipeline_stats.get('stages'):
+        st.dataframe(pd.DataFrame([{
+            'Estágio': stage['name'],
+            'Fila': f"{stage['queue']}/{stage['queue_max']}" if stage['queue_max'] else "-",
+            'Ativos': f"{stage['active']}/{stage['concurrency']}",
+            'Uso': f"{stage['utilization'] * 100:.0f}%",
+            'Lotes': stage['processed'],
+            'Ocupado (s)': round(stage['busy_seconds'], 1),
+            'Esperando fila seguinte (s)': round(stage['blocked_seconds'], 1),
+            'Erros': stage['errors'],
+            'Último erro': stage['last_error'] or "",
+        } for stage in pipeline_stats['stages']]), hide_index=True, use_container_width=True)
+        st.caption(f"Atualizado em {datetime.fromtimestamp(pipeline_stats['updated_at']).strftime('%d/%m/%Y %H:%M:%S')} · "
+                   "fila cheia com uso alto indica o estágio saturado")
+    else:
+        st.caption("SCU ainda não publicou estatísticas do pipeline.")
+
+    st.write("**🗜️ Transcodificação sem perdas (por destino):**")
+    try:
+        transcode_rows = CATALOG.transcode_stats()
+    except Exception:
+        transcode_rows = []
+    if transcode_rows:
+        st.dataframe(pd.DataFrame([{
+            'Destino': row['destination'],
+            'Arquivos': row['files'],
+            'Original (MB)': round(row['original_bytes'] / 1e6, 1),
+            'Enviado (MB)': round(row['encoded_bytes'] / 1e6, 1),
+            'Economia': f"{(1 - row['encoded_bytes'] / row['original_bytes']) * 100:.0f}%" if row['original_bytes'] else "-",
+            'CPU (s)': round(row['encode_seconds'], 1),
+            'ms/arquivo': round(row['encode_seconds'] * 1000 / row['files'], 1) if row['files'] else "-",
+            'Sem ganho': row['skipped'],
+            'Falhas': row['failures'],
+            'Atualizado': row['updated_at'],
+        } for row in transcode_rows]), hide_index=True, use_container_width=True)
+    else:
+        st.caption("Nenhuma instância transcodificada (TARGET_TRANSCODE / \"transcode\" nas regras).")
+
     st.divider()
-    
+
     # Botão para diagnóstico completo
     if st.button("📋 Gerar Relatório Completo de Diagnóstico", type="primary"):
         with st.spinner("Gerando relatório..."):
@@ -731,7 +1053,7 @@ with tab5:
     st.code(f"""
 Workspace: /home/prowess/dicomrs/
 Arquivos DICOM: {DICOM_ROOT}
-Metadados: {METADATA_FILE}
+Catálogo: {CATALOG.path}
 Configuração: {ENV_FILE}
     """, language="bash")
     
@@ -749,10 +1071,9 @@ Configuração: {ENV_FILE}
     
     with col2:
         if st.button("🧹 Limpar Metadados (Cuidado!)", type="secondary"):
-            if METADATA_FILE.exists():
-                METADATA_FILE.unlink()
-                st.success("✅ Metadados limpos!")
-                st.rerun()
+            CATALOG.clear()
+            st.success("✅ Metadados limpos!")
+            st.rerun()
 
 # Rodapé
 st.divider()
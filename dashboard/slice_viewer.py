@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Visualizador com janelamento no navegador
+O servidor manda cada fatia uma única vez: os códigos int16 do volume (HU no
+CT; nas demais, com a escala da fatia para levar a janela aos códigos), com
+os bytes baixos e altos separados e zlib, em base64 no componente.
+Janela/nível (arrastar), presets, zoom (roda) e pan (Shift+arrastar) rodam em
+JavaScript: ajustar a janela não gera rerun nem trabalho no Streamlit.
+A janela padrão da fatia (cabeçalho ou VOI LUT, ver display.py) e a inversão de
+MONOCHROME1 vão junto. Fatias coloridas vão como PNG, sem janela.
+"""
+
+import io
+import json
+import math
+import zlib
+import base64
+
+import numpy as np
+from PIL import Image
+
+# Altura do componente (px); a imagem é encaixada mantendo a proporção
+VIEWER_HEIGHT = 640
+
+
+def encode_slice(pixels):
+    """
+    Fatia int16 → bytes comprimidos: todos os bytes baixos e depois todos os
+    altos (quase constantes, comprimem bem) e zlib nível 1
+    """
+    planes = np.ascontiguousarray(pixels, dtype="<i2").view(np.uint8).reshape(-1, 2)
+    return zlib.compress(planes.T.tobytes(), 1)
+
+
+def encode_color(pixels):
+    """Fatia RGB uint8 → PNG (o navegador decodifica nativamente)"""
+    buf = io.BytesIO()
+    Image.fromarray(np.ascontiguousarray(pixels), mode="RGB").save(buf, format="PNG", compress_level=1)
+    return buf.getvalue()
+
+
+def slice_payload(volume, index):
+    """Pixels da fatia `index` do volume prontos para o componente (ou None)"""
+    pixels = volume.slice(index)
+    if pixels is None:
+        return None
+    return encode_color(pixels) if volume.color else encode_slice(pixels)
+
+
+def viewer_html(payload, shape, wc, ww, presets, state_key, caption="",
+                invert=False, lut=None, color=False, mapping=(1.0, 0.0), step=1.0):
+    """
+    HTML do componente. `payload`: encode_slice (ou encode_color com
+    `color`); `shape`: (linhas, colunas); `wc`/`ww` (janela padrão da fatia,
+    em valores da modalidade) e `presets` ({nome: {"wc", "ww"}}) vêm da
+    página; `mapping`: (escala, deslocamento) dos códigos da fatia; `step`:
+    menor largura e passo do arraste; `lut`: tabela uint8 de 65536 entradas
+    (VOI LUT, já nos códigos) usada enquanto a janela não for ajustada.
+    A janela ajustada no navegador vale para as próximas fatias enquanto a
+    janela da página (`state_key`) não mudar
+    """
+    config = {
+        'data': base64.b64encode(payload).decode('ascii'),
+        'rows': int(shape[0]),
+        'cols': int(shape[1]),
+        'wc': float(wc),
+        'ww': float(ww),
+        'presets': presets,
+        'stateKey': state_key,
+        'caption': caption,
+        'height': VIEWER_HEIGHT,
+        'invert': bool(invert),
+        'lut': base64.b64encode(zlib.compress(lut.tobytes(), 6)).decode('ascii')
+               if lut is not None else None,
+        'color': bool(color),
+        'scale': float(mapping[0]),
+        'offset': float(mapping[1]),
+        'step': float(step),
+        'decimals': max(0, -math.floor(math.log10(step))),
+    }
+    return _TEMPLATE.replace("__CONFIG__", json.dumps(config))
+
+
+_TEMPLATE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><style>
+  body {margin: 0; background: #0e1117; color: #fafafa; font: 12px sans-serif;}
+  #bar {display: flex; gap: 4px; align-items: center; padding: 2px 0 4px;}
+  #bar button {background: #262730; color: #fafafa; border: 1px solid #444;
+               border-radius: 4px; padding: 2px 6px; font-size: 11px; cursor: pointer;}
+  #bar span {margin-left: auto; opacity: .8;}
+  #view {width: 100%; background: #000; cursor: crosshair; display: block;}
+</style></head><body>
+<div id="bar"></div>
+<canvas id="view"></canvas>
+<script>
+const cfg = __CONFIG__;
+const bar = document.getElementById("bar");
+const view = document.getElementById("view");
+const ctx = view.getContext("2d");
+const image = document.createElement("canvas");
+image.width = cfg.cols; image.height = cfg.rows;
+const imageCtx = image.getContext("2d");
+const imageData = imageCtx.createImageData(cfg.cols, cfg.rows);
+const info = document.createElement("span");
+let pixels = null;
+let voiLut = null;
+
+// Janela ajustada (custom) e zoom persistem entre fatias enquanto a janela da
+// página não mudar; sem ajuste, cada fatia usa a sua janela padrão
+const storageKey = "dicom-router-viewer";
+function initialState() {
+  return {base: cfg.stateKey, custom: false, wc: cfg.wc, ww: cfg.ww, zoom: 1, panX: 0, panY: 0};
+}
+let state = initialState();
+try {
+  const saved = JSON.parse(sessionStorage.getItem(storageKey) || "null");
+  if (saved && saved.base === cfg.stateKey) {
+    state = saved;
+    if (!state.custom) { state.wc = cfg.wc; state.ww = cfg.ww; }
+  }
+} catch (e) {}
+function save() {
+  try { sessionStorage.setItem(storageKey, JSON.stringify(state)); } catch (e) {}
+}
+
+function addButton(label, action) {
+  const button = document.createElement("button");
+  button.textContent = label;
+  button.onclick = action;
+  bar.appendChild(button);
+}
+if (!cfg.color) {
+  addButton("Padrão", () => {
+    state.custom = false; state.wc = cfg.wc; state.ww = cfg.ww; windowImage();
+  });
+  for (const [name, preset] of Object.entries(cfg.presets)) {
+    addButton(name, () => {
+      state.custom = true; state.wc = preset.wc; state.ww = preset.ww; windowImage();
+    });
+  }
+}
+addButton("1:1", () => { state.zoom = 1; state.panX = state.panY = 0; draw(); save(); });
+bar.appendChild(info);
+
+async function inflate(base64) {
+  const raw = Uint8Array.from(atob(base64), c => c.charCodeAt(0));
+  const stream = new Blob([raw]).stream().pipeThrough(new DecompressionStream("deflate"));
+  return new Uint8Array(await new Response(stream).arrayBuffer());
+}
+
+async function decode() {
+  if (cfg.lut) voiLut = await inflate(cfg.lut);
+  const planes = await inflate(cfg.data);
+  // Junta os planos de bytes baixos e altos de volta em int16
+  const count = cfg.rows * cfg.cols;
+  const values = new Int16Array(count);
+  for (let i = 0; i < count; i++) values[i] = planes[i] | (planes[count + i] << 8);
+  return values;
+}
+
+function windowLut() {
+  // VOI LUT do cabeçalho (já invertida se MONOCHROME1) até a janela ser ajustada
+  if (voiLut && !state.custom) return voiLut;
+  // Janela em valores da modalidade → códigos da fatia
+  const ww = Math.max(cfg.step, state.ww) / cfg.scale;
+  const lower = (state.wc - cfg.offset) / cfg.scale - ww / 2;
+  const lut = new Uint8ClampedArray(65536);
+  for (let v = 0; v < 65536; v++) {
+    const code = v < 32768 ? v : v - 65536;
+    const g = ((Math.min(Math.max(code, lower), lower + ww) - lower) / ww * 255) | 0;
+    lut[v] = cfg.invert ? 255 - g : g;
+  }
+  return lut;
+}
+
+function windowImage() {
+  if (!pixels) return;
+  const lut = windowLut();
+  const out = imageData.data;
+  for (let i = 0, j = 0; i < pixels.length; i++, j += 4) {
+    const g = lut[pixels[i] & 0xffff];
+    out[j] = out[j + 1] = out[j + 2] = g;
+    out[j + 3] = 255;
+  }
+  imageCtx.putImageData(imageData, 0, 0);
+  draw();
+  save();
+}
+
+function draw() {
+  const width = view.clientWidth;
+  const height = cfg.height - bar.offsetHeight - 4;
+  if (view.width !== width || view.height !== height) {
+    view.width = width; view.height = height;
+  }
+  const fit = Math.min(width / cfg.cols, height / cfg.rows);
+  const scale = fit * state.zoom;
+  const x = (width - cfg.cols * scale) / 2 + state.panX;
+  const y = (height - cfg.rows * scale) / 2 + state.panY;
+  ctx.fillStyle = "#000";
+  ctx.fillRect(0, 0, width, height);
+  ctx.imageSmoothingEnabled = scale < 2;
+  ctx.drawImage(image, x, y, cfg.cols * scale, cfg.rows * scale);
+  const level = cfg.color ? "" : voiLut && !state.custom ? "  VOI LUT" :
+                `  WC ${state.wc.toFixed(cfg.decimals)}  WW ${state.ww.toFixed(cfg.decimals)}`;
+  info.textContent = cfg.caption + level + (state.zoom !== 1 ? `  ${state.zoom.toFixed(1)}×` : "");
+}
+
+// Arrastar: horizontal = largura, vertical = centro; Shift+arrastar (ou cor) = pan
+let drag = null;
+view.addEventListener("mousedown", e => {
+  drag = {x: e.clientX, y: e.clientY, pan: e.shiftKey || cfg.color};
+  e.preventDefault();
+});
+window.addEventListener("mouseup", () => { if (drag) save(); drag = null; });
+window.addEventListener("mousemove", e => {
+  if (!drag) return;
+  const dx = e.clientX - drag.x, dy = e.clientY - drag.y;
+  drag.x = e.clientX; drag.y = e.clientY;
+  if (drag.pan) {
+    state.panX += dx; state.panY += dy; draw();
+  } else {
+    state.custom = true;
+    state.ww = Math.max(cfg.step, state.ww + dx * Math.max(cfg.step, state.ww / 200));
+    state.wc += dy * Math.max(cfg.step, state.ww / 400);
+    windowImage();
+  }
+});
+view.addEventListener("wheel", e => {
+  e.preventDefault();
+  state.zoom = Math.min(16, Math.max(0.5, state.zoom * (e.deltaY < 0 ? 1.15 : 1 / 1.15)));
+  draw(); save();
+}, {passive: false});
+view.addEventListener("dblclick", () => {
+  state = initialState();
+  if (cfg.color) { draw(); save(); } else windowImage();
+});
+window.addEventListener("resize", draw);
+
+async function showColor() {
+  const raw = Uint8Array.from(atob(cfg.data), c => c.charCodeAt(0));
+  const bitmap = await createImageBitmap(new Blob([raw], {type: "image/png"}));
+  imageCtx.drawImage(bitmap, 0, 0);
+  draw();
+}
+
+(cfg.color ? showColor() : decode().then(data => { pixels = data; windowImage(); }))
+  .catch(err => { info.textContent = "Falha ao decodificar a fatia: " + err; });
+</script></body></html>
+"""
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Encaminhamento cut-through: reenvia cada instância assim que o SCP a grava
+Quando uma associação de entrada é aceita, a de saída já é aberta com os
+mesmos contextos e reutilizada (pool) a cada rajada enquanto a entrada durar. Há um encaminhador por destino roteado.
+A cópia local permanece; se o encaminhamento falhar (ou o SCP encerrar com
+instâncias na fila), a entrega volta a pendente no catálogo e o SCU faz o
+reenvio.
+"""
+
+import os
+import time
+import queue
+import threading
+
+from dicom_sender import get_pool
+from metrics import END_TO_END_SECONDS, SEND_FAILURES
+import send_status
+from study_catalog import DEFAULT_DESTINATION, SEND_OK, SEND_PENDING
+from transcoder import format_stats, get_transcoder
+
+# Liga/desliga o encaminhamento durante a recepção
+SCP_CUT_THROUGH = os.getenv("SCP_CUT_THROUGH", "1") == "1"
+# Máximo de instâncias por rajada enviada de uma vez
+CUT_THROUGH_BATCH = int(os.getenv("CUT_THROUGH_BATCH", "32"))
+# Espera pela rajada em andamento ao encerrar o SCP (s)
+CUT_THROUGH_STOP_TIMEOUT = float(os.getenv("CUT_THROUGH_STOP_TIMEOUT", "10"))
+
+# Encaminhadores com thread viva (inclusive de associações já encerradas)
+_ACTIVE = set()
+_ACTIVE_LOCK = threading.Lock()
+
+
+class CutThroughForwarder:
+    """Fila de encaminhamento de uma associação de entrada para um destino (uma thread)"""
+
+    def __init__(self, catalog, contexts, label, destination):
+        self.catalog = catalog
+        self.contexts = list(dict.fromkeys(contexts))
+        self.destination = destination
+        self.label = f"{label} → {destination.name}"
+        self.pool = get_pool(destination.host, destination.port, destination.aet, destination.name)
+        # Após uma rajada sem nenhum sucesso, o resto fica para o SCU
+        self.gave_up = False
+        # Encerramento do SCP: o que ainda está na fila volta para o SCU
+        self._stopping = False
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name=f"cut-through-{label}-{destination.name}", daemon=True
+        )
+        with _ACTIVE_LOCK:
+            _ACTIVE.add(self)
+        self._thread.start()
+
+    def submit(self, study, instance, path, received):
+        """
+        Enfileira uma instância já gravada e registrada no catálogo.
+        `received`: time.time() da chegada do C-STORE (o received_epoch do catálogo)
+        """
+        self._queue.put((study, instance, path, received))
+
+    def close(self):
+        """Fim da associação de entrada: encaminha o que falta e encerra"""
+        self._queue.put(None)
+
+    def stop(self):
+        """Encerramento do SCP: termina a rajada em andamento e devolve o resto ao SCU"""
+        self._stopping = True
+        self._queue.put(None)
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _run(self):
+        try:
+            # Abre a associação de saída em paralelo à chegada da 1ª instância
+            with self.pool.acquire(self.contexts):
+                pass
+        except Exception as e:
+            print(f"⚠ Cut-through {self.label}: destino indisponível ({e}); o SCU fará o envio")
+            self.gave_up = True
+
+        try:
+            done = False
+            while not done:
+                batch, done = self._next_batch()
+                if not batch:
+                    continue
+                if self._stopping:
+                    self._release(batch)
+                    continue
+                try:
+                    self._forward(batch)
+                except Exception as e:
+                    print(f"⚠ Cut-through {self.label}: {e}; o SCU fará o envio")
+                    self._release(batch)
+        finally:
+            with _ACTIVE_LOCK:
+                _ACTIVE.discard(self)
+
+    def _release(self, batch):
+        """Reservas do lote voltam a pendentes: o SCU envia a partir da cópia local"""
+        name = self.destination.name
+        studies = {}
+        for study, instance, _, _ in batch:
+            studies.setdefault(study['study_uid'], {})[(instance['sop_instance_uid'], name)] = SEND_PENDING
+        for study_uid, delivery_states in studies.items():
+            try:
+                self.catalog.mark_deliveries(study_uid, delivery_states)
+            except Exception as e:
+                print(f"⚠ Cut-through {self.label}: falha ao devolver {len(delivery_states)} "
+                      f"entrega(s) ao SCU ({e})")
+
+    def _next_batch(self):
+        """Espera a próxima instância e junta as que já estão na fila"""
+        item = self._queue.get()
+        if item is None:
+            return [], True
+        batch = [item]
+        while len(batch) < CUT_THROUGH_BATCH:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _forward(self, batch):
+        if self.gave_up:
+            results = [(path, False, "cut-through desativado") for _, _, path, _ in batch]
+        else:
+            results, stats = get_transcoder("scp").send(self.pool, self.destination, [
+                (path, instance['sop_class_uid'], instance['transfer_syntax'])
+                for _, instance, path, _ in batch
+            ])
+            if stats['files']:
+                print(f"🗜 Cut-through {self.label}: {format_stats(stats)}")
+            self.catalog.add_transcode_stats(self.destination.name, stats)
+            if not any(ok for _, ok, _ in results):
+                print(f"⚠ Cut-through {self.label}: {results[0][2]}; o SCU fará o envio")
+                self.gave_up = True
+
+        name = self.destination.name
+        states = {}
+        now = time.time()
+        for (study, instance, _, received), (path, ok, message) in zip(batch, results):
+            label = path.name if name == DEFAULT_DESTINATION else f"{path.name} → {name}"
+            if ok:
+                print(f"⚡ Encaminhado: {label}")
+                END_TO_END_SECONDS.observe(now - received, destination=name)
+            else:
+                SEND_FAILURES.inc(destination=name)
+                if not self.gave_up:
+                    print(f"↪ {label}: {message} (fica para o SCU)")
+            entry = states.setdefault(study['study_uid'], (study, {}, []))
+            entry[1][(instance['sop_instance_uid'], name)] = SEND_OK if ok else SEND_PENDING
+            if ok:
+                entry[2].append((label, ok, message))
+
+        # Falhas voltam a pendente: o SCU reenvia a partir da cópia local
+        for study, delivery_states, sent in states.values():
+            self.catalog.mark_deliveries(study['study_uid'], delivery_states)
+            send_status.update_study_status(self.catalog.root, study['folder'], sent,
+                                            self.catalog.delivery_counts(study['study_uid']))
+
+
+def stop_all(timeout=CUT_THROUGH_STOP_TIMEOUT):
+    """
+    Encerra todos os encaminhadores do processo: cada um termina a rajada em
+    andamento e devolve o que estava na fila ao SCU. Reservas de uma rajada
+    que não terminar no prazo são devolvidas quando o worker reinicia
+    """
+    with _ACTIVE_LOCK:
+        forwarders = list(_ACTIVE)
+    for forwarder in forwarders:
+        forwarder.stop()
+    deadline = time.monotonic() + timeout
+    for forwarder in forwarders:
+        forwarder.join(max(0.0, deadline - time.monotonic()))
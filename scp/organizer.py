@@ -1,60 +1,25 @@
 #!/usr/bin/env python3
 """
 Monitor e organizador de arquivos DICOM
-Monitora a pasta raiz e organiza arquivos por paciente em tempo real
+Monitora a pasta raiz (inotify) e organiza arquivos por paciente em tempo real
 """
 
 import os
 import time
-import pydicom
 from pathlib import Path
-from datetime import datetime
 import shutil
-import json
+
+from dicom_header import HeaderParserPool, summarize_dicom_file
+from folder_watcher import FolderWatcher
+from routing_rules import load_router
+from study_catalog import SEND_PENDING, StudyCatalog
 
 DICOM_ROOT = Path(os.getenv("DICOM_ROOT", "/home/dicom"))
-METADATA_FILE = DICOM_ROOT / ".metadata.json"
+CATALOG = StudyCatalog(DICOM_ROOT)
+ROUTER = load_router()
+# Leitura de cabeçalhos em todos os núcleos (HEADER_WORKERS processos)
+HEADER_PARSER = HeaderParserPool()
 QUARANTINE_DIR = DICOM_ROOT / "_INVALID_NO_PIXELS"
-IMAGE_MODALITIES = {
-    "CR", "CT", "DX", "IO", "MG", "MR", "NM", "OT", "PT", "RF",
-    "RTIMAGE", "US", "XA", "XC",
-}
-
-def sanitize_filename(text):
-    """Remove caracteres inválidos"""
-    if not text:
-        return "UNKNOWN"
-    # Substitui separadores DICOM de PersonName por espaço
-    text = text.replace('^', ' ').replace('=', ' ')
-    # Remove caracteres problemáticos para filesystem
-    invalid_chars = '<>:"/\\|?*'
-    for char in invalid_chars:
-        text = text.replace(char, '_')
-    # Colapsa espaços múltiplos e limita tamanho
-    text = ' '.join(text.split())
-    return text.strip()[:50] or "UNKNOWN"
-
-def dataset_requires_pixel_data(ds):
-    modality = str(getattr(ds, "Modality", "")).upper()
-    if modality in IMAGE_MODALITIES:
-        return True
-    return hasattr(ds, "Rows") and hasattr(ds, "Columns")
-
-def dataset_has_pixel_data(ds):
-    return (
-        "PixelData" in ds
-        or "FloatPixelData" in ds
-        or "DoubleFloatPixelData" in ds
-    )
-
-def validate_image_dicom_has_pixels(filepath):
-    ds = pydicom.dcmread(filepath, stop_before_pixels=False)
-    if not dataset_requires_pixel_data(ds):
-        return True, "nao e imagem"
-    if not dataset_has_pixel_data(ds):
-        return False, "DICOM de imagem sem PixelData"
-    return True, "ok"
-
 def quarantine_invalid_dicom(filepath, reason):
     src = Path(filepath)
     QUARANTINE_DIR.mkdir(parents=True, exist_ok=True)
@@ -66,79 +31,31 @@ def quarantine_invalid_dicom(filepath, reason):
     shutil.move(str(src), str(dest))
     print(f"✗ Quarentena: {dest.name} ({reason})")
 
-def load_metadata():
-    """Carrega metadados de estudos conhecidos"""
-    if METADATA_FILE.exists():
-        with open(METADATA_FILE, 'r') as f:
-            return json.load(f)
-    return {}
-
-def save_metadata(metadata):
-    """Salva metadados"""
-    with open(METADATA_FILE, 'w') as f:
-        json.dump(metadata, f, indent=2)
-
-def get_or_create_study_folder(ds):
+def get_or_create_study_folder(study_meta):
     """
     Retorna pasta do estudo, criando se necessário
     Agrupa imagens do mesmo estudo na mesma pasta
     """
-    # Chave única do estudo
-    study_uid = str(getattr(ds, 'StudyInstanceUID', ''))
-    patient_id = sanitize_filename(str(getattr(ds, 'PatientID', 'UNKNOWN')))
-    patient_name = sanitize_filename(str(getattr(ds, 'PatientName', 'UNKNOWN')))
-    
-    # Carrega metadados
-    metadata = load_metadata()
-    
-    # Se estudo já conhecido, retorna pasta existente
-    if study_uid in metadata:
-        folder_name = metadata[study_uid]['folder']
-        return DICOM_ROOT / folder_name, metadata[study_uid]
-    
-    # Novo estudo - cria pasta com timestamp
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    folder_name = f"{timestamp}_{patient_id}_{patient_name}"
-    
-    # Garante nome único
-    counter = 1
-    original_name = folder_name
-    while (DICOM_ROOT / folder_name).exists():
-        folder_name = f"{original_name}_{counter}"
-        counter += 1
-    
-    # Cria metadados do estudo
-    study_metadata = {
-        'folder': folder_name,
-        'patient_id': patient_id,
-        'patient_name': patient_name,
-        'study_uid': study_uid,
-        'study_date': str(getattr(ds, 'StudyDate', '')),
-        'study_time': str(getattr(ds, 'StudyTime', '')),
-        'modality': str(getattr(ds, 'Modality', 'UNKNOWN')),
-        'created_at': timestamp,
-        'image_count': 0,
-        'study_description': str(getattr(ds, 'StudyDescription', ''))
-    }
-    
-    metadata[study_uid] = study_metadata
-    save_metadata(metadata)
-    
-    return DICOM_ROOT / folder_name, study_metadata
+    # Busca/registra o estudo no catálogo a partir do resumo do cabeçalho
+    study, _ = CATALOG.get_or_create_study(study_meta)
+    return DICOM_ROOT / study['folder'], study
 
-def organize_file(filepath):
-    """Organiza um arquivo DICOM"""
+def organize_file(filepath, summary=None):
+    """Organiza um arquivo DICOM (`summary`: resumo já lido no pool de processos)"""
     try:
-        ok_pixels, reason = validate_image_dicom_has_pixels(filepath)
-        if not ok_pixels:
-            quarantine_invalid_dicom(filepath, reason)
+        # Uma única leitura do cabeçalho: validação, pasta e metadados
+        if summary is None:
+            summary = summarize_dicom_file(filepath, ROUTER.keywords)
+        if not summary['readable']:
+            # Ilegível (ex.: ainda sendo gravado): deixa na raiz para nova tentativa
+            print(f"✗ Erro ao organizar {filepath}: {summary['reason']}")
+            return False
+        if not summary['ok']:
+            quarantine_invalid_dicom(filepath, summary['reason'])
             return False
-
-        # Lê metadados
-        ds = pydicom.dcmread(filepath, stop_before_pixels=True)
         
         # Obtém ou cria pasta do estudo
-        dest_folder, study_meta = get_or_create_study_folder(ds)
+        dest_folder, study_meta = get_or_create_study_folder(summary['study'])
         dest_folder.mkdir(parents=True, exist_ok=True)
         
         # Move arquivo
@@ -153,12 +70,15 @@ def organize_file(filepath):
         
         shutil.move(filepath, dest_path)
         
-        # Atualiza contador de imagens
-        study_uid = str(ds.StudyInstanceUID)
-        metadata = load_metadata()
-        if study_uid in metadata:
-            metadata[study_uid]['image_count'] += 1
-            save_metadata(metadata)
+        # Registra a instância e atualiza contador de imagens
+        CATALOG.record_instances(study_meta['study_uid'], [{
+            **summary['instance'],
+            'filename': dest_path.name,
+            'size_bytes': dest_path.stat().st_size,
+            # Recepção = gravação pelo storescp (o move preserva o mtime)
+            'received_epoch': dest_path.stat().st_mtime,
+            'deliveries': {name: SEND_PENDING for name in ROUTER.route(summary['tags'])},
+        }])
         
         print(f"✓ {study_meta['folder']}: {filename}")
         return True
@@ -174,23 +94,21 @@ def monitor_and_organize():
     print(f"Pasta: {DICOM_ROOT}")
     print("=" * 60)
     
-    processed = set()
+    # Eventos inotify na raiz (não em subpastas) + varredura periódica de segurança
+    watcher = FolderWatcher(DICOM_ROOT).start()
     
     while True:
         try:
-            # Procura arquivos .dcm na raiz (não em subpastas)
-            root_files = [f for f in DICOM_ROOT.glob("*.dcm") if f.is_file()]
-            
-            for filepath in root_files:
-                if filepath not in processed:
-                    if organize_file(filepath):
-                        processed.add(filepath)
-            
-            # Aguarda antes de verificar novamente
-            time.sleep(2)
+            # Pode já ter sido movido (evento e varredura do mesmo arquivo)
+            files = [f for f in watcher.get_batch(timeout=1.0) if f.is_file()]
+            # Cabeçalhos lidos em paralelo; mover e catalogar segue aqui, em ordem
+            for filepath, summary in zip(files, HEADER_PARSER.map(files, ROUTER.keywords)):
+                organize_file(str(filepath), summary)
             
         except KeyboardInterrupt:
             print("\n⚠ Encerrando monitor...")
+            watcher.stop()
+            HEADER_PARSER.shutdown()
             break
         except Exception as e:
             print(f"✗ Erro no monitor: {e}")
@@ -5,11 +5,17 @@ DICOM_ROOT="${DICOM_ROOT:-/home/dicom}"
 SCP_PORT="${SCP_PORT:-104}"
 SCP_AET="${SCP_AET:-DICOMRS_SCP}"
 
-mkdir -p "$DICOM_ROOT"
+# O storescp grava em uma pasta oculta de spool e, só depois que o arquivo
+# foi recebido e fechado, o move (rename atômico, mesmo volume) para a raiz.
+# Assim todo .dcm que aparece na raiz (IN_MOVED_TO) já está completo.
+INCOMING_DIR="$DICOM_ROOT/.incoming"
+
+mkdir -p "$DICOM_ROOT" "$INCOMING_DIR"
 
 exec storescp \
   --verbose \
   --aetitle "$SCP_AET" \
   "$SCP_PORT" \
   --filename-extension .dcm \
-  -od "$DICOM_ROOT"
+  -od "$INCOMING_DIR" \
+  --exec-on-reception "mv -f '#p/#f' '$DICOM_ROOT/#f'"
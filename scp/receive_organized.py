@@ -8,55 +8,16 @@ import os
 import sys
 import subprocess
 from pathlib import Path
-import pydicom
 from datetime import datetime
 import shutil
 
+from dicom_header import sanitize_filename, validate_image_dicom_has_pixels
+
 # Diretório de destino
 DICOM_ROOT = os.getenv("DICOM_ROOT", "/home/dicom")
 SCP_PORT = os.getenv("SCP_PORT", "104")
 SCP_AET = os.getenv("SCP_AET", "DICOMRS_SCP")
 QUARANTINE_DIR = Path(DICOM_ROOT) / "_INVALID_NO_PIXELS"
-IMAGE_MODALITIES = {
-    "CR", "CT", "DX", "IO", "MG", "MR", "NM", "OT", "PT", "RF",
-    "RTIMAGE", "US", "XA", "XC",
-}
-
-def sanitize_filename(text):
-    """Remove caracteres inválidos de nomes de arquivo/pasta"""
-    if not text:
-        return "UNKNOWN"
-    # Substitui separadores DICOM de PersonName por espaço
-    text = text.replace('^', ' ').replace('=', ' ')
-    # Remove caracteres problemáticos para filesystem
-    invalid_chars = '<>:"/\\|?*'
-    for char in invalid_chars:
-        text = text.replace(char, '_')
-    # Colapsa espaços múltiplos
-    text = ' '.join(text.split())
-    return text.strip() or "UNKNOWN"
-
-def dataset_requires_pixel_data(ds):
-    modality = str(getattr(ds, "Modality", "")).upper()
-    if modality in IMAGE_MODALITIES:
-        return True
-    return hasattr(ds, "Rows") and hasattr(ds, "Columns")
-
-def dataset_has_pixel_data(ds):
-    return (
-        "PixelData" in ds
-        or "FloatPixelData" in ds
-        or "DoubleFloatPixelData" in ds
-    )
-
-def validate_image_dicom_has_pixels(filepath):
-    ds = pydicom.dcmread(filepath, stop_before_pixels=False)
-    if not dataset_requires_pixel_data(ds):
-        return True, "nao e imagem"
-    if not dataset_has_pixel_data(ds):
-        return False, "DICOM de imagem sem PixelData"
-    return True, "ok"
-
 def quarantine_invalid_dicom(filepath, reason):
     src = Path(filepath)
     QUARANTINE_DIR.mkdir(parents=True, exist_ok=True)
@@ -74,17 +35,19 @@ def organize_dicom_file(filepath):
     Estrutura: /home/dicom/YYYYMMDD_HHMMSS_PatientID_PatientName/
     """
     try:
-        ok_pixels, reason = validate_image_dicom_has_pixels(filepath)
+        # Uma única leitura do cabeçalho para validar e organizar
+        ok_pixels, reason, ds = validate_image_dicom_has_pixels(filepath)
+        if ds is None:
+            # Ilegível (ex.: ainda sendo gravado): deixa na raiz para nova tentativa
+            print(f"✗ Erro ao organizar {filepath}: {reason}", file=sys.stderr)
+            return False
         if not ok_pixels:
             quarantine_invalid_dicom(filepath, reason)
             return False
-
-        # Lê metadados DICOM (sem pixels) para organizar
-        ds = pydicom.dcmread(filepath, stop_before_pixels=True)
         
         # Extrai informações do paciente
-        patient_id = sanitize_filename(str(getattr(ds, 'PatientID', 'UNKNOWN')))
-        patient_name = sanitize_filename(str(getattr(ds, 'PatientName', 'UNKNOWN')))
+        patient_id = sanitize_filename(str(getattr(ds, 'PatientID', 'UNKNOWN')), max_length=None)
+        patient_name = sanitize_filename(str(getattr(ds, 'PatientName', 'UNKNOWN')), max_length=None)
         
         # Cria timestamp da recepção
         reception_time = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+DICOM Storage SCP nativo (pynetdicom)
+Substitui o storescp (receive.sh): atende várias associações simultâneas e
+grava cada instância direto na pasta do estudo, usando o cabeçalho que já
+está em memória, registrando-a no catálogo no mesmo passo. O SCU encontra
+as instâncias pendentes pelo catálogo, sem reler nem mover arquivos.
+
+Cada instância é roteada pelas regras de tags (routing_rules.py) para um ou
+mais destinos; com SCP_CUT_THROUGH=1 ela já é encaminhada a cada um deles
+enquanto a associação de entrada continua recebendo (ver forwarder.py).
+
+Com SCP_WORKERS > 1, vários processos escutam a mesma porta (SO_REUSEPORT)
+e o kernel distribui as conexões entre eles.
+"""
+
+import os
+import sys
+import time
+import signal
+import socket
+import threading
+import multiprocessing
+from functools import partial
+from io import BytesIO
+from pathlib import Path
+
+from pydicom.uid import generate_uid
+from pynetdicom import AE, ALL_TRANSFER_SYNTAXES, AllStoragePresentationContexts, evt, _config
+from pynetdicom.sop_class import Verification
+from pynetdicom.transport import AssociationServer
+
+from dicom_header import (
+    instance_metadata_from_header,
+    read_dicom_header,
+    study_metadata_from_header,
+    validate_header_has_pixels,
+)
+from forwarder import SCP_CUT_THROUGH, CutThroughForwarder, stop_all
+from metrics import (
+    METRICS_FOLDER,
+    QUARANTINED,
+    RECEIVED_BYTES,
+    RECEIVED_FILES,
+    VALIDATE_SECONDS,
+    gauge,
+    histogram,
+    read_snapshots,
+    start_metrics_server,
+    start_snapshot_writer,
+    write_snapshot,
+)
+from transcoder import get_transcoder
+from routing_rules import load_router
+from study_catalog import SEND_CLAIMED, SEND_PENDING, StudyCatalog
+
+# Força flush imediato do output
+sys.stdout.reconfigure(line_buffering=True)
+sys.stderr.reconfigure(line_buffering=True)
+
+# Aceita também SOP Classes privadas/desconhecidas como armazenamento
+_config.UNRESTRICTED_STORAGE_SERVICE = True
+
+DICOM_ROOT = Path(os.getenv("DICOM_ROOT", "/home/dicom"))
+SCP_PORT = int(os.getenv("SCP_PORT", "104"))
+SCP_AET = os.getenv("SCP_AET", "DICOMRS_SCP")
+# Processos receptores e associações simultâneas por processo
+SCP_WORKERS = int(os.getenv("SCP_WORKERS", "2"))
+SCP_MAX_ASSOCIATIONS = int(os.getenv("SCP_MAX_ASSOCIATIONS", "16"))
+# Tamanho máximo de PDU aceito (0 = sem limite)
+SCP_MAX_PDU = int(os.getenv("SCP_MAX_PDU", "0"))
+
+QUARANTINE_FOLDER = DICOM_ROOT / "_INVALID_NO_PIXELS"
+
+# Catálogo de estudos (SQLite) compartilhado com SCU e dashboard
+CATALOG = StudyCatalog(DICOM_ROOT)
+
+# Destinos e regras de roteamento (os mesmos do SCU)
+ROUTER = load_router()
+
+# Dono das entregas reservadas pelo cut-through deste worker (ver serve)
+CLAIM_OWNER = "scp-0"
+
+# Sessão (contextos + encaminhadores) de cada associação de entrada ativa
+SESSIONS = {}
+SESSIONS_LOCK = threading.Lock()
+
+# Métricas próprias do receptor (as comuns estão em metrics.py)
+ASSOCIATIONS = gauge("dicom_router_associations_active", "Associações de entrada abertas")
+STORE_SECONDS = histogram("dicom_router_store_seconds",
+                          "Gravação em disco + registro no catálogo de uma instância recebida")
+
+# Status C-STORE
+STATUS_SUCCESS = 0x0000
+STATUS_OUT_OF_RESOURCES = 0xA700
+STATUS_CANNOT_UNDERSTAND = 0xC000
+
+
+class ReusePortAssociationServer(AssociationServer):
+    """Servidor de associações com SO_REUSEPORT (vários processos na mesma porta)"""
+
+    def server_bind(self):
+        if SCP_WORKERS > 1 and hasattr(socket, "SO_REUSEPORT"):
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+class AssociationSession:
+    """Estado de uma associação de entrada: um encaminhador por destino, criado sob demanda"""
+
+    def __init__(self, calling_aet, contexts):
+        self.calling_aet = calling_aet
+        self.contexts = contexts
+        self.forwarders = {}
+
+    def forwarder(self, name):
+        if not (SCP_CUT_THROUGH and self.contexts):
+            return None
+        forwarder = self.forwarders.get(name)
+        if forwarder is None:
+            forwarder = CutThroughForwarder(
+                CATALOG, self.contexts, self.calling_aet, ROUTER.destinations[name],
+            )
+            self.forwarders[name] = forwarder
+        return forwarder
+
+    def close(self):
+        for forwarder in self.forwarders.values():
+            forwarder.close()
+
+
+def instance_filename(instance):
+    """Nome do arquivo no estilo do storescp: MODALIDADE.SOPInstanceUID.dcm"""
+    modality = instance['modality'] or "UN"
+    sop_uid = instance['sop_instance_uid'] or str(generate_uid())
+    return f"{modality}.{sop_uid}.dcm"
+
+
+def write_atomic(dest_path, data):
+    """Grava em nome temporário oculto e renomeia: o .dcm só existe completo"""
+    tmp_path = dest_path.with_name(f".{dest_path.name}.tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, dest_path)
+
+
+def quarantine_instance(data, filename, reason):
+    """Grava instância inválida na quarentena para análise manual"""
+    QUARANTINE_FOLDER.mkdir(parents=True, exist_ok=True)
+    dest = QUARANTINE_FOLDER / filename
+    counter = 1
+    while dest.exists():
+        dest = QUARANTINE_FOLDER / f"{Path(filename).stem}_{counter}.dcm"
+        counter += 1
+    write_atomic(dest, data)
+    QUARANTINED.inc()
+    print(f"🚫 DICOM inválido gravado na quarentena: {dest.name} ({reason})")
+
+
+def handle_store(event):
+    """Grava a instância recebida na pasta do estudo e registra no catálogo"""
+    # Recepção (latência ponta a ponta): a mesma no catálogo e no cut-through
+    received = time.time()
+    started = time.perf_counter()
+    try:
+        # Bytes como vieram da rede (preâmbulo + file meta + dataset), sem decodificar
+        data = event.encoded_dataset()
+        ds = read_dicom_header(BytesIO(data))
+    except Exception as e:
+        print(f"❌ Instância ilegível de {event.assoc.requestor.ae_title}: {e}")
+        return STATUS_CANNOT_UNDERSTAND
+    RECEIVED_FILES.inc(calling_aet=event.assoc.requestor.ae_title)
+    RECEIVED_BYTES.inc(len(data), calling_aet=event.assoc.requestor.ae_title)
+
+    instance = instance_metadata_from_header(ds)
+    filename = instance_filename(instance)
+
+    # Trava de integridade: imagem sem pixels não entra no fluxo de envio
+    ok_pixels, reason = validate_header_has_pixels(ds)
+    VALIDATE_SECONDS.observe(time.perf_counter() - started)
+    if not ok_pixels:
+        try:
+            quarantine_instance(data, filename, reason)
+        except OSError as e:
+            print(f"⚠ Falha ao gravar na quarentena {filename}: {e}")
+            return STATUS_OUT_OF_RESOURCES
+        return STATUS_SUCCESS
+
+    with SESSIONS_LOCK:
+        session = SESSIONS.get(event.assoc)
+    calling_aet = session.calling_aet if session else event.assoc.requestor.ae_title
+    destinations = ROUTER.route(ds, calling_aet=calling_aet, called_aet=SCP_AET)
+    # Uma entrega por destino: com encaminhador já reservada, senão pendente para o SCU
+    forwarders = {name: session.forwarder(name) if session else None for name in destinations}
+    deliveries = {
+        name: SEND_CLAIMED if forwarder else SEND_PENDING
+        for name, forwarder in forwarders.items()
+    }
+
+    started = time.perf_counter()
+    try:
+        study, _ = CATALOG.get_or_create_study(study_metadata_from_header(ds))
+        dest_path = DICOM_ROOT / study['folder'] / filename
+        write_atomic(dest_path, data)
+        # O estudo volta a "não enviado" até as entregas desta instância saírem
+        CATALOG.record_instances(study['study_uid'], [{
+            **instance,
+            'filename': filename,
+            'size_bytes': len(data),
+            'received_epoch': received,
+            'deliveries': deliveries,
+        }], claim_owner=CLAIM_OWNER)
+    except Exception as e:
+        print(f"❌ Falha ao gravar {filename}: {e}")
+        return STATUS_OUT_OF_RESOURCES
+    STORE_SECONDS.observe(time.perf_counter() - started)
+
+    print(f"📥 {study['folder']}/{filename}")
+    if not destinations:
+        print(f"⚠ Nenhuma regra de roteamento casou: {filename}")
+    for forwarder in forwarders.values():
+        if forwarder:
+            forwarder.submit(study, instance, dest_path, received)
+    return STATUS_SUCCESS
+
+
+def handle_accepted(event):
+    requestor = event.assoc.requestor
+    print(f"🔗 Associação aceita: {requestor.ae_title} ({requestor.address})")
+    # Mesmos contextos (SOP Class, Transfer Syntax) negociados na entrada
+    contexts = [
+        (str(cx.abstract_syntax), str(cx.transfer_syntax[0]))
+        for cx in event.assoc.accepted_contexts
+        if cx.abstract_syntax != Verification
+    ]
+    with SESSIONS_LOCK:
+        SESSIONS[event.assoc] = AssociationSession(requestor.ae_title, contexts)
+    ASSOCIATIONS.inc()
+
+
+def handle_closed(event, reason):
+    print(f"🔌 Associação {reason}: {event.assoc.requestor.ae_title}")
+    with SESSIONS_LOCK:
+        session = SESSIONS.pop(event.assoc, None)
+    if session:
+        ASSOCIATIONS.dec()
+        session.close()
+
+
+def create_ae():
+    """AE receptor: todas as SOP Classes de armazenamento e Transfer Syntaxes + C-ECHO"""
+    ae = AE(ae_title=SCP_AET)
+    ae.maximum_associations = SCP_MAX_ASSOCIATIONS
+    ae.maximum_pdu_size = SCP_MAX_PDU
+    for cx in AllStoragePresentationContexts:
+        ae.add_supported_context(cx.abstract_syntax, ALL_TRANSFER_SYNTAXES)
+    ae.add_supported_context(Verification)
+    return ae
+
+
+def serve(worker_id=0, publish_metrics=False):
+    """
+    Atende associações até o processo ser encerrado
+    `publish_metrics`: grava as métricas deste worker para o processo principal
+    """
+    global CLAIM_OWNER
+    CLAIM_OWNER = f"scp-{worker_id}"
+    # Reservas de cut-through de uma execução anterior deste worker voltam ao SCU
+    released = CATALOG.release_claimed_deliveries(owner=CLAIM_OWNER)
+    if released:
+        print(f"↩ Worker {worker_id}: {released} entrega(s) reservada(s) devolvida(s) ao SCU")
+    handlers = [
+        (evt.EVT_C_STORE, handle_store),
+        (evt.EVT_ACCEPTED, handle_accepted),
+        (evt.EVT_RELEASED, handle_closed, ["liberada"]),
+        (evt.EVT_ABORTED, handle_closed, ["abortada"]),
+    ]
+    server = create_ae().make_server(
+        ("", SCP_PORT), evt_handlers=handlers, server_class=ReusePortAssociationServer,
+    )
+    print(f"👂 Worker {worker_id} (pid {os.getpid()}) escutando na porta {SCP_PORT}")
+    snapshot_path = METRICS_FOLDER / f"scp-{worker_id}.json"
+    if publish_metrics:
+        start_snapshot_writer(snapshot_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # make_server não registra o servidor no AE: só fecha o socket
+        server.server_close()
+        # Encaminhadores não são abandonados com a thread: a fila volta ao SCU
+        stop_all()
+        get_transcoder("scp").shutdown()
+        if publish_metrics:
+            write_snapshot(snapshot_path)
+
+
+def main():
+    print("=" * 60)
+    print("DICOM Storage SCP nativo")
+    print(f"AET: {SCP_AET} | Porta: {SCP_PORT}")
+    print(f"Pasta: {DICOM_ROOT}")
+    print(f"Workers: {SCP_WORKERS} | Associações por worker: {SCP_MAX_ASSOCIATIONS}")
+    print(f"Cut-through: {'ativo' if SCP_CUT_THROUGH else 'desativado'}")
+    print(ROUTER.describe())
+    print("=" * 60)
+
+    DICOM_ROOT.mkdir(parents=True, exist_ok=True)
+    get_transcoder("scp").cleanup_stale()
+    # docker stop (SIGTERM) encerra como Ctrl+C, derrubando também os workers
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    if SCP_WORKERS <= 1:
+        start_metrics_server()
+        serve()
+        return
+
+    # Contadores recomeçam junto com os workers: descarta retratos antigos
+    for path in METRICS_FOLDER.glob("scp-*.json"):
+        path.unlink(missing_ok=True)
+    start_metrics_server(sources=partial(read_snapshots, METRICS_FOLDER, "scp-*.json"))
+
+    # Um processo por worker; reinicia o que morrer. Não são daemon para
+    # poderem ter o próprio pool de processos de transcodificação
+    workers = {}
+    try:
+        while True:
+            for worker_id in range(SCP_WORKERS):
+                proc = workers.get(worker_id)
+                if proc is None or not proc.is_alive():
+                    if proc is not None:
+                        print(f"⚠ Worker {worker_id} encerrou (código {proc.exitcode}); reiniciando")
+                    proc = multiprocessing.Process(target=serve, args=(worker_id, True))
+                    proc.start()
+                    workers[worker_id] = proc
+            time.sleep(2)
+    except KeyboardInterrupt:
+        print("\n⚠ Encerrando receptor...")
+        for proc in workers.values():
+            proc.terminate()
+        for proc in workers.values():
+            proc.join(timeout=5)
+
+
+if __name__ == "__main__":
+    main()
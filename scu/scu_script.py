@@ -1,157 +1,92 @@
 #!/usr/bin/env python3
 """
 DICOM SCU - Envia arquivos DICOM e organiza por paciente
-Monitora pasta raiz, envia ao destino, e organiza em subpastas
+Envia aos destinos roteados (pool de associações persistentes por destino)
+as entregas pendentes no catálogo: instâncias que o SCP nativo gravou direto
+nas pastas de estudo e arquivos soltos na pasta raiz, que organiza antes
 """
 
 import os
 import sys
-import subprocess
 import time
 import shutil
+import signal
+import asyncio
+from functools import partial
 from pathlib import Path
 from datetime import datetime
-import json
+
+from dicom_header import HeaderParserPool, summarize_dicom_file
+from dicom_sender import close_all_pools, get_pool
+from folder_watcher import FolderWatcher
+from metrics import (
+    DISCOVER_SECONDS,
+    END_TO_END_SECONDS,
+    QUARANTINED,
+    SEND_FAILURES,
+    SEND_RETRIES,
+    VALIDATE_SECONDS,
+    add_collector,
+    gauge,
+    start_metrics_server,
+)
+from pipeline import Pipeline, Source, Stage
+from previews import PREVIEW_SETTLE, PreviewBuilder
+from routing_rules import load_router
+import send_status
+from study_catalog import (
+    DEFAULT_DESTINATION,
+    SEND_CLAIMED,
+    SEND_FAILED,
+    SEND_PENDING,
+    StudyCatalog,
+)
+from transcoder import format_stats, get_transcoder, syntax_names
 
 # Força flush imediato do output
 sys.stdout.reconfigure(line_buffering=True)
 sys.stderr.reconfigure(line_buffering=True)
 
-try:
-    import pydicom
-    HAS_PYDICOM = True
-except ImportError:
-    HAS_PYDICOM = False
-    print("⚠ pydicom não disponível - organizando por timestamp apenas", flush=True)
-
-# Configurações do destino
-TARGET_HOST = os.getenv("TARGET_HOST", "192.168.10.16")
-TARGET_PORT = os.getenv("TARGET_PORT", "4243")
-TARGET_AET = os.getenv("TARGET_AET", "ZEROCLICK")
+# Destinos e regras de roteamento (TARGET_* é o destino "default")
+ROUTER = load_router()
 
 # Diretórios
 WATCH_FOLDER = Path(os.getenv("DICOM_ROOT", "/home/dicom"))
-METADATA_FILE = WATCH_FOLDER / ".metadata.json"
-STATUS_FILE = WATCH_FOLDER / ".send_status.json"
 QUARANTINE_FOLDER = WATCH_FOLDER / "_INVALID_NO_PIXELS"
+# Arquivos reservados por um worker (rename atômico tira o arquivo da raiz)
+CLAIM_FOLDER = WATCH_FOLDER / ".sending"
 
-IMAGE_MODALITIES = {
-    "CR", "CT", "DX", "IO", "MG", "MR", "NM", "OT", "PT", "RF",
-    "RTIMAGE", "US", "XA", "XC",
-}
-
-def sanitize_filename(text):
-    """Remove caracteres inválidos"""
-    if not text:
-        return "UNKNOWN"
-    # Substitui separadores DICOM de PersonName por espaço
-    text = text.replace('^', ' ').replace('=', ' ')
-    # Remove caracteres problemáticos para filesystem
-    invalid_chars = '<>:"/\\|?*'
-    for char in invalid_chars:
-        text = text.replace(char, '_')
-    # Colapsa espaços múltiplos e limita tamanho
-    text = ' '.join(text.split())
-    return text.strip()[:50] or "UNKNOWN"
-
-def load_metadata():
-    """Carrega metadados de estudos conhecidos"""
-    if METADATA_FILE.exists():
-        try:
-            with open(METADATA_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
-
-def save_metadata(metadata):
-    """Salva metadados"""
-    try:
-        with open(METADATA_FILE, 'w') as f:
-            json.dump(metadata, f, indent=2)
-    except Exception as e:
-        print(f"Erro ao salvar metadata: {e}")
+# Paralelismo: workers do SCU e tamanho máximo de cada lote enviado
+SCU_WORKERS = int(os.getenv("SCU_WORKERS", "4"))
+SCU_BATCH_SIZE = int(os.getenv("SCU_BATCH_SIZE", "100"))
+# Lotes aguardando os workers de envio; cheio, o claim para de reservar
+SEND_QUEUE_SIZE = int(os.getenv("SEND_QUEUE_SIZE", str(SCU_WORKERS * 2)))
 
-def load_send_status():
-    """Carrega status de envio"""
-    if STATUS_FILE.exists():
-        try:
-            with open(STATUS_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
-
-def save_send_status(status):
-    """Salva status de envio"""
-    try:
-        with open(STATUS_FILE, 'w') as f:
-            json.dump(status, f, indent=2)
-    except Exception as e:
-        print(f"Erro ao salvar status: {e}")
-
-def clean_study_description(ds):
-    """Limpa caracteres inválidos do campo StudyDescription"""
-    if 'StudyDescription' in ds:
-        desc = ds.StudyDescription
-        # Remove caracteres não imprimíveis ou substitui por espaço
-        desc_clean = ''.join(c if c.isprintable() else ' ' for c in desc)
-        # Garante UTF-8 válido
-        desc_clean = desc_clean.encode('utf-8', errors='replace').decode('utf-8')
-        ds.StudyDescription = desc_clean
-
-def read_dicom_metadata_only(filepath):
-    """
-    Lê apenas metadados e marca o dataset como leitura sem pixels.
-    Use safe_save_dicom() se algum dia precisar regravar.
-    """
-    ds = pydicom.dcmread(filepath, stop_before_pixels=True)
-    ds._read_without_pixels = True
-    return ds
-
-def dataset_requires_pixel_data(ds):
-    """Heurística conservadora: imagens devem ter PixelData."""
-    modality = str(getattr(ds, "Modality", "")).upper()
-    if modality in IMAGE_MODALITIES:
-        return True
-    return hasattr(ds, "Rows") and hasattr(ds, "Columns")
-
-def dataset_has_pixel_data(ds):
-    return (
-        "PixelData" in ds
-        or "FloatPixelData" in ds
-        or "DoubleFloatPixelData" in ds
-    )
+# Pipeline (discover → classify → route ⇢ claim → send → commit): concorrência
+# de cada estágio e tamanho das filas entre eles (lotes); send usa SCU_WORKERS
+PIPELINE_CLASSIFY_CONCURRENCY = int(os.getenv("PIPELINE_CLASSIFY_CONCURRENCY", "2"))
+PIPELINE_ROUTE_CONCURRENCY = int(os.getenv("PIPELINE_ROUTE_CONCURRENCY", "1"))
+PIPELINE_COMMIT_CONCURRENCY = int(os.getenv("PIPELINE_COMMIT_CONCURRENCY", "1"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))
 
-def safe_save_dicom(ds, filepath):
-    """
-    Bloqueia gravação acidental de datasets lidos sem pixels.
-    Isso evita corromper arquivos de imagem por save_as() após stop_before_pixels=True.
-    """
-    if getattr(ds, "_read_without_pixels", False) and dataset_requires_pixel_data(ds):
-        raise RuntimeError(
-            "Bloqueado: tentativa de salvar DICOM lido com stop_before_pixels=True. "
-            "Isso pode remover PixelData."
-        )
-    ds.save_as(filepath)
-
-def validate_image_dicom_has_pixels(filepath):
-    """
-    Valida se um DICOM de imagem contém pixel data.
-    Retorna (ok, motivo).
-    """
-    if not HAS_PYDICOM:
-        return True, "pydicom indisponível"
-    try:
-        ds = pydicom.dcmread(filepath, stop_before_pixels=False)
-    except Exception as e:
-        return False, f"falha ao ler DICOM: {e}"
+# Catálogo de estudos (SQLite) compartilhado com organizador e dashboard
+CATALOG = StudyCatalog(WATCH_FOLDER)
+
+# Recodificação sem perdas por destino (pool de processos), se configurada
+TRANSCODER = get_transcoder("scu")
+
+# Leitura de cabeçalhos em todos os núcleos (HEADER_WORKERS processos)
+HEADER_PARSER = HeaderParserPool()
+
+# Prévias por série para o dashboard (PREVIEW_WORKERS processos com nice 19)
+PREVIEWS = PreviewBuilder()
+# Séries na fila/geração de prévia (o scan não as devolve de novo)
+PREVIEWS_IN_FLIGHT = set()
 
-    if not dataset_requires_pixel_data(ds):
-        return True, "não é imagem"
-    if not dataset_has_pixel_data(ds):
-        return False, "DICOM de imagem sem PixelData"
-    return True, "ok"
+# Entregas do catálogo ainda não concluídas, lidas a cada coleta do /metrics
+DELIVERY_BACKLOG = gauge("dicom_router_deliveries_backlog",
+                         "Entregas não concluídas no catálogo", ("destination", "state"))
+DELIVERY_STATES = {SEND_PENDING: "pending", SEND_CLAIMED: "sending", SEND_FAILED: "retry"}
 
 def quarantine_invalid_dicom(filepath, reason):
     """Move arquivo inválido para quarentena para análise manual."""
@@ -163,63 +98,26 @@ def quarantine_invalid_dicom(filepath, reason):
         dest = QUARANTINE_FOLDER / f"{src.stem}_{counter}{src.suffix}"
         counter += 1
     shutil.move(str(src), str(dest))
+    QUARANTINED.inc()
     print(f"🚫 DICOM inválido movido para quarentena: {dest.name} ({reason})")
     return dest
 
-def get_or_create_study_folder(filepath):
+def get_or_create_study_folder(study_meta):
     """
-    Obtém ou cria pasta do estudo baseado nos metadados DICOM
+    Obtém ou cria pasta do estudo a partir do resumo do cabeçalho
     Retorna (pasta_destino, study_uid)
     """
-    study_uid = None
     folder_name = None
+    study_uid = study_meta['study_uid']
     
-    if HAS_PYDICOM:
-        try:
-            ds = read_dicom_metadata_only(filepath)
-            clean_study_description(ds)
-            # Nao regravar o DICOM apos leitura com stop_before_pixels=True:
-            # isso pode salvar o arquivo sem PixelData e corromper a imagem.
-            study_uid = str(getattr(ds, 'StudyInstanceUID', ''))
-            patient_id = sanitize_filename(str(getattr(ds, 'PatientID', 'UNKNOWN')))
-            patient_name = sanitize_filename(str(getattr(ds, 'PatientName', 'UNKNOWN')))
-            
-            # Verifica se estudo já existe
-            metadata = load_metadata()
-            if study_uid and study_uid in metadata:
-                folder_name = metadata[study_uid]['folder']
-            else:
-                # Novo estudo - cria pasta
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                folder_name = f"{timestamp}_{patient_id}_{patient_name}"
-                
-                # Garante nome único
-                counter = 1
-                original_name = folder_name
-                while (WATCH_FOLDER / folder_name).exists():
-                    folder_name = f"{original_name}_{counter}"
-                    counter += 1
-                
-                # Salva metadados
-                metadata[study_uid] = {
-                    'folder': folder_name,
-                    'patient_id': patient_id,
-                    'patient_name': patient_name,
-                    'study_uid': study_uid,
-                    'study_date': str(getattr(ds, 'StudyDate', '')),
-                    'study_time': str(getattr(ds, 'StudyTime', '')),
-                    'modality': str(getattr(ds, 'Modality', 'UNKNOWN')),
-                    'study_description': str(getattr(ds, 'StudyDescription', '')),
-                    'created_at': timestamp,
-                    'image_count': 0,
-                    'sent': False
-                }
-                save_metadata(metadata)
-                
-        except Exception as e:
-            print(f"⚠ Erro ao ler DICOM: {e}")
+    try:
+        # Busca ou registra o estudo no catálogo (cria a pasta se for novo)
+        study, _ = CATALOG.get_or_create_study(study_meta)
+        folder_name = study['folder']
+    except Exception as e:
+        print(f"⚠ Erro ao registrar estudo: {e}")
     
-    # Fallback se não conseguir ler metadados
+    # Fallback se não conseguir registrar o estudo
     if not folder_name:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         folder_name = f"{timestamp}_UNKNOWN"
@@ -230,34 +128,190 @@ def get_or_create_study_folder(filepath):
     
     return dest_folder, study_uid
 
-def update_study_status(folder_name, sent_success):
-    """Atualiza status de envio do estudo"""
-    status = load_send_status()
+def update_study_status(folder_name, study_uid, results):
+    """
+    Atualiza status de envio do estudo (.send_status.json do dashboard)
+    `results`: lista de (arquivo, ok, mensagem), um item por instância;
+    as contagens vêm das entregas do estudo no catálogo
+    """
+    send_status.update_study_status(WATCH_FOLDER, folder_name, results,
+                                    CATALOG.delivery_counts(study_uid))
+
+def prepare_summary(summary):
+    """
+    A partir do resumo do cabeçalho (lido uma vez, no pool de processos):
+    quarentena se inválido, senão roteia e determina a pasta do estudo
+    Retorna (arquivo, pasta_destino, study_uid, instância) ou None se foi para quarentena
+    `instância` traz SOP Class/Transfer Syntax para o envio sem reler o arquivo
+    e `deliveries` com os destinos casados pelas regras
+    """
+    filepath = Path(summary['path'])
+    # Trava de integridade: nao processa imagem DICOM sem pixels.
+    if not summary['ok']:
+        print(f"❌ Arquivo DICOM inválido: {filepath.name} ({summary['reason']})")
+        try:
+            quarantine_invalid_dicom(str(filepath), summary['reason'])
+        except Exception as e:
+            print(f"⚠ Falha ao mover para quarentena {filepath.name}: {e}")
+        return None
     
-    if folder_name not in status:
-        status[folder_name] = {
-            'status': 'pendente',
-            'sent_count': 0,
-            'failed_count': 0,
-            'total_count': 0,
-            'last_update': ''
-        }
+    dest_folder, study_uid = get_or_create_study_folder(summary['study'])
+    instance = dict(summary['instance'])
+    instance['deliveries'] = {name: SEND_PENDING for name in ROUTER.route(summary['tags'])}
+    # Recepção = gravação do arquivo na raiz (o rename da reserva preserva o mtime)
+    try:
+        instance['received_epoch'] = filepath.stat().st_mtime
+    except OSError:
+        pass
+    return filepath, dest_folder, study_uid, instance
+
+def prepare_file(filepath):
+    """Lê o cabeçalho no próprio processo e prepara o arquivo (ver prepare_summary)"""
+    return prepare_summary(summarize_dicom_file(filepath, ROUTER.keywords))
+
+def organize_file(filepath, dest_folder):
+    """Move arquivo para a pasta do estudo sem sobrescrever; retorna o destino"""
+    dest_path = dest_folder / filepath.name
+    counter = 1
+    while dest_path.exists():
+        dest_path = dest_folder / f"{filepath.stem}_{counter}{filepath.suffix}"
+        counter += 1
+    shutil.move(str(filepath), str(dest_path))
+    return dest_path
+
+def ingest_study_batch(entries):
+    """
+    Organiza arquivos da raiz na pasta do estudo e enfileira uma entrega por
+    destino roteado (uma transação por lote); o envio sai da fila do catálogo
+    `entries`: lista de (arquivo, pasta_destino, study_uid, instância) do mesmo estudo
+    Retorna a quantidade de instâncias registradas
+    """
+    _, dest_folder, study_uid, _ = entries[0]
+    folder_name = dest_folder.name
+    organized = []
+    for filepath, _, _, instance in entries:
+        try:
+            dest_path = organize_file(filepath, dest_folder)
+            print(f"📁 Organizado: {folder_name}/{dest_path.name}")
+            if not instance['deliveries']:
+                print(f"⚠ Nenhuma regra de roteamento casou: {dest_path.name}")
+            organized.append({
+                **instance,
+                'filename': dest_path.name,
+                'size_bytes': dest_path.stat().st_size,
+            })
+        except Exception as e:
+            print(f"⚠ Erro ao organizar {filepath.name}: {e}")
     
-    status[folder_name]['total_count'] += 1
-    if sent_success:
-        status[folder_name]['sent_count'] += 1
-        status[folder_name]['status'] = 'enviado'
-    else:
-        status[folder_name]['failed_count'] += 1
-        status[folder_name]['status'] = 'falha'
+    try:
+        if study_uid and organized:
+            CATALOG.record_instances(study_uid, organized)
+    except Exception as e:
+        print(f"⚠ Erro ao registrar instâncias de {folder_name}: {e}")
+    return len(organized)
+
+def delivery_label(filename, destination):
+    """Nome usado no .send_status.json (destino só quando não é o padrão)"""
+    return filename if destination == DEFAULT_DESTINATION else f"{filename} → {destination}"
+
+def send_deliveries(rows):
+    """
+    Envia a um destino instâncias já gravadas na pasta do estudo
+    `rows`: entregas reservadas no catálogo (mesmo estudo e destino), com `folder`
+    Retorna lista de (arquivo, ok, mensagem)
+    """
+    folder_name = rows[0]['folder']
+    destination = rows[0]['destination']
+    study_folder = WATCH_FOLDER / folder_name
+    items = [
+        (study_folder / row['filename'], row['sop_class_uid'], row['transfer_syntax'])
+        for row in rows
+    ]
+
+    target = ROUTER.destinations.get(destination)
+    if target is None:
+        return [(path, False, f"destino '{destination}' não configurado") for path, _, _ in items]
+    print(f"📤 Enviando estudo {folder_name} → {destination}: {len(items)} arquivo(s)")
+    return send_transcoded(target, items)
+
+def commit_deliveries(rows, results):
+    """
+    Grava o resultado do envio no catálogo e no .send_status.json
+    Falhas voltam para a fila com backoff exponencial
+    """
+    folder_name = rows[0]['folder']
+    study_uid = rows[0]['study_uid']
+    destination = rows[0]['destination']
+    sent_states = {}
+    errors = {}
+    status_results = []
+    now = time.time()
+    for row, (filepath, send_success, message) in zip(rows, results):
+        key = (row['sop_instance_uid'], destination)
+        label = delivery_label(filepath.name, destination)
+        if row['attempts']:
+            SEND_RETRIES.inc(destination=destination)
+        if send_success:
+            print(f"✅ Enviado: {label}")
+            # Instâncias de catálogos antigos (sem o epoch) ficam fora do histograma
+            if row['received_epoch'] is not None:
+                END_TO_END_SECONDS.observe(max(0.0, now - row['received_epoch']),
+                                           destination=destination)
+        else:
+            SEND_FAILURES.inc(destination=destination)
+            print(f"❌ Erro ao enviar {label}: {message} "
+                  f"(tentativa {row['attempts'] + 1}, reenvio agendado)")
+            errors[key] = message
+        sent_states[key] = send_success
+        status_results.append((label, send_success, message))
     
-    status[folder_name]['last_update'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    save_send_status(status)
+    try:
+        CATALOG.mark_deliveries(study_uid, sent_states, errors)
+        update_study_status(folder_name, study_uid, status_results)
+    except Exception as e:
+        print(f"⚠ Erro ao atualizar status de {folder_name}: {e}")
+
+def send_transcoded(target, items):
+    """Envia ao destino recodificando o que ele aceitar; soma as estatísticas"""
+    pool = get_pool(target.host, target.port, target.aet, target.name)
+    try:
+        results, stats = TRANSCODER.send(pool, target, items)
+    except Exception as e:
+        return [(path, False, f"exceção no envio: {e}") for path, _, _ in items]
+    if stats['files']:
+        print(f"🗜 Transcodificados para {target.name}: {format_stats(stats)}")
+    try:
+        CATALOG.add_transcode_stats(target.name, stats)
+    except Exception as e:
+        print(f"⚠ Erro ao registrar estatísticas de transcodificação: {e}")
+    return results
+
+def group_deliveries(rows):
+    """Agrupa entregas reservadas por destino e estudo (um lote por associação)"""
+    batches = {}
+    for row in rows:
+        batches.setdefault((row['destination'], row['study_uid']), []).append(row)
+    return list(batches.values())
+
+def resume_after_outage(destination):
+    """Destino voltou (C-ECHO ok): drena já a fila de reenvio dele"""
+    rescheduled = CATALOG.reschedule_failed(destination)
+    if rescheduled:
+        print(f"🔁 Destino {destination} disponível: {rescheduled} entrega(s) voltam para envio")
+
+def destination_breakers():
+    """Disjuntor de cada destino configurado (avisa o SCU quando o destino volta)"""
+    breakers = {}
+    for name, target in ROUTER.destinations.items():
+        breaker = get_pool(target.host, target.port, target.aet, target.name).breaker
+        breaker.add_listener(partial(resume_after_outage, name))
+        breakers[name] = breaker
+    return breakers
 
 def send_and_organize(file_path):
     """
-    Envia arquivo DICOM e depois organiza na pasta correta
-    Retorna True se sucesso, False se falha
+    Organiza arquivo DICOM na pasta correta e o coloca na fila de envio
+    Retorna True se entrou na fila, False se falha
     """
     filepath = Path(file_path)
     
@@ -265,110 +319,272 @@ def send_and_organize(file_path):
         print(f"⚠ Arquivo não encontrado: {file_path}")
         return False
     
-    print(f"📤 Enviando: {filepath.name}")
-
-    # Trava de integridade: nao processa imagem DICOM sem pixels.
-    ok_pixels, reason = validate_image_dicom_has_pixels(str(filepath))
-    if not ok_pixels:
-        print(f"❌ Arquivo DICOM inválido: {filepath.name} ({reason})")
-        try:
-            quarantine_invalid_dicom(str(filepath), reason)
-        except Exception as e:
-            print(f"⚠ Falha ao mover para quarentena {filepath.name}: {e}")
+    claimed = claim_file(filepath)
+    if not claimed:
         return False
     
-    # Primeiro, determina a pasta de destino
-    dest_folder, study_uid = get_or_create_study_folder(str(filepath))
-    folder_name = dest_folder.name
+    prepared = prepare_file(claimed)
+    if not prepared:
+        return False
     
-    # Envia para o ZeroClick
-    send_success = False
+    return ingest_study_batch([prepared]) == 1
+
+def claim_file(filepath):
+    """
+    Reserva o arquivo para um worker com rename atômico para CLAIM_FOLDER.
+    Só um processo/thread consegue renomear: nenhuma instância é enviada duas vezes.
+    Retorna o novo caminho, ou None se outro já reservou.
+    """
+    claimed = CLAIM_FOLDER / filepath.name
+    if claimed.exists():
+        return None  # Mesmo nome ainda em envio; tenta no próximo ciclo
     try:
-        result = subprocess.run([
-            "gdcmscu", "--store", 
-            "-H", TARGET_HOST, 
-            "-p", TARGET_PORT, 
-            "--call", TARGET_AET, 
-            "-i", str(filepath)
-        ], check=True, text=True, capture_output=True, timeout=30)
-        
-        print(f"✅ Enviado: {filepath.name}")
-        send_success = True
-        
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Erro ao enviar {filepath.name}: {e.stderr}")
-    except subprocess.TimeoutExpired:
-        print(f"⏱ Timeout ao enviar {filepath.name}")
-    except Exception as e:
-        print(f"❌ Exceção ao enviar {filepath.name}: {e}")
-    
-    # Move para pasta organizada (mesmo se falhou o envio, para não perder)
+        os.rename(filepath, claimed)
+    except FileNotFoundError:
+        return None
+    return claimed
+
+def unclaim_file(filepath):
+    """Devolve à raiz um arquivo reservado; retorna o novo caminho"""
+    dest = WATCH_FOLDER / filepath.name
+    counter = 1
+    # Chegou outro arquivo com o mesmo nome: volta com sufixo (os dois são enviados)
+    while dest.exists():
+        dest = WATCH_FOLDER / f"{filepath.stem}_{counter}{filepath.suffix}"
+        counter += 1
+    os.rename(filepath, dest)
+    if dest.name != filepath.name:
+        print(f"⚠ {filepath.name} já existe na raiz: recuperado como {dest.name}")
+    return dest
+
+def recover_claimed_files():
+    """Devolve à raiz arquivos reservados por uma execução interrompida"""
+    CLAIM_FOLDER.mkdir(parents=True, exist_ok=True)
+    for filepath in CLAIM_FOLDER.glob("*.dcm"):
+        dest = unclaim_file(filepath)
+        print(f"↩ Recuperado para reenvio: {dest.name}")
+
+def unclaim_paths(paths, error):
+    """
+    on_error do classify/route: os arquivos do lote ainda reservados voltam à
+    raiz e o watcher os descobre de novo
+    """
+    for path in map(Path, paths):
+        if path.parent != CLAIM_FOLDER or not path.exists():
+            continue  # Já organizado na pasta do estudo
+        try:
+            dest = unclaim_file(path)
+            print(f"↩ Devolvido à raiz após erro: {dest.name}")
+        except OSError as e:
+            print(f"⚠ Falha ao devolver {path.name} à raiz: {e}")
+
+def unclaim_summaries(summaries, error):
+    """on_error do route: ver unclaim_paths"""
+    unclaim_paths([summary['path'] for summary in summaries], error)
+
+def release_deliveries(rows, error):
+    """on_error do send/commit: as entregas reservadas do lote voltam a pendentes"""
+    CATALOG.mark_deliveries(rows[0]['study_uid'], {
+        (row['sop_instance_uid'], row['destination']): SEND_PENDING for row in rows
+    })
+    print(f"↩ {len(rows)} entrega(s) de {rows[0]['folder']} devolvida(s) à fila após erro")
+
+def group_by_study(prepared_entries):
+    """Agrupa arquivos preparados por pasta de estudo (StudyInstanceUID)"""
+    batches = {}
+    for prepared in prepared_entries:
+        if prepared:
+            batches.setdefault(prepared[1], []).append(prepared)
+    return list(batches.values())
+
+def split_batches(entries, size=SCU_BATCH_SIZE):
+    """Quebra um estudo grande em lotes para usar várias associações em paralelo"""
+    return [entries[i:i + size] for i in range(0, len(entries), size)]
+
+def discover_root_files(watcher, free_slots):
+    """
+    Estágio discover: arquivos .dcm novos na raiz (não em subpastas), em rajada,
+    reservados com rename atômico. Sem espera: pela convenção de spool só
+    chegam arquivos completos. Retorna lotes de caminhos reservados
+    """
+    root_files = watcher.get_batch(timeout=1.0, max_items=free_slots * SCU_BATCH_SIZE)
+    now = time.time()
+    claimed = []
+    for filepath in root_files:
+        try:
+            written = filepath.stat().st_mtime
+        except OSError:
+            continue
+        path = claim_file(filepath)
+        if path:
+            claimed.append(path)
+            DISCOVER_SECONDS.observe(max(0.0, now - written))
+    return split_batches(claimed)
+
+def classify_files(paths):
+    """
+    Estágio classify: leitura e validação do cabeçalho em todos os núcleos;
+    voltam só resumos (estudo, instância, tags das regras), sem Dataset
+    """
+    summaries = HEADER_PARSER.map(paths, ROUTER.keywords)
+    for summary in summaries:
+        VALIDATE_SECONDS.observe(summary['seconds'])
+    return [summaries]
+
+def route_files(claim_source, summaries):
+    """
+    Estágio route: quarentena dos inválidos, roteamento pelas regras,
+    organização na pasta do estudo e uma entrega por destino no catálogo
+    """
+    prepared = [prepare_summary(summary) for summary in summaries]
+    for entries in group_by_study(prepared):
+        ingest_study_batch(entries)
+    # Entregas novas: o claim não espera o próximo ciclo
+    claim_source.wake()
+
+def claim_deliveries(breakers, free_slots):
+    """
+    Estágio claim: entregas pendentes (raiz, SCP nativo) e falhas cujo reenvio
+    venceu, exceto de destinos com disjuntor aberto. Contrapressão: só reserva
+    o que cabe na fila de envio. Um lote por destino e estudo (ou fatia de
+    estudo grande)
+    """
+    unavailable = [name for name, breaker in breakers.items() if not breaker.allow()]
+    if len(unavailable) == len(breakers):
+        return []
+    pending = CATALOG.claim_pending_deliveries(
+        limit=free_slots * SCU_BATCH_SIZE, exclude_destinations=unavailable,
+    )
+    return [batch for rows in group_deliveries(pending) for batch in split_batches(rows)]
+
+def send_batch(rows):
+    """Estágio send: um lote por associação (o pool limita por destino)"""
+    return [(rows, send_deliveries(rows))]
+
+def commit_batch(sent):
+    """Estágio commit: resultado no catálogo e no .send_status.json"""
+    commit_deliveries(*sent)
+
+def release_committed(sent, error):
+    """on_error do commit: sem o resultado gravado, o lote volta à fila (ver release_deliveries)"""
+    release_deliveries(sent[0], error)
+
+def collect_delivery_backlog():
+    """Entregas pendentes, em envio e aguardando reenvio, por destino"""
+    counts = CATALOG.delivery_backlog()
+    for name in ROUTER.destinations:
+        for state, label in DELIVERY_STATES.items():
+            DELIVERY_BACKLOG.set(counts.pop((name, state), 0), destination=name, state=label)
+    # Destinos que saíram das regras mas ainda têm entregas
+    for (name, state), total in counts.items():
+        DELIVERY_BACKLOG.set(total, destination=name, state=DELIVERY_STATES.get(state, str(state)))
+
+def scan_previews(free_slots):
+    """
+    Fonte preview_scan: séries que pararam de receber instâncias há
+    PREVIEW_SETTLE s e têm imagens fora da prévia (SCU e SCP nativo)
+    """
+    series = CATALOG.pending_previews(PREVIEW_SETTLE, limit=free_slots,
+                                      exclude=list(PREVIEWS_IN_FLIGHT))
+    PREVIEWS_IN_FLIGHT.update(row['series_uid'] for row in series)
+    return series
+
+def build_preview(series):
+    """Estágio preview: gera a prévia da série num processo de baixa prioridade"""
+    series_uid = series['series_uid']
     try:
-        dest_path = dest_folder / filepath.name
-        
-        # Evita sobrescrever
-        counter = 1
-        while dest_path.exists():
-            dest_path = dest_folder / f"{filepath.stem}_{counter}{filepath.suffix}"
-            counter += 1
-        
-        shutil.move(str(filepath), str(dest_path))
-        print(f"📁 Organizado: {folder_name}/{dest_path.name}")
-        
-        # Atualiza contador de imagens nos metadados
-        if study_uid:
-            metadata = load_metadata()
-            if study_uid in metadata:
-                metadata[study_uid]['image_count'] += 1
-                metadata[study_uid]['sent'] = send_success
-                save_metadata(metadata)
-        
-        # Atualiza status de envio
-        update_study_status(folder_name, send_success)
-        
-    except Exception as e:
-        print(f"⚠ Erro ao organizar {filepath.name}: {e}")
-    
-    return send_success
+        entry = CATALOG.series_entry(series_uid)
+        path, seconds = PREVIEWS.build(WATCH_FOLDER / series['folder'], series, entry) \
+            if entry else (None, 0.0)
+        if path:
+            print(f"🖼 Prévia: {series['folder']} série {series.get('series_number') or '?'} "
+                  f"({sum(entry['frame_counts'])} imagens, {seconds:.1f}s)")
+        # Sem imagem (SR, falha de leitura): não tenta de novo até chegar instância nova
+        CATALOG.mark_preview(series_uid, series['image_count'])
+    finally:
+        PREVIEWS_IN_FLIGHT.discard(series_uid)
+
+def build_pipeline(watcher, breakers):
+    """
+    discover → classify → route ⇢ claim → send → commit
+    O route grava as entregas no catálogo e acorda o claim, que também
+    recolhe o que o SCP nativo gravou e os reenvios vencidos.
+    À parte, preview_scan → preview gera as miniaturas por série, sem
+    dividir fila com o envio
+    """
+    claim = Source("claim", partial(claim_deliveries, breakers), idle_wait=1.0)
+    discover = Source("discover", partial(discover_root_files, watcher), idle_wait=0)
+    # Com erro num lote, on_error devolve os arquivos à raiz / as entregas à fila
+    classify = Stage("classify", classify_files, PIPELINE_CLASSIFY_CONCURRENCY, PIPELINE_QUEUE_SIZE,
+                     on_error=unclaim_paths)
+    route = Stage("route", partial(route_files, claim), PIPELINE_ROUTE_CONCURRENCY, PIPELINE_QUEUE_SIZE,
+                  on_error=unclaim_summaries)
+    send = Stage("send", send_batch, SCU_WORKERS, SEND_QUEUE_SIZE, on_error=release_deliveries)
+    commit = Stage("commit", commit_batch, PIPELINE_COMMIT_CONCURRENCY, PIPELINE_QUEUE_SIZE,
+                   on_error=release_committed)
+    discover.to(classify).to(route)
+    claim.to(send).to(commit)
+    nodes = [discover, classify, route, claim, send, commit]
+    if PREVIEWS.enabled:
+        preview_scan = Source("preview_scan", scan_previews, idle_wait=PREVIEW_SETTLE / 2)
+        preview = Stage("preview", build_preview, PREVIEWS.workers, queue_size=1)
+        preview_scan.to(preview)
+        nodes += [preview_scan, preview]
+    return Pipeline(nodes, stats_root=WATCH_FOLDER)
+
+async def run_pipeline(watcher, breakers):
+    """Executa o pipeline até SIGTERM/SIGINT; encerra drenando os estágios"""
+    pipeline = build_pipeline(watcher, breakers)
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, pipeline.stop)
+    await pipeline.run()
 
 def monitor_folder():
-    """Monitora pasta raiz para novos arquivos .dcm"""
+    """Monitora a pasta raiz e as pendências do catálogo e envia em lotes por estudo"""
     print("=" * 60)
     print("DICOM SCU - Monitor de Envio")
     print(f"Pasta: {WATCH_FOLDER}")
-    print(f"Destino: {TARGET_HOST}:{TARGET_PORT} (AET: {TARGET_AET})")
+    for dest in ROUTER.destinations.values():
+        transcode = f" | transcodifica: {', '.join(syntax_names(dest.transcode))}" if dest.transcode else ""
+        print(f"Destino {dest.name}: {dest.host}:{dest.port} (AET: {dest.aet}){transcode}")
+    print(ROUTER.describe())
+    print(f"Envio: {SCU_WORKERS} worker(s) | Lote máximo: {SCU_BATCH_SIZE} | "
+          f"Fila de envio: {SEND_QUEUE_SIZE} lote(s) | Leitura: {HEADER_PARSER.workers} processo(s)")
+    print(f"Pipeline: classify {PIPELINE_CLASSIFY_CONCURRENCY} | route {PIPELINE_ROUTE_CONCURRENCY} | "
+          f"commit {PIPELINE_COMMIT_CONCURRENCY} | filas {PIPELINE_QUEUE_SIZE} lote(s)")
     print("=" * 60)
-    
-    processing = set()  # Arquivos sendo processados
-    
-    while True:
-        try:
-            # Procura arquivos .dcm na raiz (não em subpastas)
-            root_files = list(WATCH_FOLDER.glob("*.dcm"))
-            
-            for filepath in root_files:
-                if filepath.is_file() and str(filepath) not in processing:
-                    processing.add(str(filepath))
-                    
-                    # Aguarda um pouco para garantir que o arquivo foi completamente escrito
-                    time.sleep(0.5)
-                    
-                    # Verifica se arquivo ainda existe (pode ter sido movido)
-                    if filepath.exists():
-                        send_and_organize(str(filepath))
-                    
-                    processing.discard(str(filepath))
-            
-            # Aguarda antes de verificar novamente
-            time.sleep(2)
-            
-        except KeyboardInterrupt:
-            print("\n⚠ Encerrando monitor...")
-            break
-        except Exception as e:
-            print(f"❌ Erro no monitor: {e}")
-            time.sleep(5)
+
+    recover_claimed_files()
+    TRANSCODER.cleanup_stale()
+    released = CATALOG.release_claimed_deliveries()
+    if released:
+        print(f"↩ {released} entrega(s) do catálogo devolvida(s) para reenvio")
+    backlog = CATALOG.retry_backlog()
+    if backlog['total']:
+        print(f"🔁 Fila de reenvio: {backlog['total']} entrega(s) com falha agendada(s)")
+    # Disjuntor por destino: com ele aberto as entregas daquele destino
+    # esperam o C-ECHO, sem segurar as dos demais
+    breakers = destination_breakers()
+    # Eventos inotify (IN_CLOSE_WRITE/IN_MOVED_TO) na raiz alimentam o discover
+    watcher = FolderWatcher(WATCH_FOLDER).start()
+    add_collector(collect_delivery_backlog)
+    start_metrics_server()
+
+    try:
+        asyncio.run(run_pipeline(watcher, breakers))
+    finally:
+        # Tudo que entrou no pipeline já foi enviado e gravado; o que ficou na
+        # raiz ou pendente no catálogo é retomado na próxima execução
+        watcher.stop()
+        HEADER_PARSER.shutdown()
+        TRANSCODER.shutdown()
+        PREVIEWS.shutdown()
+        # Associações têm threads não-daemon: o atexit chegaria tarde demais
+        close_all_pools()
+        print("✅ Monitor encerrado")
 
 if __name__ == "__main__":
     WATCH_FOLDER.mkdir(parents=True, exist_ok=True)
+    CLAIM_FOLDER.mkdir(parents=True, exist_ok=True)
     monitor_folder()
@@ -1,8 +1,9 @@
 import os
-import subprocess
 import time
 from pathlib import Path
-import json
+
+from dicom_sender import send_dicom_batch
+from study_catalog import StudyCatalog
 
 # Configurações do destino
 TARGET_HOST = os.getenv("TARGET_HOST", "192.168.10.16")
@@ -11,43 +12,7 @@ TARGET_AET = os.getenv("TARGET_AET", "ZEROCLICK")
 
 # Diretório a ser monitorado
 WATCH_FOLDER = Path("/home/dicom")
-METADATA_FILE = WATCH_FOLDER / ".metadata.json"
-
-def load_metadata():
-    """Carrega metadados dos estudos"""
-    if METADATA_FILE.exists():
-        with open(METADATA_FILE, 'r') as f:
-            return json.load(f)
-    return {}
-
-def save_metadata(metadata):
-    """Salva metadados"""
-    with open(METADATA_FILE, 'w') as f:
-        json.dump(metadata, f, indent=2)
-
-def send_dicom(file_path):
-    """Envia um arquivo DICOM"""
-    print(f"📤 Enviando: {file_path}")
-    try:
-        result = subprocess.run([
-            "gdcmscu", 
-            "--verbose", 
-            "--store", 
-            TARGET_HOST, 
-            TARGET_PORT, 
-            "--call", 
-            TARGET_AET, 
-            file_path
-        ], check=True, text=True, capture_output=True, timeout=30)
-        
-        print(f"✓ Enviado: {file_path}")
-        return True
-    except subprocess.TimeoutExpired:
-        print(f"✗ Timeout ao enviar: {file_path}")
-        return False
-    except subprocess.CalledProcessError as e:
-        print(f"✗ Erro ao enviar {file_path}: {e.stderr}")
-        return False
+CATALOG = StudyCatalog(WATCH_FOLDER)
 
 def process_study_folder(folder_path):
     """
@@ -65,14 +30,19 @@ def process_study_folder(folder_path):
     success_count = 0
     failed_files = []
     
-    for dcm_file in dcm_files:
-        if send_dicom(str(dcm_file)):
+    # Estudo inteiro numa única associação (contextos negociados uma vez)
+    results = send_dicom_batch(dcm_files, TARGET_HOST, TARGET_PORT, TARGET_AET)
+    
+    for dcm_file, sent, message in results:
+        if sent:
+            print(f"✓ Enviado: {dcm_file}")
             try:
                 dcm_file.unlink()  # Deleta arquivo após envio
                 success_count += 1
             except Exception as e:
                 print(f"✗ Erro ao deletar {dcm_file}: {e}")
         else:
+            print(f"✗ Erro ao enviar {dcm_file}: {message}")
             failed_files.append(dcm_file.name)
     
     print(f"   ✓ Enviados: {success_count}/{len(dcm_files)}")
@@ -80,13 +50,10 @@ def process_study_folder(folder_path):
     # Se todos foram enviados, deleta a pasta
     if success_count == len(dcm_files):
         try:
-            # Atualiza metadados antes de deletar
-            metadata = load_metadata()
-            for study_uid, study_data in metadata.items():
-                if study_data.get('folder') == folder_path.name:
-                    study_data['sent'] = True
-                    study_data['sent_at'] = time.strftime("%Y%m%d_%H%M%S")
-            save_metadata(metadata)
+            # Atualiza catálogo antes de deletar
+            study = CATALOG.get_study_by_folder(folder_path.name)
+            if study:
+                CATALOG.mark_study_sent(study['study_uid'], True)
             
             # Remove pasta vazia
             folder_path.rmdir()